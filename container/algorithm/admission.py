@@ -0,0 +1,117 @@
+# Admission control for the inference server. Every gunicorn worker admits a bounded amount of work
+# to /invocations: a number of requests and a number of CSV rows in flight. Requests that would go
+# over the budget, or that already waited longer than the queue time budget before the worker got to
+# them, are answered right away with a 503 and a Retry-After header instead of adding to the backlog.
+# A client (or SageMaker) retrying a fast 503 keeps the latency of the admitted requests bounded,
+# where an unbounded queue makes every request slow once the server is overloaded.
+#
+# The queue time is measured from the X-Request-Start header that nginx sets when it proxies the
+# request to gunicorn (see nginx.conf) to the time the worker picks the request up, so it covers the
+# gunicorn backlog and the worker's own queue. The time nginx spent reading the request is not included.
+#
+# We set the following parameters:
+#
+# Parameter                  Environment Variable               Default Value
+# ---------                  --------------------               -------------
+# requests in flight         MODEL_SERVER_MAX_IN_FLIGHT         4 per worker
+# rows in flight             MODEL_SERVER_MAX_ROWS_IN_FLIGHT    100000 per worker
+# queue time budget          MODEL_SERVER_MAX_QUEUE_SECONDS     1 second
+# Retry-After header         MODEL_SERVER_RETRY_AFTER_SECONDS   1 second
+
+from __future__ import print_function
+
+import os
+import time
+import threading
+
+max_in_flight = int(os.environ.get('MODEL_SERVER_MAX_IN_FLIGHT', 4))
+max_rows_in_flight = int(os.environ.get('MODEL_SERVER_MAX_ROWS_IN_FLIGHT', 100000))
+max_queue_seconds = float(os.environ.get('MODEL_SERVER_MAX_QUEUE_SECONDS', 1))
+retry_after_seconds = int(os.environ.get('MODEL_SERVER_RETRY_AFTER_SECONDS', 1))
+
+def parse_queue_seconds(request_start, now=None):
+    """Get the time a request waited before it was handled
+
+    Arguments:
+        request_start {string} -- the X-Request-Start header, "t=<seconds since the epoch>"
+
+    Keyword Arguments:
+        now {float} -- the current time (default: {None}, the current time)
+
+    Returns:
+        float -- the seconds since nginx proxied the request, or 0 if the header is missing or invalid
+    """
+    if not request_start:
+        return 0.0
+    try:
+        start = float(request_start[2:] if request_start.startswith('t=') else request_start)
+    except ValueError:
+        return 0.0
+    return max((now or time.time()) - start, 0.0)
+
+def count_rows(payload):
+    """Count the rows of a CSV payload without parsing it"""
+    rows = payload.count(b'\n')
+    if payload and not payload.endswith(b'\n'):
+        rows += 1
+    return rows
+
+class AdmissionController(object):
+    def __init__(self, max_in_flight=max_in_flight, max_rows_in_flight=max_rows_in_flight, max_queue_seconds=max_queue_seconds):
+        """Keeps the work in flight in a worker within a budget
+
+        Keyword Arguments:
+            max_in_flight {int} -- the number of requests in flight (default: {max_in_flight})
+            max_rows_in_flight {int} -- the number of rows in flight. A request with more rows is only
+                admitted when nothing else is in flight (default: {max_rows_in_flight})
+            max_queue_seconds {float} -- requests that waited longer than this are rejected, their
+                client has most likely given up already (default: {max_queue_seconds})
+        """
+        self.max_in_flight = max_in_flight
+        self.max_rows_in_flight = max_rows_in_flight
+        self.max_queue_seconds = max_queue_seconds
+        self.in_flight = 0
+        self.rows_in_flight = 0
+        self.admitted = 0
+        self.rejected = {'in_flight': 0, 'rows': 0, 'queue_time': 0}
+        self.__lock = threading.Lock()
+
+    def try_acquire(self, rows, queue_seconds):
+        """Admit a request if it fits in the budget. Call release when an admitted request is done.
+
+        Arguments:
+            rows {int} -- the number of rows in the request
+            queue_seconds {float} -- the time the request waited before it got here
+
+        Returns:
+            string -- None if the request was admitted, or the reason it was rejected
+        """
+        with self.__lock:
+            if queue_seconds > self.max_queue_seconds:
+                reason = 'queue_time'
+            elif self.in_flight >= self.max_in_flight:
+                reason = 'in_flight'
+            elif self.in_flight > 0 and self.rows_in_flight + rows > self.max_rows_in_flight:
+                reason = 'rows'
+            else:
+                self.in_flight += 1
+                self.rows_in_flight += rows
+                self.admitted += 1
+                return None
+            self.rejected[reason] += 1
+            return reason
+
+    def release(self, rows):
+        """Release the budget of an admitted request"""
+        with self.__lock:
+            self.in_flight -= 1
+            self.rows_in_flight -= rows
+
+    def stats(self):
+        with self.__lock:
+            return {
+                'in_flight': self.in_flight,
+                'rows_in_flight': self.rows_in_flight,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected)
+            }
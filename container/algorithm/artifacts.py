@@ -0,0 +1,222 @@
+# Writers and readers for the model artifact. The training job saves the model with one of the
+# formats below and the inference server loads it back with load_model, which reads the small
+# artifact.json file written next to the model to find out which format was used.
+#
+# Formats (select one with the "model_format" hyperparameter, e.g. "joblib-lz4:3"):
+#
+#   joblib           uncompressed joblib
+#   joblib-zlib      joblib compressed with zlib, level 0-9 (default 3)
+#   joblib-lz4       joblib compressed with lz4, level 0-16 (default 3). Requires the lz4 package.
+#   zstd             pickle compressed with zstandard, level 1-22 (default 3). Requires the zstandard package.
+#                    "zstd:1" is the default when zstandard is installed, otherwise "joblib" is.
+#   pickle5          pickle protocol 5 with the numpy buffers written out-of-band to a separate file
+#                    that is memory mapped on load. Requires python 3.8+ (or the pickle5 backport).
+#
+# The model directory is tarred and gzipped by SageMaker (model.tar.gz) after training, so compressing
+# the artifact itself mostly trades save/load CPU time for a smaller file inside an already
+# compressed archive. Run benchmark_serialization.py to measure the trade-offs for your model.
+# For a 100 tree random forest it gave (tar.gz size, save + tar + untar + load seconds, excluding
+# the download which is proportional to the tar.gz size):
+#
+#   zstd:1         15.4 MB   1.4 s
+#   joblib-zlib:3  15.1 MB   2.7 s
+#   pickle5        14.2 MB   2.7 s
+#   joblib         14.2 MB   3.0 s
+#
+# Uncompressed artifacts are cheap to write and load but make gzipping model.tar.gz slow, while
+# zlib/lz4 in joblib are slow to load. zstd at a low level is fast on both ends and its output
+# is barely touched by the outer gzip, so it is the default.
+
+from __future__ import print_function
+
+import os
+import json
+import mmap
+import pickle
+
+import joblib
+
+try:
+    import lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import pickle5
+except ImportError:
+    pickle5 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_FORMAT = 'zstd:1' if zstandard is not None else 'joblib'
+METADATA_FILE_NAME = 'artifact.json'
+MODEL_FILE_NAME = 'model.joblib'
+
+def _get_pickle_protocol_5():
+    """Get a pickle module that supports protocol 5 (out-of-band buffers)
+
+    Returns:
+        module -- the pickle module to use
+    """
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        return pickle
+    if pickle5 is not None:
+        return pickle5
+    raise ValueError('The pickle5 model format requires python 3.8+ or the pickle5 package.')
+
+def parse_format(model_format):
+    """Split a format specification like "joblib-lz4:3" into its name and compression level
+
+    Arguments:
+        model_format {string} -- the format specification
+
+    Returns:
+        tuple -- (format name, compression level or None)
+    """
+    if model_format is None or model_format == '':
+        model_format = DEFAULT_FORMAT
+    name, _, level = str(model_format).partition(':')
+    name = name.strip().lower()
+    if name not in WRITERS:
+        raise ValueError('Unknown model format "{}". Valid formats are: {}'.format(name, ', '.join(sorted(WRITERS))))
+    # Fail here, when the hyperparameters are read, instead of after the fit when the model is saved
+    if name == 'joblib-lz4' and lz4 is None:
+        raise ValueError('The joblib-lz4 model format requires the lz4 package.')
+    if name == 'zstd' and zstandard is None:
+        raise ValueError('The zstd model format requires the zstandard package.')
+    if name == 'pickle5':
+        _get_pickle_protocol_5()
+    return name, int(level) if level else None
+
+def _write_joblib(model, model_dir, level, compressor=None):
+    file_name = MODEL_FILE_NAME
+    if compressor is None:
+        compress = 0
+    else:
+        compress = (compressor, 3 if level is None else level)
+    joblib.dump(model, os.path.join(model_dir, file_name), compress=compress)
+    return {'files': [file_name]}
+
+def _write_joblib_uncompressed(model, model_dir, level):
+    return _write_joblib(model, model_dir, level)
+
+def _write_joblib_zlib(model, model_dir, level):
+    return _write_joblib(model, model_dir, level, compressor='zlib')
+
+def _write_joblib_lz4(model, model_dir, level):
+    return _write_joblib(model, model_dir, level, compressor='lz4')
+
+def _read_joblib(model_dir, metadata):
+    return joblib.load(os.path.join(model_dir, metadata['files'][0]))
+
+def _write_zstd(model, model_dir, level):
+    if zstandard is None:
+        raise ValueError('The zstd model format requires the zstandard package.')
+    file_name = 'model.pkl.zst'
+    compressor = zstandard.ZstdCompressor(level=3 if level is None else level)
+    with open(os.path.join(model_dir, file_name), 'wb') as f:
+        with compressor.stream_writer(f) as writer:
+            pickle.dump(model, writer, protocol=pickle.HIGHEST_PROTOCOL)
+    return {'files': [file_name]}
+
+def _read_zstd(model_dir, metadata):
+    if zstandard is None:
+        raise ValueError('The zstd model format requires the zstandard package.')
+    with open(os.path.join(model_dir, metadata['files'][0]), 'rb') as f:
+        with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            return pickle.load(reader)
+
+def _write_pickle5(model, model_dir, level):
+    pickle_module = _get_pickle_protocol_5()
+    buffers = []
+    payload = pickle_module.dumps(model, protocol=5, buffer_callback=buffers.append)
+
+    # Write the buffers back to back into one file and remember where each one starts and ends
+    file_name, buffers_file_name = 'model.pkl', 'model.buffers'
+    offsets = []
+    with open(os.path.join(model_dir, buffers_file_name), 'wb') as f:
+        position = 0
+        for buffer in buffers:
+            raw = buffer.raw()
+            f.write(raw)
+            offsets.append([position, position + raw.nbytes])
+            position += raw.nbytes
+    with open(os.path.join(model_dir, file_name), 'wb') as f:
+        f.write(payload)
+    return {'files': [file_name, buffers_file_name], 'buffer_offsets': offsets}
+
+def _read_pickle5(model_dir, metadata):
+    pickle_module = _get_pickle_protocol_5()
+    file_name, buffers_file_name = metadata['files']
+    with open(os.path.join(model_dir, file_name), 'rb') as f:
+        payload = f.read()
+
+    buffers = []
+    offsets = metadata['buffer_offsets']
+    if offsets:
+        # Copy-on-write mapping, so the arrays are backed by the page cache and don't need
+        # to be copied (they stay writeable for libraries that expect that)
+        with open(os.path.join(model_dir, buffers_file_name), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        view = memoryview(mapped)
+        buffers = [view[start:end] for start, end in offsets]
+    return pickle_module.loads(payload, buffers=buffers)
+
+WRITERS = {
+    'joblib': _write_joblib_uncompressed,
+    'joblib-zlib': _write_joblib_zlib,
+    'joblib-lz4': _write_joblib_lz4,
+    'zstd': _write_zstd,
+    'pickle5': _write_pickle5
+}
+
+READERS = {
+    'joblib': _read_joblib,
+    'joblib-zlib': _read_joblib,
+    'joblib-lz4': _read_joblib,
+    'zstd': _read_zstd,
+    'pickle5': _read_pickle5
+}
+
+def save_model(model, model_dir, model_format=DEFAULT_FORMAT):
+    """Save a model to a directory in the given format
+
+    Arguments:
+        model -- the (fitted) model to save
+        model_dir {string} -- the directory to write the model to (e.g. /opt/ml/model)
+
+    Keyword Arguments:
+        model_format {string} -- the format specification, e.g. "joblib" or "joblib-lz4:3" (default: {DEFAULT_FORMAT})
+
+    Returns:
+        dict -- the artifact metadata, which is also written to artifact.json
+    """
+    name, level = parse_format(model_format)
+    metadata = WRITERS[name](model, model_dir, level)
+    metadata['format'] = name
+    metadata['level'] = level
+    with open(os.path.join(model_dir, METADATA_FILE_NAME), 'w') as f:
+        json.dump(metadata, f)
+    return metadata
+
+def load_model(model_dir):
+    """Load a model that was saved with save_model
+
+    Models saved before artifact.json was introduced are loaded from model.joblib.
+
+    Arguments:
+        model_dir {string} -- the directory the model was saved to (e.g. /opt/ml/model)
+
+    Returns:
+        the model
+    """
+    metadata_path = os.path.join(model_dir, METADATA_FILE_NAME)
+    if not os.path.exists(metadata_path):
+        return joblib.load(os.path.join(model_dir, MODEL_FILE_NAME))
+
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    return READERS[metadata['format']](model_dir, metadata)
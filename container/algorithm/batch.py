@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# Offline batch scoring with the trained model. Every CSV (or Parquet) file in the input channel is
+# split into chunks, the chunks are scored in parallel by a pool of worker processes and the
+# predictions for each chunk are written to their own shard in the output data directory:
+#
+#   /opt/ml/input/data/<channel>/<name>.csv  ->  /opt/ml/output/data/<name>.csv.part-00000.out, ...
+#
+# CSV files are split into byte ranges on line boundaries so that each worker reads and parses its
+# own chunk. The parent process only hands out offsets, which keeps memory bounded by the chunk size
+# times the number of workers and lets the throughput scale with the number of cores. The model is
+# loaded once with ScoringService before the workers are forked, so they share it.
+#
+# The input files have the same layout as the /invocations payload: no header and no label column.
+# Parquet files are scored one row group at a time and require the pyarrow package.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# input channel            BATCH_INPUT_CHANNEL               score
+# number of workers        BATCH_WORKERS                     the number of CPU cores
+# chunk size               BATCH_CHUNK_MB                    16 MB
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import traceback
+import multiprocessing
+
+import pandas as pd
+
+from predictor import ScoringService
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+prefix = '/opt/ml/'
+
+input_path = prefix + 'input/data'
+output_path = os.path.join(prefix, 'output')
+output_data_path = os.path.join(output_path, 'data')
+
+channel_name = os.environ.get('BATCH_INPUT_CHANNEL', 'score')
+scoring_path = os.path.join(input_path, channel_name)
+
+cpu_count = multiprocessing.cpu_count()
+
+batch_workers = int(os.environ.get('BATCH_WORKERS', cpu_count))
+batch_chunk_bytes = int(float(os.environ.get('BATCH_CHUNK_MB', 16)) * 1024 * 1024)
+
+def is_parquet(file_path):
+    return file_path.endswith('.parquet') or file_path.endswith('.parq')
+
+def csv_chunks(file_path, chunk_bytes):
+    """Split a CSV file into byte ranges that start and end on line boundaries
+
+    Arguments:
+        file_path {string} -- the CSV file
+        chunk_bytes {int} -- the approximate size of each chunk
+
+    Returns:
+        list -- a list of (start, end) byte offsets
+    """
+    size = os.path.getsize(file_path)
+    chunks = []
+    with open(file_path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            # Move the end of the chunk to the end of the current line
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def create_tasks(input_files, output_dir, chunk_bytes):
+    """Create the scoring tasks for all of the input files
+
+    Arguments:
+        input_files {list} -- the paths of the files to score
+        output_dir {string} -- where to write the prediction shards
+        chunk_bytes {int} -- the approximate size of each CSV chunk
+
+    Returns:
+        list -- a list of task tuples (file path, chunk, output path)
+    """
+    tasks = []
+    for file_path in input_files:
+        output_prefix = os.path.join(output_dir, os.path.basename(file_path))
+        if is_parquet(file_path):
+            if pq is None:
+                raise ValueError('Scoring {} requires the pyarrow package.'.format(file_path))
+            chunks = range(pq.ParquetFile(file_path).num_row_groups)
+        else:
+            chunks = csv_chunks(file_path, chunk_bytes)
+
+        for shard, chunk in enumerate(chunks):
+            tasks.append((file_path, chunk, '{}.part-{:05d}.out'.format(output_prefix, shard)))
+    return tasks
+
+def read_chunk(file_path, chunk):
+    """Read one chunk of an input file
+
+    Arguments:
+        file_path {string} -- the input file
+        chunk -- a (start, end) byte range for CSV files or a row group index for Parquet files
+
+    Returns:
+        pandas.DataFrame -- the data in the chunk
+    """
+    if is_parquet(file_path):
+        return pq.ParquetFile(file_path).read_row_group(chunk).to_pandas()
+
+    start, end = chunk
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # A chunk of blank lines (e.g. at the end of a file) has no rows, which read_csv rejects
+    if not data.strip():
+        return pd.DataFrame()
+    return pd.read_csv(io.BytesIO(data), header=None)
+
+def score_chunk(task):
+    """Score one chunk and write its predictions to a shard (runs in the worker processes)
+
+    Arguments:
+        task {tuple} -- (file path, chunk, output path)
+
+    Returns:
+        int -- the number of rows scored
+    """
+    file_path, chunk, shard_path = task
+    data = read_chunk(file_path, chunk)
+    predictions = ScoringService.predict(data) if len(data) > 0 else []
+
+    # Same format as the /invocations response: one prediction per line
+    with open(shard_path, 'w') as f:
+        f.write(''.join('{}\n'.format(x) for x in predictions))
+    return len(data)
+
+def score(input_dir, output_dir, workers=batch_workers, chunk_bytes=batch_chunk_bytes):
+    """Score every file in a directory
+
+    Arguments:
+        input_dir {string} -- the directory with the files to score
+        output_dir {string} -- the directory to write the prediction shards to
+
+    Keyword Arguments:
+        workers {int} -- the number of worker processes (default: {batch_workers})
+        chunk_bytes {int} -- the approximate size of each CSV chunk (default: {batch_chunk_bytes})
+
+    Returns:
+        dict -- a summary of the scoring run
+    """
+    input_files = sorted(
+        os.path.join(input_dir, x) for x in os.listdir(input_dir)
+        if os.path.isfile(os.path.join(input_dir, x))
+    )
+    if len(input_files) == 0:
+        raise ValueError(('There are no files in {}.\n' +
+                          'This usually indicates that the channel ({}) was incorrectly specified,\n' +
+                          'the data specification in S3 was incorrectly specified or the role specified\n' +
+                          'does not have permission to access the data.').format(input_dir, channel_name))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Load the model before forking so the workers share it instead of each loading a copy
+    ScoringService.get_model()
+
+    start = time.time()
+    tasks = create_tasks(input_files, output_dir, chunk_bytes)
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            rows = sum(pool.imap_unordered(score_chunk, tasks))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rows = sum(score_chunk(task) for task in tasks)
+    seconds = time.time() - start
+
+    return {
+        'files': len(input_files),
+        'shards': len(tasks),
+        'rows': rows,
+        'workers': workers,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds > 0 else 0.0
+    }
+
+def predict():
+    print('Starting the batch scoring.')
+    try:
+        summary = score(scoring_path, output_data_path)
+        print('::batch::rows::{}::'.format(summary['rows']))
+        print('::batch::rows_per_second::{:.2f}::'.format(summary['rows_per_second']))
+        with open(os.path.join(output_data_path, 'batch_summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        print('Batch scoring complete.')
+    except Exception as e:
+        trc = traceback.format_exc()
+        with open(os.path.join(output_path, 'failure'), 'w') as s:
+            s.write('Exception during batch scoring: ' + str(e) + '\n' + trc)
+        print('Exception during batch scoring: ' + str(e) + '\n' + trc, file=sys.stderr)
+        sys.exit(255)
+
+if __name__ == '__main__':
+    predict()
+
+    sys.exit(0)
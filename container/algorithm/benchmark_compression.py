@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# Benchmarks compressed request and response bodies for /invocations (see content_encoding.py). For
+# every request size and encoding, the client compresses the CSV payload, the server (the flask app
+# with the model in /opt/ml/model, in process) decompresses, scores and compresses the response, and
+# the client decompresses the response. The transfer time of both bodies is estimated from the given
+# bandwidth between the client and the endpoint, and the effective rows/s is the number of rows divided
+# by the sum of all of these. "max rows" is how many rows of this kind fit in a request within the
+# 5 MB request body limit of nginx.conf.
+#
+# The payload is random values with 6 decimals, which compress less than most real data.
+#
+# Usage:
+#   python benchmark_compression.py [--bandwidth 12.5] [--repeat 3]
+
+from __future__ import print_function
+
+import gzip
+import time
+import argparse
+
+import content_encoding
+import execution_parameters
+from predictor import app, ScoringService
+
+REQUEST_ROWS = [1000, 10000, 50000]
+MAX_REQUEST_BYTES = 5 * 1024 * 1024
+
+def compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=content_encoding.GZIP_LEVEL)
+    if encoding == 'zstd':
+        return content_encoding.zstandard.ZstdCompressor(level=content_encoding.ZSTD_LEVEL).compress(body)
+    return body
+
+def decompress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'zstd':
+        return content_encoding.zstandard.ZstdDecompressor().decompress(body)
+    return body
+
+def benchmark(client, payload, encoding, bandwidth, repeat):
+    """Send a payload with an encoding and measure the parts of the round trip
+
+    Arguments:
+        client -- the flask test client
+        payload {bytes} -- the CSV payload
+        encoding {string} -- 'identity', 'gzip' or 'zstd' for both the request and the response
+        bandwidth {float} -- the bandwidth between the client and the endpoint in MB/s
+        repeat {int} -- the number of requests (the fastest one is kept)
+
+    Returns:
+        dict -- the measurements
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        body = compress(payload, encoding)
+        client_seconds = time.time() - start
+
+        headers = {'Content-Type': 'text/csv', 'Accept-Encoding': encoding}
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        start = time.time()
+        response = client.post('/invocations', data=body, headers=headers)
+        server_seconds = time.time() - start
+        if response.status_code != 200:
+            raise RuntimeError('The request failed with {}: {}'.format(response.status_code, response.data[:200]))
+
+        start = time.time()
+        decompress(response.data, response.headers.get('Content-Encoding', 'identity'))
+        client_seconds += time.time() - start
+
+        transfer_seconds = (len(body) + len(response.data)) / (bandwidth * 1024 * 1024)
+        result = {
+            'request_kb': len(body) / 1024.0,
+            'response_kb': len(response.data) / 1024.0,
+            'client_ms': client_seconds * 1000,
+            'server_ms': server_seconds * 1000,
+            'transfer_ms': transfer_seconds * 1000,
+            'total_seconds': client_seconds + server_seconds + transfer_seconds
+        }
+        if best is None or result['total_seconds'] < best['total_seconds']:
+            best = result
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compressed request and response bodies for /invocations.')
+    parser.add_argument('--bandwidth', type=float, default=12.5, help='the bandwidth to the endpoint in MB/s (12.5 is 100 Mbit/s)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    feature_count = execution_parameters.get_feature_count(ScoringService.get_model())
+    encodings = ['identity', 'gzip'] + (['zstd'] if content_encoding.zstandard is not None else [])
+
+    print('Bandwidth {} MB/s'.format(args.bandwidth))
+    print('{:>7}{:>10}{:>12}{:>13}{:>11}{:>11}{:>13}{:>10}{:>10}'.format(
+        'rows', 'encoding', 'request KB', 'response KB', 'client ms', 'server ms', 'transfer ms', 'rows/s', 'max rows'))
+    for rows in REQUEST_ROWS:
+        payload = execution_parameters.make_payload(feature_count, rows)
+        for encoding in encodings:
+            result = benchmark(client, payload, encoding, args.bandwidth, args.repeat)
+            max_rows = int(rows * MAX_REQUEST_BYTES / (result['request_kb'] * 1024))
+            print('{:>7}{:>10}{:>12.0f}{:>13.0f}{:>11.1f}{:>11.1f}{:>13.1f}{:>10.0f}{:>10}'.format(
+                rows, encoding, result['request_kb'], result['response_kb'], result['client_ms'],
+                result['server_ms'], result['transfer_ms'], rows / result['total_seconds'], max_rows))
+
+if __name__ == '__main__':
+    main()
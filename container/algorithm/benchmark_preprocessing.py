@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+# Benchmarks the per-request cost of the preprocessing in preprocessing.py. The same fitted
+# preprocessing (median imputation, standard scaling and one-hot encoding of the categorical columns)
+# is applied to requests of different sizes in three ways:
+#
+#   pandas        per-request DataFrame code: fillna, arithmetic on the numeric columns, get_dummies
+#   scikit-learn  a fitted ColumnTransformer of SimpleImputer, StandardScaler and OneHotEncoder
+#   compiled      Preprocessor.transform, one pass into a preallocated array
+#
+# Usage:
+#   python benchmark_preprocessing.py [--features 20] [--categorical 4] [--repeat 50]
+
+from __future__ import print_function
+
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+import preprocessing
+
+REQUEST_ROWS = [1, 100, 10000]
+
+def make_data(rows, features, categorical, seed=0):
+    """Make numeric columns with missing values, followed by categorical columns with 10 categories"""
+    random = np.random.RandomState(seed)
+    X = random.normal(size=(rows, features)) * 10
+    X[:, features - categorical:] = random.randint(0, 10, size=(rows, categorical))
+    X[random.uniform(size=X.shape) < 0.05] = np.nan
+    return pd.DataFrame(X)
+
+def make_pandas_transform(train_X, numeric, categorical):
+    """The preprocessing as DataFrame code, the way it is often bolted onto a request handler"""
+    fill = pd.concat([train_X[numeric].median(), train_X[categorical].mode().iloc[0]])
+    filled = train_X.fillna(fill)
+    mean, std = filled[numeric].mean(), filled[numeric].std(ddof=0)
+    categories = {x: sorted(filled[x].unique()) for x in categorical}
+
+    def transform(X):
+        X = X.fillna(fill)
+        parts = [(X[numeric] - mean) / std]
+        for column in categorical:
+            values = pd.Categorical(X[column], categories=categories[column])
+            parts.append(pd.get_dummies(values, prefix=str(column)).set_index(X.index).astype(np.float64))
+        return pd.concat(parts, axis=1).to_numpy()
+    return transform
+
+def best_seconds(function, argument, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        function(argument)
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-request cost of the preprocessing.')
+    parser.add_argument('--features', type=int, default=20, help='the number of feature columns')
+    parser.add_argument('--categorical', type=int, default=4, help='how many of them are categorical')
+    parser.add_argument('--repeat', type=int, default=50, help='the best of this many runs is kept')
+    args = parser.parse_args()
+
+    numeric = list(range(args.features - args.categorical))
+    categorical = list(range(args.features - args.categorical, args.features))
+    train_X = make_data(10000, args.features, args.categorical)
+
+    preprocessor = preprocessing.Preprocessor('median', 'standard', tuple(categorical), 'onehot').fit(train_X)
+    reference = ColumnTransformer([
+        ('numeric', make_pipeline(SimpleImputer(strategy='median'), StandardScaler()), numeric),
+        ('categorical', make_pipeline(SimpleImputer(strategy='most_frequent'), OneHotEncoder(handle_unknown='ignore')), categorical)
+    ], sparse_threshold=0).fit(train_X)
+    transforms = [
+        ('pandas', make_pandas_transform(train_X, numeric, categorical)),
+        ('scikit-learn', reference.transform),
+        ('compiled', preprocessor.transform)
+    ]
+
+    print('{:>8}{:>16}{:>16}{:>16}'.format('rows', *['{} ms'.format(name) for name, _ in transforms]))
+    for rows in REQUEST_ROWS:
+        request = make_data(rows, args.features, args.categorical, seed=1)
+        # Check that the three agree before timing them
+        outputs = [transform(request) for _, transform in transforms]
+        for output in outputs[1:]:
+            np.testing.assert_allclose(output, outputs[0], atol=1e-9)
+        seconds = [best_seconds(transform, request, args.repeat) for _, transform in transforms]
+        print('{:>8}{:>16.3f}{:>16.3f}{:>16.3f}'.format(rows, *[x * 1000 for x in seconds]))
+
+if __name__ == '__main__':
+    main()
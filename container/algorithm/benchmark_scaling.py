@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# Scaling benchmarks built on the synthetic data generator. For every combination of rows and columns
+# it measures:
+#
+#   - training: the train() function is run in a fresh process on synthetic CSV shards laid out like
+#     the SageMaker training channel. The phase timings and peak memory come from the profile that
+#     train() writes (see profiler.py).
+#   - serving: the /invocations route is called through the flask test client with CSV payloads of
+#     different sizes and the throughput in rows per second is reported.
+#
+# Usage:
+#   python benchmark_scaling.py [--rows 10000 100000 1000000] [--columns 4 100] [--batch-sizes 1 100 10000]
+
+from __future__ import print_function
+
+import io
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from contextlib import redirect_stdout
+
+import pandas as pd
+
+from sklearn import tree
+
+import synthetic_data
+
+def _run_training(prefix, hyperparameters):
+    """Run train() with the SageMaker paths pointing at a local directory (runs in a child process)"""
+    import train
+    with open(os.path.join(prefix, 'input/config/hyperparameters.json'), 'w') as f:
+        json.dump(hyperparameters, f)
+    # A single host, whatever the config files of this machine's /opt/ml say
+    with open(os.path.join(prefix, 'input/config/resourceConfig.json'), 'w') as f:
+        json.dump({'current_host': 'algo-1', 'hosts': ['algo-1']}, f)
+    with open(os.path.join(prefix, 'input/config/inputdataconfig.json'), 'w') as f:
+        json.dump({train.channel_name: {'S3DistributionType': 'FullyReplicated', 'TrainingInputMode': 'File'}}, f)
+    train.param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
+    train.resource_config_path = os.path.join(prefix, 'input/config/resourceConfig.json')
+    train.input_data_config_path = os.path.join(prefix, 'input/config/inputdataconfig.json')
+    train.training_path = os.path.join(prefix, 'input/data', train.channel_name)
+    train.model_path = os.path.join(prefix, 'model')
+    train.output_path = os.path.join(prefix, 'output')
+    train.output_data_path = os.path.join(prefix, 'output/data')
+    train.train()
+
+def benchmark_training(rows, columns, classes, shards, hyperparameters):
+    """Train on synthetic data in a fresh process and return the profile it wrote
+
+    Arguments:
+        rows {int} -- the number of training rows
+        columns {int} -- the number of feature columns
+        classes {int} -- the number of classes
+        shards {int} -- the number of training files
+        hyperparameters {dict} -- the training hyperparameters
+
+    Returns:
+        dict -- the measurements
+    """
+    prefix = tempfile.mkdtemp()
+    try:
+        for path in ['input/config', 'model', 'output/data']:
+            os.makedirs(os.path.join(prefix, path))
+
+        start = time.time()
+        synthetic_data.write_shards(os.path.join(prefix, 'input/data/train'), rows, columns, classes, shards)
+        generate_seconds = time.time() - start
+
+        # A fresh process per run, so the peak memory of one run doesn't carry over to the next
+        process = multiprocessing.get_context('spawn').Process(target=_run_training, args=(prefix, hyperparameters))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            return {'rows': rows, 'columns': columns, 'error': 'training exited with code {}'.format(process.exitcode)}
+
+        with open(os.path.join(prefix, 'output/data/profile.json')) as f:
+            profile = json.load(f)
+        result = {'rows': rows, 'columns': columns, 'generate_s': generate_seconds}
+        result.update({'{}_s'.format(x['name']): x['seconds'] for x in profile['phases']})
+        result['total_s'] = profile['total_seconds']
+        result['peak_rss_mb'] = profile['peak_rss_mb']
+        return result
+    finally:
+        shutil.rmtree(prefix, ignore_errors=True)
+
+def benchmark_serving(train_rows, columns, classes, batch_sizes, hyperparameters, duration=2.0):
+    """Measure the /invocations throughput for different payload sizes
+
+    Arguments:
+        train_rows {int} -- the number of rows used to train the model
+        columns {int} -- the number of feature columns
+        classes {int} -- the number of classes
+        batch_sizes {list} -- the payload sizes (rows per request) to measure
+        hyperparameters {dict} -- the training hyperparameters
+
+    Keyword Arguments:
+        duration {float} -- roughly how many seconds to spend on each payload size (default: {2.0})
+
+    Returns:
+        list -- one dict of measurements per payload size
+    """
+    from predictor import app, ScoringService
+
+    train_data = synthetic_data.make_frame(train_rows, columns, classes)
+    max_leaf_nodes = hyperparameters.get('max_leaf_nodes', None)
+    ScoringService.model = tree.DecisionTreeClassifier(
+        max_leaf_nodes=int(max_leaf_nodes) if max_leaf_nodes is not None else None
+    ).fit(train_data.iloc[:, 1:], train_data.iloc[:, 0])
+
+    client = app.test_client()
+    results = []
+    for batch_size in batch_sizes:
+        y, X = synthetic_data.generate_block(batch_size, columns, classes, seed=1)
+        payload = synthetic_data.format_block(y, X, classes, include_labels=False)
+
+        # The server logs every request, which would drown out the results
+        requests, start = 0, time.time()
+        with redirect_stdout(io.StringIO()):
+            while requests == 0 or time.time() - start < duration:
+                response = client.post('/invocations', data=payload, headers={'Content-Type': 'text/csv'})
+                assert response.status_code == 200, response.data
+                requests += 1
+        seconds = time.time() - start
+        results.append({
+            'columns': columns,
+            'batch_rows': batch_size,
+            'payload_mb': len(payload) / 1e6,
+            'latency_ms': 1000.0 * seconds / requests,
+            'rows_per_s': batch_size * requests / seconds
+        })
+    ScoringService.model = None
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark training and serving at different data sizes')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[4, 100])
+    parser.add_argument('--classes', type=int, default=3)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 1000, 10000])
+    parser.add_argument('--max-leaf-nodes', default='4', help='the max_leaf_nodes hyperparameter')
+    args = parser.parse_args()
+    hyperparameters = {'max_leaf_nodes': args.max_leaf_nodes}
+
+    training = [benchmark_training(rows, columns, args.classes, args.shards, hyperparameters)
+                for columns in args.columns for rows in args.rows]
+    print('\nTraining')
+    print(pd.DataFrame(training).to_string(index=False, float_format='{:.3f}'.format))
+
+    serving = []
+    for columns in args.columns:
+        serving += benchmark_serving(min(args.rows), columns, args.classes, args.batch_sizes, hyperparameters)
+    print('\nServing (/invocations through the flask test client)')
+    print(pd.DataFrame(serving).to_string(index=False, float_format='{:.3f}'.format))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Benchmarks the model artifact formats in artifacts.py. For each format it measures how long it
+# takes to save the model, the size of the artifact, the size of the model.tar.gz that SageMaker
+# builds from the model directory, how long it takes to untar that archive on the endpoint and how
+# long it takes to load the model. The end-to-end time adds an estimated download time for the
+# model.tar.gz at the given bandwidth.
+#
+# Usage:
+#   python benchmark_serialization.py [--trees 200] [--rows 100000] [--bandwidth 50]
+
+from __future__ import print_function
+
+import os
+import time
+import shutil
+import tarfile
+import argparse
+import tempfile
+
+import pandas as pd
+
+from sklearn import tree
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+
+import artifacts
+
+FORMATS = ['joblib', 'joblib-zlib:1', 'joblib-zlib:3', 'joblib-lz4:0', 'joblib-lz4:3', 'zstd:1', 'zstd:3', 'pickle5']
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+
+def benchmark_format(model, model_format, bandwidth, repeat):
+    """Save, archive, extract and load a model with the given format
+
+    Arguments:
+        model -- the model to benchmark
+        model_format {string} -- the artifact format specification
+        bandwidth {float} -- the download bandwidth in MB/s used to estimate the transfer time
+        repeat {int} -- the number of times to repeat each measurement (the best time is kept)
+
+    Returns:
+        dict -- the measurements
+    """
+    results = {'format': model_format}
+    work_dir = tempfile.mkdtemp()
+    try:
+        model_dir = os.path.join(work_dir, 'model')
+        serving_dir = os.path.join(work_dir, 'serving')
+        archive_path = os.path.join(work_dir, 'model.tar.gz')
+
+        save_times, tar_times, untar_times, load_times = [], [], [], []
+        for _ in range(repeat):
+            for path in [model_dir, serving_dir]:
+                shutil.rmtree(path, ignore_errors=True)
+                os.makedirs(path)
+
+            start = time.time()
+            artifacts.save_model(model, model_dir, model_format=model_format)
+            save_times.append(time.time() - start)
+
+            # SageMaker gzips the model directory after training...
+            start = time.time()
+            with tarfile.open(archive_path, 'w:gz', compresslevel=6) as tar:
+                for name in os.listdir(model_dir):
+                    tar.add(os.path.join(model_dir, name), arcname=name)
+            tar_times.append(time.time() - start)
+
+            # ...and extracts it on the endpoint before the server loads the model
+            start = time.time()
+            with tarfile.open(archive_path, 'r:gz') as tar:
+                tar.extractall(serving_dir)
+            untar_times.append(time.time() - start)
+
+            start = time.time()
+            artifacts.load_model(serving_dir)
+            load_times.append(time.time() - start)
+
+        results['artifact_mb'] = directory_size(model_dir) / 1e6
+        results['tar_gz_mb'] = os.path.getsize(archive_path) / 1e6
+        results['save_s'] = min(save_times)
+        results['tar_s'] = min(tar_times)
+        results['untar_s'] = min(untar_times)
+        results['load_s'] = min(load_times)
+        results['download_s'] = results['tar_gz_mb'] / bandwidth
+        results['end_to_end_s'] = (results['save_s'] + results['tar_s'] + results['download_s'] +
+                                   results['untar_s'] + results['load_s'])
+    except (ValueError, ImportError) as e:
+        results['error'] = str(e)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def build_models(rows, trees):
+    """Build the template model (a decision tree trained on iris) and a large synthetic forest"""
+    iris_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../local_test/test_dir/input/data/train/iris.csv')
+    if not os.path.exists(iris_path):
+        iris_path = '/opt/ml/input/data/train/iris.csv'
+    iris = pd.read_csv(iris_path, header=None)
+    template = tree.DecisionTreeClassifier(max_leaf_nodes=4).fit(iris.iloc[:, 1:], iris.iloc[:, 0])
+
+    X, y = make_classification(n_samples=rows, n_features=20, n_informative=10, n_classes=3, random_state=0)
+    forest = RandomForestClassifier(n_estimators=trees, n_jobs=-1, random_state=0).fit(X, y)
+    return [('template decision tree', template), ('synthetic forest ({} trees, {} rows)'.format(trees, rows), forest)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the model artifact formats')
+    parser.add_argument('--rows', type=int, default=100000, help='rows used to train the synthetic forest')
+    parser.add_argument('--trees', type=int, default=200, help='trees in the synthetic forest')
+    parser.add_argument('--bandwidth', type=float, default=50.0, help='S3 download bandwidth in MB/s')
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per measurement')
+    parser.add_argument('--formats', nargs='+', default=FORMATS, help='the formats to benchmark')
+    args = parser.parse_args()
+
+    columns = ['format', 'artifact_mb', 'tar_gz_mb', 'save_s', 'tar_s', 'untar_s', 'load_s', 'end_to_end_s']
+    for model_name, model in build_models(args.rows, args.trees):
+        print('\n{}'.format(model_name))
+        results = [benchmark_format(model, x, args.bandwidth, args.repeat) for x in args.formats]
+        table = pd.DataFrame([x for x in results if 'error' not in x], columns=columns)
+        print(table.sort_values('end_to_end_s').to_string(index=False, float_format='{:.4f}'.format))
+        for failed in [x for x in results if 'error' in x]:
+            print('{}: skipped ({})'.format(failed['format'], failed['error']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+# Post-fit compaction of tree models. A fitted scikit-learn tree carries a lot of state that is only
+# needed during training (per-node impurity, sample counts and class counts for every internal node)
+# and stores its thresholds as float64. The compact models in this file keep only what predict needs:
+#
+#   - the tree structure (children, split features) in the smallest integer type that fits
+#   - the thresholds as float32. scikit-learn casts the input to float32 before comparing it with a
+#     threshold, and for a float32 value x, x <= t exactly when x <= (t rounded down to float32), so
+#     rounding the thresholds down is lossless for prediction
+#   - for a single tree, the index of the predicted class in every leaf; for an ensemble, the class
+#     probabilities of the leaves only
+#
+# Compaction itself is lossless, so the compact model is checked against the original one on the rows
+# the model was trained on. Ensembles can additionally be pruned: members are greedily dropped as long
+# as the accuracy on a hold-out set stays within a tolerance of the accuracy of the full ensemble, so
+# they need rows that were kept out of the fit (see needs_holdout and split_holdout).
+#
+# Supported models: DecisionTreeClassifier, RandomForestClassifier and ExtraTreesClassifier with a
+# single output. Anything else is returned unchanged.
+
+from __future__ import print_function
+
+import time
+import pickle
+
+import numpy as np
+
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
+from sklearn.model_selection import train_test_split
+
+def _smallest_int_dtype(max_value, signed=True):
+    """Get the smallest integer dtype that can hold values up to max_value (and -1 if signed)"""
+    candidates = [np.int8, np.int16, np.int32, np.int64] if signed else [np.uint8, np.uint16, np.uint32, np.uint64]
+    for dtype in candidates:
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return candidates[-1]
+
+def _round_down_to_float32(values):
+    """Round float64 values down to the largest float32 that is <= the value"""
+    rounded = values.astype(np.float32)
+    too_big = rounded.astype(np.float64) > values
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+class CompactTree(object):
+    """The prediction-only structure of a fitted scikit-learn tree"""
+
+    def __init__(self, sklearn_tree, leaf_values):
+        """
+        Arguments:
+            sklearn_tree {sklearn.tree._tree.Tree} -- the tree_ attribute of a fitted tree
+            leaf_values {numpy.ndarray} -- one row of values for every node (only the leaf rows are kept)
+        """
+        n_nodes = sklearn_tree.node_count
+        node_dtype = _smallest_int_dtype(n_nodes)
+
+        is_leaf = sklearn_tree.children_left == -1
+        # Map every node to its row in the leaf value table (internal nodes don't need values)
+        leaf_index = np.zeros(n_nodes, dtype=np.int64)
+        leaf_index[is_leaf] = np.arange(is_leaf.sum())
+
+        # Leaves point back to themselves, so every row can take max_depth steps without
+        # checking whether it has already reached a leaf
+        nodes = np.arange(n_nodes)
+        self.max_depth = sklearn_tree.max_depth
+        self.children_left = np.where(is_leaf, nodes, sklearn_tree.children_left).astype(node_dtype)
+        self.children_right = np.where(is_leaf, nodes, sklearn_tree.children_right).astype(node_dtype)
+        self.feature = np.where(is_leaf, 0, sklearn_tree.feature).astype(_smallest_int_dtype(max(sklearn_tree.feature.max(), 0)))
+        self.threshold = _round_down_to_float32(sklearn_tree.threshold)
+        self.leaf_index = leaf_index.astype(_smallest_int_dtype(max(is_leaf.sum(), 1)))
+        self.leaf_values = leaf_values[is_leaf]
+
+    def apply(self, X):
+        """Get the index of the leaf that each row of X ends up in
+
+        Arguments:
+            X {numpy.ndarray} -- float32 feature data
+
+        Returns:
+            numpy.ndarray -- the leaf table index for each row
+        """
+        n_rows = X.shape[0]
+        node = np.zeros(n_rows, dtype=np.int64)
+        rows = np.arange(n_rows)
+        current = node
+        for depth in range(self.max_depth):
+            go_left = X[rows, self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.children_left[current], self.children_right[current])
+            if depth % 4 == 3 or depth == self.max_depth - 1:
+                # Every few levels, put the rows that have reached a leaf aside so deep trees
+                # don't keep walking rows that are already done
+                node[rows] = current
+                active = self.children_left[current] != current
+                rows, current = rows[active], current[active]
+                if rows.size == 0:
+                    break
+        return self.leaf_index[node]
+
+def _check_features(X, n_features):
+    """Convert the input to float32 and check that it has the number of features the model was fitted on"""
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim != 2 or X.shape[1] != n_features:
+        raise ValueError('Number of features of the model must match the input. Model n_features is {} and input n_features is {}.'.format(
+            n_features, X.shape[1] if X.ndim == 2 else X.ndim))
+    return X
+
+class CompactTreeClassifier(object):
+    """A prediction-only replacement for a fitted DecisionTreeClassifier"""
+
+    def __init__(self, model):
+        self.classes_ = model.classes_
+        self.n_features_ = model.tree_.n_features
+        # Store the index of the predicted class for every leaf (sklearn predicts the argmax of the leaf value)
+        class_index = np.argmax(model.tree_.value[:, 0, :], axis=1)
+        self.tree = CompactTree(model.tree_, class_index.astype(_smallest_int_dtype(len(self.classes_), signed=False)))
+
+    def predict(self, X):
+        X = _check_features(X, self.n_features_)
+        return self.classes_.take(self.tree.leaf_values[self.tree.apply(X)], axis=0)
+
+class CompactForestClassifier(object):
+    """A prediction-only replacement for a fitted random forest or extra trees classifier"""
+
+    def __init__(self, model):
+        self.classes_ = model.classes_
+        self.n_features_ = model.estimators_[0].tree_.n_features
+        self.trees = [CompactTree(x.tree_, self.__leaf_proba(x.tree_)) for x in model.estimators_]
+
+    @staticmethod
+    def __leaf_proba(sklearn_tree):
+        """The class probabilities of every node, computed the same way as DecisionTreeClassifier.predict_proba"""
+        proba = sklearn_tree.value[:, 0, :].copy()
+        normalizer = proba.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        return proba / normalizer
+
+    def tree_proba(self, X):
+        """The class probabilities predicted by each tree
+
+        Arguments:
+            X -- feature data
+
+        Returns:
+            list -- one (rows x classes) array per tree
+        """
+        X = _check_features(X, self.n_features_)
+        return [x.leaf_values[x.apply(X)] for x in self.trees]
+
+    def predict_proba(self, X):
+        # Sum in the same order as the forest does so the result is identical
+        all_proba = np.zeros((np.asarray(X).shape[0], len(self.classes_)), dtype=np.float64)
+        for proba in self.tree_proba(X):
+            all_proba += proba
+        all_proba /= len(self.trees)
+        return all_proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+def prune_forest(model, X, y, tolerance):
+    """Greedily drop trees from a compact forest while the hold-out accuracy stays within a tolerance
+
+    Arguments:
+        model {CompactForestClassifier} -- the forest to prune (it is modified in place)
+        X -- hold-out feature data
+        y -- hold-out labels
+        tolerance {float} -- the largest drop in accuracy (as a fraction, e.g. 0.01) allowed
+
+    Returns:
+        list -- the indexes of the trees that were dropped
+    """
+    y = np.asarray(y)
+    tree_proba = model.tree_proba(X)
+    total = np.sum(tree_proba, axis=0)
+    baseline = np.mean(model.classes_.take(np.argmax(total, axis=1)) == y)
+
+    kept = list(range(len(model.trees)))
+    dropped = []
+    while len(kept) > 1:
+        # Find the tree whose removal hurts the accuracy the least
+        best_tree, best_accuracy = None, -1.0
+        for tree_index in kept:
+            predictions = model.classes_.take(np.argmax(total - tree_proba[tree_index], axis=1))
+            accuracy = np.mean(predictions == y)
+            if accuracy > best_accuracy:
+                best_tree, best_accuracy = tree_index, accuracy
+        if best_accuracy < baseline - tolerance:
+            break
+        total = total - tree_proba[best_tree]
+        kept.remove(best_tree)
+        dropped.append(best_tree)
+
+    model.trees = [model.trees[x] for x in kept]
+    return dropped
+
+def measure(model, X, repeat=5):
+    """Measure the serialized size of a model and its prediction latency
+
+    Arguments:
+        model -- the model
+        X -- the data to time predictions on
+
+    Keyword Arguments:
+        repeat {int} -- the number of timing runs; the fastest one is reported (default: {5})
+
+    Returns:
+        dict -- the size in bytes and the latency in seconds
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.time()
+        model.predict(X)
+        latencies.append(time.time() - start)
+    return {
+        'size_bytes': len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)),
+        'latency_seconds': min(latencies)
+    }
+
+def needs_holdout(model, tolerance=0.0):
+    """Check whether compacting a model needs a hold-out set that is kept out of the fit
+
+    Only pruning the members of an ensemble does. The model doesn't have to be fitted yet.
+
+    Arguments:
+        model -- the scikit-learn model
+
+    Keyword Arguments:
+        tolerance {float} -- the pruning tolerance passed to compact, None to not prune (default: {0.0})
+
+    Returns:
+        bool -- True if compact needs rows that the model was not trained on
+    """
+    return isinstance(model, (RandomForestClassifier, ExtraTreesClassifier)) and tolerance is not None
+
+def split_holdout(X, y, holdout_fraction, random_state=0):
+    """Split off a hold-out set, stratified by the label where every class has enough rows for that
+
+    Arguments:
+        X -- feature data
+        y -- labels
+        holdout_fraction {float} -- the share of the rows to hold out
+
+    Keyword Arguments:
+        random_state {int} -- the seed of the split (default: {0})
+
+    Returns:
+        tuple -- (X_fit, X_holdout, y_fit, y_holdout)
+    """
+    try:
+        return train_test_split(X, y, test_size=holdout_fraction, stratify=y, random_state=random_state)
+    except ValueError:
+        # A class with a single row (or more classes than hold-out rows) can't be stratified
+        return train_test_split(X, y, test_size=holdout_fraction, random_state=random_state)
+
+def compact(model, X_check, y_check, tolerance=0.0):
+    """Compact a fitted model and check that it still predicts the same
+
+    The compact model has to make exactly the same predictions as the original one on X_check, for
+    which the training rows will do. When trees are pruned from an ensemble, its accuracy on X_check
+    has to stay within the tolerance instead, so X_check has to be a hold-out set.
+    If the checks fail, the original model is returned.
+
+    Arguments:
+        model -- the fitted scikit-learn model
+        X_check -- the feature data to check the predictions on
+        y_check -- the labels of X_check
+
+    Keyword Arguments:
+        tolerance {float} -- the largest drop in accuracy on a hold-out set allowed when pruning ensemble members.
+            Use None to not prune at all (default: {0.0})
+
+    Returns:
+        tuple -- (the model to save, a report dict with the size and latency before and after)
+    """
+    if not isinstance(model, (DecisionTreeClassifier, RandomForestClassifier, ExtraTreesClassifier)):
+        print('Model compaction does not support {}. Keeping the original model.'.format(type(model).__name__))
+        return model, None
+    if model.n_outputs_ != 1:
+        print('Model compaction only supports single output models. Keeping the original model.')
+        return model, None
+
+    if isinstance(model, DecisionTreeClassifier):
+        compacted = CompactTreeClassifier(model)
+    else:
+        compacted = CompactForestClassifier(model)
+
+    original_predictions = model.predict(X_check)
+    report = {
+        'before': measure(model, X_check),
+        'parity': bool(np.array_equal(compacted.predict(X_check), original_predictions)),
+        'dropped_members': 0
+    }
+    if not report['parity']:
+        print('Compact model predictions differ from the original model. Keeping the original model.')
+        return model, report
+
+    if isinstance(compacted, CompactForestClassifier) and tolerance is not None:
+        report['dropped_members'] = len(prune_forest(compacted, X_check, y_check, tolerance))
+
+    y_check = np.asarray(y_check)
+    report['accuracy_before'] = float(np.mean(original_predictions == y_check))
+    report['accuracy_after'] = float(np.mean(compacted.predict(X_check) == y_check))
+    report['after'] = measure(compacted, X_check)
+    return compacted, report
+
+def print_report(report):
+    """Print a compaction report in the same format as the other training metrics"""
+    if report is None:
+        return
+    print('::compaction::parity::{}::'.format(int(report['parity'])))
+    print('::compaction::size_bytes_before::{}::'.format(report['before']['size_bytes']))
+    print('::compaction::latency_seconds_before::{:.6f}::'.format(report['before']['latency_seconds']))
+    if 'after' in report:
+        print('::compaction::size_bytes_after::{}::'.format(report['after']['size_bytes']))
+        print('::compaction::latency_seconds_after::{:.6f}::'.format(report['after']['latency_seconds']))
+        print('::compaction::dropped_members::{}::'.format(report['dropped_members']))
+        print('::compaction::accuracy_before::{:.6f}::'.format(report['accuracy_before']))
+        print('::compaction::accuracy_after::{:.6f}::'.format(report['accuracy_after']))
@@ -0,0 +1,165 @@
+# Compressed request and response bodies for /invocations. CSV compresses well (typically 3-5x), so
+# compressing it saves transfer time for remote clients and lets more rows fit in a request within the
+# request body limit of nginx.conf (client_max_body_size), which applies to the compressed size.
+#
+# Requests with a Content-Encoding of gzip or zstd are decompressed as a stream, in chunks, and the
+# request is rejected as soon as the decompressed body is larger than the limit, so a small request
+# that expands to gigabytes (a decompression bomb) never takes more memory than the limit.
+#
+# Responses are compressed when they are larger than the threshold and the Accept-Encoding header of
+# the request allows it. zstd is preferred over gzip when the client accepts both, because it is
+# faster on both ends. Both use a low compression level: the point is a faster transfer, not the
+# smallest body.
+#
+# zstd requires the zstandard package. Without it, zstd requests are rejected (415) and responses are
+# only compressed with gzip.
+#
+# We set the following parameters:
+#
+# Parameter                  Environment Variable                   Default Value
+# ---------                  --------------------                   -------------
+# decompressed body limit    MODEL_SERVER_MAX_DECOMPRESSED_MB       50 MB
+# compression threshold      MODEL_SERVER_COMPRESS_MIN_BYTES        1024 bytes (-1 never compresses responses)
+
+from __future__ import print_function
+
+import os
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+max_decompressed_bytes = int(float(os.environ.get('MODEL_SERVER_MAX_DECOMPRESSED_MB', 50)) * 1024 * 1024)
+compress_min_bytes = int(os.environ.get('MODEL_SERVER_COMPRESS_MIN_BYTES', 1024))
+
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 1
+READ_CHUNK_BYTES = 256 * 1024
+
+# The errors of the decompressors on data that is not valid for its encoding
+DECODE_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+class UnsupportedEncodingError(Exception):
+    pass
+
+class PayloadTooLargeError(Exception):
+    pass
+
+class InvalidPayloadError(Exception):
+    pass
+
+def get_encodings():
+    """Get the content encodings this server can read and write, the preferred one first"""
+    return (['zstd'] if zstandard is not None else []) + ['gzip']
+
+def _parse_encodings(header):
+    """Split a Content-Encoding header like "gzip" or "gzip, zstd" into a list of encodings"""
+    encodings = [x.strip().lower() for x in (header or '').split(',')]
+    return [x for x in encodings if x and x != 'identity']
+
+def _open_decoder(stream, encoding):
+    """Wrap a file-like object in a reader that decompresses it as it is read"""
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    raise UnsupportedEncodingError('Unsupported Content-Encoding "{}". Supported encodings are: {}'.format(
+        encoding, ', '.join(get_encodings())))
+
+def read_body(stream, content_encoding, max_bytes=None):
+    """Read a request body, decompressing it if it has a Content-Encoding
+
+    Arguments:
+        stream -- a file-like object with the request body
+        content_encoding {string} -- the Content-Encoding header, or None
+
+    Keyword Arguments:
+        max_bytes {int} -- the largest decompressed body to accept (default: {None}, max_decompressed_bytes)
+
+    Returns:
+        bytes -- the decompressed body
+
+    Raises:
+        UnsupportedEncodingError -- if the encoding is not supported
+        PayloadTooLargeError -- if the decompressed body is larger than max_bytes
+        InvalidPayloadError -- if the body is not valid for its encoding
+    """
+    max_bytes = max_decompressed_bytes if max_bytes is None else max_bytes
+    reader = stream
+    # The encodings are listed in the order they were applied, so they are undone in reverse
+    for encoding in reversed(_parse_encodings(content_encoding)):
+        reader = _open_decoder(reader, encoding)
+    if reader is stream:
+        return stream.read()
+
+    chunks, size = [], 0
+    try:
+        while True:
+            # Never ask for more than one byte past the limit
+            chunk = reader.read(min(READ_CHUNK_BYTES, max_bytes + 1 - size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > max_bytes:
+                raise PayloadTooLargeError('The decompressed request body is larger than {} bytes.'.format(max_bytes))
+    except DECODE_ERRORS as e:
+        raise InvalidPayloadError('The request body is not valid {}: {}'.format(content_encoding, e))
+    return b''.join(chunks)
+
+def choose_encoding(accept_encoding):
+    """Choose the encoding of a response from the Accept-Encoding header of the request
+
+    Arguments:
+        accept_encoding {string} -- the Accept-Encoding header, e.g. "gzip, deflate" or "zstd;q=1, gzip;q=0.5"
+
+    Returns:
+        string -- 'zstd' or 'gzip', or None if the response should not be compressed
+    """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, parameters = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith('q='):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+
+    candidates = []
+    for preference, encoding in enumerate(get_encodings()):
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            candidates.append((-quality, preference, encoding))
+    return min(candidates)[2] if candidates else None
+
+def encode_body(body, accept_encoding, min_bytes=None):
+    """Compress a response body if it is large enough and the client accepts a supported encoding
+
+    Arguments:
+        body {bytes} -- the response body
+        accept_encoding {string} -- the Accept-Encoding header of the request, or None
+
+    Keyword Arguments:
+        min_bytes {int} -- the smallest body to compress, -1 to never compress (default: {None}, compress_min_bytes)
+
+    Returns:
+        tuple -- (the body, the Content-Encoding or None if the body was not compressed)
+    """
+    min_bytes = compress_min_bytes if min_bytes is None else min_bytes
+    if min_bytes < 0 or len(body) < min_bytes:
+        return body, None
+    encoding = choose_encoding(accept_encoding)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), encoding
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), encoding
+    return body, None
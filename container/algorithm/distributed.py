@@ -0,0 +1,174 @@
+# Multi-instance training. When a training job runs on several instances, SageMaker describes the
+# cluster in /opt/ml/input/config/resourceConfig.json:
+#
+#   {"current_host": "algo-2", "hosts": ["algo-1", "algo-2", "algo-3"], ...}
+#
+# Every host trains a model on its own shard of the training data. With the ShardedByS3Key data
+# distribution SageMaker already copies a different subset of the files to each host; with
+# FullyReplicated every host has all of the data and keeps every n-th row. The other hosts then send
+# their model, row count and cross-validation accuracy to the first host (the leader) over a
+# multiprocessing connection. The leader saves an ensemble of the shard models that votes on the
+# predictions, weighted by the number of rows each model was trained on, and reports the row-weighted
+# average of the cross-validation accuracies.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# leader port              SHARD_EXCHANGE_PORT               7777
+# exchange timeout         SHARD_EXCHANGE_TIMEOUT_SECONDS    600
+# leader address           SHARD_EXCHANGE_LEADER_ADDRESS     the leader's host name (set it to simulate hosts locally)
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import threading
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+
+shard_exchange_port = int(os.environ.get('SHARD_EXCHANGE_PORT', 7777))
+shard_exchange_timeout = float(os.environ.get('SHARD_EXCHANGE_TIMEOUT_SECONDS', 600))
+
+def read_host_info(resource_config_path):
+    """Read the hosts of the training cluster
+
+    Arguments:
+        resource_config_path {string} -- the path of resourceConfig.json
+
+    Returns:
+        dict -- the current host, the list of hosts and the rank (index) of the current host. A missing
+                or empty file is treated as a single host.
+    """
+    config = {}
+    if os.path.exists(resource_config_path):
+        with open(resource_config_path) as f:
+            content = f.read()
+        if content.strip():
+            config = json.loads(content)
+
+    current_host = config.get('current_host', 'algo-1')
+    hosts = config.get('hosts', [current_host])
+    return {'current_host': current_host, 'hosts': hosts, 'rank': hosts.index(current_host)}
+
+def read_distribution(input_data_config_path, channel_name):
+    """Read how the data of a channel is distributed over the hosts
+
+    Arguments:
+        input_data_config_path {string} -- the path of inputdataconfig.json
+        channel_name {string} -- the channel
+
+    Returns:
+        string -- FullyReplicated or ShardedByS3Key
+    """
+    if not os.path.exists(input_data_config_path):
+        return 'FullyReplicated'
+    with open(input_data_config_path) as f:
+        config = json.load(f)
+    return config.get(channel_name, {}).get('S3DistributionType', 'FullyReplicated')
+
+def select_shard(data, rank, host_count):
+    """Keep every host_count-th row, starting at rank"""
+    return data.iloc[rank::host_count]
+
+class ShardEnsemble(object):
+    """An ensemble of the models trained on the shards of the data, which votes on the predictions"""
+
+    def __init__(self, models, weights):
+        """
+        Arguments:
+            models {list} -- the fitted models
+            weights {list} -- the weight of each model's vote (the number of rows it was trained on)
+        """
+        self.models = models
+        self.weights = np.asarray(weights, dtype=np.float64)
+        # A shard may not contain every class
+        self.classes_ = np.unique(np.concatenate([x.classes_ for x in models]))
+        self.n_features_ = getattr(models[0], 'n_features_', None)
+
+    def predict(self, X):
+        votes = np.zeros((len(X), len(self.classes_)))
+        rows = np.arange(len(X))
+        for model, weight in zip(self.models, self.weights):
+            votes[rows, np.searchsorted(self.classes_, model.predict(X))] += weight
+        # Ties go to the first class, like argmax does everywhere else
+        return self.classes_.take(np.argmax(votes, axis=1))
+
+def _authkey():
+    # Only the hosts of the same training job can connect to each other
+    return os.environ.get('TRAINING_JOB_NAME', 'local-training').encode('utf-8')
+
+def _leader_address(host_info):
+    return os.environ.get('SHARD_EXCHANGE_LEADER_ADDRESS', host_info['hosts'][0])
+
+def _send_shard(host_info, shard):
+    """Send a shard result to the leader, retrying until it listens"""
+    address = (_leader_address(host_info), shard_exchange_port)
+    deadline = time.time() + shard_exchange_timeout
+    while True:
+        try:
+            connection = Client(address, authkey=_authkey())
+            break
+        except (OSError, EOFError):
+            if time.time() > deadline:
+                raise TimeoutError('Could not connect to the leader at {}:{}.'.format(*address))
+            time.sleep(1)
+    with connection:
+        connection.send(shard)
+        # Wait until the leader has received everything before exiting
+        connection.recv()
+
+def _collect_shards(host_info, own_shard):
+    """Receive the shard results of all other hosts (runs on the leader)"""
+    shards = [own_shard]
+    errors = []
+    listener = Listener(('', shard_exchange_port), authkey=_authkey())
+
+    def accept():
+        try:
+            for _ in range(len(host_info['hosts']) - 1):
+                connection = listener.accept()
+                shards.append(connection.recv())
+                connection.send('received')
+                connection.close()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=accept, daemon=True)
+    thread.start()
+    thread.join(shard_exchange_timeout)
+    listener.close()
+    if errors:
+        raise errors[0]
+    if thread.is_alive():
+        raise TimeoutError('Received {} of {} shard models.'.format(len(shards), len(host_info['hosts'])))
+    return sorted(shards, key=lambda x: x['rank'])
+
+def exchange(host_info, model, rows, cv_accuracy):
+    """Combine the models of all hosts on the leader
+
+    Arguments:
+        host_info {dict} -- see read_host_info
+        model -- the model fitted on this host's shard, or None if the host has no data
+        rows {int} -- the number of rows in this host's shard
+        cv_accuracy {float} -- the cross-validation accuracy on this host's shard, or None if the host has no data
+
+    Returns:
+        tuple -- on the leader, (the ShardEnsemble, the row-weighted cross-validation accuracy).
+                 On the other hosts, (None, None).
+    """
+    shard = {'rank': host_info['rank'], 'model': model, 'rows': rows, 'cv_accuracy': cv_accuracy}
+    if host_info['rank'] != 0:
+        _send_shard(host_info, shard)
+        return None, None
+
+    # Hosts without data send an empty shard
+    shards = [x for x in _collect_shards(host_info, shard) if x['model'] is not None]
+    if not shards:
+        raise ValueError('None of the {} hosts has training data.'.format(len(host_info['hosts'])))
+    weights = [x['rows'] for x in shards]
+    ensemble = ShardEnsemble([x['model'] for x in shards], weights)
+    cv_accuracy = np.average([x['cv_accuracy'] for x in shards], weights=weights)
+    return ensemble, cv_accuracy
@@ -0,0 +1,112 @@
+# The execution parameters of the inference server, which SageMaker Batch Transform reads from
+# GET /execution-parameters before it sends the first batch. They tell Batch Transform to send one
+# request per worker at a time, with as many records per request as the server can score within a
+# reasonable time:
+#
+#   - MaxConcurrentTransforms: the number of gunicorn workers. Scoring is CPU bound, so more
+#     concurrent requests per worker would only queue (and be rejected by admission.py).
+#   - BatchStrategy: MultiRecord, so the per-request overhead is paid once per batch.
+#   - MaxPayloadInMB: the size of a batch that takes about MODEL_SERVER_TARGET_REQUEST_SECONDS to
+#     score. The cost per row is measured by scoring a synthetic payload with the model's number of
+#     features. It is capped by the request body limit in nginx.conf (client_max_body_size) and by the
+#     rows in flight budget in admission.py.
+#
+# The measurement runs once per loaded model and the result is kept, so probes while the server is
+# scoring don't take CPU from /invocations and always get the same answer.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable                  Default Value
+# ---------                --------------------                  -------------
+# number of workers        MODEL_SERVER_WORKERS                  the number of CPU cores
+# payload limit            MODEL_SERVER_MAX_PAYLOAD_MB           5 MB (client_max_body_size in nginx.conf)
+# time per request         MODEL_SERVER_TARGET_REQUEST_SECONDS   10 seconds
+
+from __future__ import print_function
+
+import os
+import time
+import threading
+import multiprocessing
+
+import numpy as np
+
+import admission
+
+model_server_workers = int(os.environ.get('MODEL_SERVER_WORKERS', multiprocessing.cpu_count()))
+max_payload_mb = int(os.environ.get('MODEL_SERVER_MAX_PAYLOAD_MB', 5))
+target_request_seconds = float(os.environ.get('MODEL_SERVER_TARGET_REQUEST_SECONDS', 10))
+
+CALIBRATION_ROWS = 2000
+
+# The model the execution parameters were measured for, and the parameters
+_calibrated_model = None
+_calibrated_parameters = None
+_calibration_lock = threading.Lock()
+
+def get_feature_count(model):
+    """Get the number of features a fitted model expects, or None if it is not known"""
+    for attribute in ['n_features_in_', 'n_features_']:
+        if getattr(model, attribute, None) is not None:
+            return int(getattr(model, attribute))
+    return None
+
+def make_payload(feature_count, rows, seed=0):
+    """Make a CSV payload of random values, formatted like the training data"""
+    values = np.random.RandomState(seed).uniform(0, 10, size=(rows, feature_count))
+    return ''.join(','.join('{:.6f}'.format(x) for x in row) + '\n' for row in values).encode('utf-8')
+
+def measure_row_cost(transform, feature_count, rows=CALIBRATION_ROWS):
+    """Measure what it costs to score a row
+
+    Arguments:
+        transform {function} -- scores a CSV payload (bytes) and returns the response body
+        feature_count {int} -- the number of features per row
+
+    Keyword Arguments:
+        rows {int} -- the number of rows to score (default: {CALIBRATION_ROWS})
+
+    Returns:
+        tuple -- (seconds per row, bytes per row of the payload)
+    """
+    payload = make_payload(feature_count, rows)
+    # The first call can include one-time costs
+    transform(payload[:payload.index(b'\n') + 1])
+    start = time.time()
+    transform(payload)
+    return (time.time() - start) / rows, len(payload) / float(rows)
+
+def get_execution_parameters(transform, model):
+    """Get the execution parameters for SageMaker Batch Transform
+
+    The parameters are measured on the first call for a model and returned again for the same model.
+
+    Arguments:
+        transform {function} -- scores a CSV payload (bytes) and returns the response body
+        model -- the model, used to find the number of features. None if it is not known (e.g. in
+                 multi-model mode), in which case the payload is only limited by nginx.
+
+    Returns:
+        dict -- MaxConcurrentTransforms, BatchStrategy and MaxPayloadInMB
+    """
+    global _calibrated_model, _calibrated_parameters
+
+    payload_mb = max_payload_mb
+    feature_count = get_feature_count(model) if model is not None else None
+    if feature_count is not None:
+        # Concurrent probes wait for the one measurement instead of scoring at the same time
+        with _calibration_lock:
+            if _calibrated_model is not model:
+                seconds_per_row, bytes_per_row = measure_row_cost(transform, feature_count)
+                rows = min(target_request_seconds / max(seconds_per_row, 1e-9), admission.max_rows_in_flight)
+                _calibrated_parameters = {'MaxPayloadInMB': min(max(int(rows * bytes_per_row / (1024 * 1024)), 1), max_payload_mb)}
+                _calibrated_model = model
+                print('Scoring takes {:.1f} microseconds per row of {:.0f} bytes. MaxPayloadInMB is {}.'.format(
+                    seconds_per_row * 1e6, bytes_per_row, _calibrated_parameters['MaxPayloadInMB']))
+            payload_mb = _calibrated_parameters['MaxPayloadInMB']
+
+    return {
+        'MaxConcurrentTransforms': model_server_workers,
+        'BatchStrategy': 'MULTI_RECORD',
+        'MaxPayloadInMB': payload_mb
+    }
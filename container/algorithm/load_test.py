@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Open-loop load test for the inference server. Requests are sent at a fixed rate, whether or not the
+# earlier ones were answered, like independent clients do. When the rate is more than the server can
+# handle, the latency of a server without admission control keeps growing for as long as the overload
+# lasts. With admission control (see admission.py) the excess requests get a fast 503 and the latency
+# of the admitted requests stays bounded.
+#
+# Usage:
+#   python load_test.py [--url http://localhost:8080] [--rate 100] [--seconds 20] [--rows 1000]
+#
+# With --local, the test starts gunicorn with the app of wsgi.py on a local port and uses the model in
+# /opt/ml/model. There is no nginx in front of it, so the test sets the X-Request-Start header itself.
+# Add --compare to run the test a second time with the admission control turned off.
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+NO_ADMISSION_CONTROL = {
+    'MODEL_SERVER_MAX_IN_FLIGHT': '1000000',
+    'MODEL_SERVER_MAX_ROWS_IN_FLIGHT': '1000000000',
+    'MODEL_SERVER_MAX_QUEUE_SECONDS': '1000000'
+}
+
+def make_payload(rows):
+    """Repeat the rows of the test payload to get a payload with the given number of rows"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_payload.csv'), 'rb') as f:
+        lines = f.read().splitlines()
+    return b'\n'.join(lines[i % len(lines)] for i in range(rows)) + b'\n'
+
+def run(url, rate, seconds, payload, timeout=60, request_start_header=False):
+    """Send requests at a fixed rate and measure the responses
+
+    Arguments:
+        url {string} -- the base URL of the server
+        rate {float} -- the number of requests per second
+        seconds {float} -- how long to send requests for
+        payload {bytes} -- the CSV payload of every request
+
+    Keyword Arguments:
+        timeout {float} -- the request timeout in seconds (default: {60})
+        request_start_header {bool} -- set the X-Request-Start header like nginx does (default: {False})
+
+    Returns:
+        dict -- the measurements
+    """
+    def invoke(scheduled):
+        headers = {'Content-Type': 'text/csv'}
+        if request_start_header:
+            headers['X-Request-Start'] = 't={:.3f}'.format(time.time())
+        try:
+            response = requests.post(url + '/invocations', data=payload, headers=headers, timeout=timeout)
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        # Measured from the time the request should have been sent, so a slow client doesn't hide latency
+        return status, time.time() - scheduled
+
+    def ping(scheduled):
+        try:
+            status = requests.get(url + '/ping', timeout=timeout).status_code
+        except requests.RequestException:
+            status = None
+        return status, time.time() - scheduled
+
+    count = int(rate * seconds)
+    start = time.time()
+    futures, pings = [], []
+    with ThreadPoolExecutor(max_workers=512) as executor:
+        for i in range(count):
+            scheduled = start + i / rate
+            time.sleep(max(scheduled - time.time(), 0))
+            futures.append(executor.submit(invoke, scheduled))
+            # A health check every second, like SageMaker does
+            if i % max(int(rate), 1) == 0:
+                pings.append(executor.submit(ping, time.time()))
+        results = [x.result() for x in futures]
+        ping_results = [x.result() for x in pings]
+    elapsed = time.time() - start
+
+    ok = [latency for status, latency in results if status == 200]
+    rejected = [latency for status, latency in results if status == 503]
+    return {
+        'sent': count,
+        'ok': len(ok),
+        'rejected': len(rejected),
+        'failed': count - len(ok) - len(rejected),
+        'ok_per_s': len(ok) / elapsed,
+        'p50_ms': np.percentile(ok, 50) * 1000 if ok else None,
+        'p99_ms': np.percentile(ok, 99) * 1000 if ok else None,
+        'rejected_p99_ms': np.percentile(rejected, 99) * 1000 if rejected else None,
+        'ping_p99_ms': np.percentile([x[1] for x in ping_results], 99) * 1000,
+        'ping_failed': sum(1 for x in ping_results if x[0] != 200)
+    }
+
+def start_local_server(environment, workers):
+    """Start gunicorn in a child process and wait until it answers"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', '127.0.0.1:{}'.format(port), 'wsgi:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=dict(os.environ, **environment),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    url = 'http://127.0.0.1:{}'.format(port)
+    for _ in range(100):
+        try:
+            requests.get(url + '/ping', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('The local server did not start.')
+
+def print_result(name, result):
+    def ms(x):
+        return '-' if x is None else '{:.0f}'.format(x)
+    print('{:<24}{:>6}{:>6}{:>9}{:>7}{:>8.1f}{:>9}{:>9}{:>13}{:>10}'.format(
+        name, result['sent'], result['ok'], result['rejected'], result['failed'], result['ok_per_s'],
+        ms(result['p50_ms']), ms(result['p99_ms']), ms(result['rejected_p99_ms']), ms(result['ping_p99_ms'])))
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load test for the inference server.')
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--rate', type=float, default=100, help='requests per second')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--rows', type=int, default=1000, help='rows per request')
+    parser.add_argument('--local', action='store_true', help='start gunicorn locally instead of using --url')
+    parser.add_argument('--workers', type=int, default=2, help='with --local, the number of gunicorn workers')
+    parser.add_argument('--compare', action='store_true', help='with --local, also run without admission control')
+    args = parser.parse_args()
+
+    payload = make_payload(args.rows)
+    print('{:<24}{:>6}{:>6}{:>9}{:>7}{:>8}{:>9}{:>9}{:>13}{:>10}'.format(
+        'server', 'sent', 'ok', 'rejected', 'failed', 'ok/s', 'p50 ms', 'p99 ms', '503 p99 ms', 'ping p99'))
+
+    if not args.local:
+        print_result(args.url, run(args.url, args.rate, args.seconds, payload))
+        return
+
+    variants = [('admission control', {})]
+    if args.compare:
+        variants.append(('no admission control', NO_ADMISSION_CONTROL))
+    for name, environment in variants:
+        process, url = start_local_server(environment, args.workers)
+        try:
+            print_result(name, run(url, args.rate, args.seconds, payload, request_start_header=True))
+        finally:
+            process.kill()
+            process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# Multi-model hosting. With SAGEMAKER_MULTI_MODEL=true the inference server serves many models from
+# one endpoint: every request names its model in the X-Amzn-SageMaker-Target-Model header (which
+# SageMaker sets from the TargetModel parameter of InvokeEndpoint), and the model is loaded from
+# <models directory>/<model id> on first use. A model id like "tenant-a.tar.gz" is looked up in the
+# directory "tenant-a", i.e. the directory the archive was extracted to.
+#
+# Every worker keeps the models it loaded in a least recently used cache. When the models in the
+# cache take more memory than the budget, the least recently used models are evicted. Requests for a
+# model that is being loaded wait for that load instead of loading the model again.
+#
+# We set the following parameters:
+#
+# Parameter                Environment Variable              Default Value
+# ---------                --------------------              -------------
+# multi-model mode         SAGEMAKER_MULTI_MODEL             false
+# models directory         MODEL_SERVER_MODELS_DIR           /opt/ml/models
+# cache memory budget      MODEL_SERVER_MODEL_CACHE_MB       512 per worker
+
+from __future__ import print_function
+
+import os
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+multi_model = os.environ.get('SAGEMAKER_MULTI_MODEL', 'false').lower() == 'true'
+models_dir = os.environ.get('MODEL_SERVER_MODELS_DIR', '/opt/ml/models')
+model_cache_bytes = int(float(os.environ.get('MODEL_SERVER_MODEL_CACHE_MB', 512)) * 1024 * 1024)
+
+class ModelNotFoundError(Exception):
+    pass
+
+def get_model_dir(model_id, base_dir=None):
+    """Get the directory of a model
+
+    Arguments:
+        model_id {string} -- the model id, e.g. "tenant-a" or "tenant-a.tar.gz"
+
+    Keyword Arguments:
+        base_dir {string} -- the models directory (default: {None}, models_dir)
+
+    Returns:
+        string -- the model directory
+
+    Raises:
+        ModelNotFoundError -- if the id points outside of the models directory or the model does not exist
+    """
+    base_dir = os.path.abspath(base_dir or models_dir)
+    if model_id.endswith('.tar.gz'):
+        model_id = model_id[:-len('.tar.gz')]
+    model_dir = os.path.abspath(os.path.join(base_dir, model_id))
+    if not model_dir.startswith(base_dir + os.sep) or not os.path.isdir(model_dir):
+        raise ModelNotFoundError('Model {} does not exist.'.format(model_id))
+    return model_dir
+
+def estimate_size(model):
+    """Estimate the memory a model takes by the size of its pickle"""
+    return len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+
+class _PendingLoad(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.model = None
+        self.error = None
+
+class ModelCache(object):
+    def __init__(self, load, max_bytes=model_cache_bytes, size_of=estimate_size):
+        """A least recently used cache of loaded models with a memory budget
+
+        Arguments:
+            load {function} -- loads a model by id (the models are cached by the same id)
+
+        Keyword Arguments:
+            max_bytes {int} -- the memory budget of the cache (default: {model_cache_bytes})
+            size_of {function} -- estimates the memory a model takes (default: {estimate_size})
+        """
+        self.__load = load
+        self.__size_of = size_of
+        self.max_bytes = max_bytes
+        self.__models = OrderedDict()   # model id -> (model, size), the least recently used first
+        self.__pending = {}             # model id -> _PendingLoad
+        self.__lock = threading.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'waits': 0, 'loads': 0, 'load_errors': 0, 'load_seconds': 0.0, 'evictions': 0}
+        self.__load_seconds = {}
+
+    def get(self, model_id):
+        """Get a model, loading it if it is not in the cache
+
+        Arguments:
+            model_id {string} -- the model id
+
+        Returns:
+            the model
+        """
+        with self.__lock:
+            if model_id in self.__models:
+                self.__models.move_to_end(model_id)
+                self.__stats['hits'] += 1
+                return self.__models[model_id][0]
+            pending = self.__pending.get(model_id)
+            loading_elsewhere = pending is not None
+            if loading_elsewhere:
+                self.__stats['waits'] += 1
+            else:
+                pending = self.__pending[model_id] = _PendingLoad()
+                self.__stats['misses'] += 1
+
+        if loading_elsewhere:
+            # Another request is loading the model
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.model
+
+        start = time.time()
+        try:
+            model = self.__load(model_id)
+            size = self.__size_of(model)
+        except Exception as e:
+            with self.__lock:
+                del self.__pending[model_id]
+                self.__stats['load_errors'] += 1
+            pending.error = e
+            pending.done.set()
+            raise
+        seconds = time.time() - start
+
+        with self.__lock:
+            self.__models[model_id] = (model, size)
+            self.__stats['loads'] += 1
+            self.__stats['load_seconds'] += seconds
+            self.__load_seconds[model_id] = seconds
+            # Evict the least recently used models, but always keep the one that was just loaded
+            while len(self.__models) > 1 and self.__bytes() > self.max_bytes:
+                evicted, _ = self.__models.popitem(last=False)
+                del self.__load_seconds[evicted]
+                self.__stats['evictions'] += 1
+                print('Evicted model {} from the cache.'.format(evicted))
+            del self.__pending[model_id]
+        pending.model = model
+        pending.done.set()
+        print('Loaded model {} in {:.3f} seconds ({} bytes).'.format(model_id, seconds, size))
+        return model
+
+    def __bytes(self):
+        return sum(size for _, size in self.__models.values())
+
+    def stats(self):
+        """Get the cache counters and the loaded models
+
+        Returns:
+            dict -- the counters, the memory used and budget, and the size and load time of each
+                    loaded model, the most recently used last
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['bytes'] = self.__bytes()
+            stats['max_bytes'] = self.max_bytes
+            stats['models'] = [
+                {'model': model_id, 'bytes': size, 'load_seconds': self.__load_seconds.get(model_id)}
+                for model_id, (_, size) in self.__models.items()
+            ]
+            return stats
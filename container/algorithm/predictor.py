@@ -5,7 +5,6 @@ from __future__ import print_function
 
 import os
 import json
-from joblib import load
 import io
 import sys
 import signal
@@ -15,8 +14,15 @@ import flask
 
 import pandas as pd
 
+import admission
+import content_encoding
+import model_cache
+import execution_parameters
+from artifacts import load_model
+
 prefix = '/opt/ml/'
-model_path = os.path.join(prefix, 'model')
+# MODEL_SERVER_MODEL_DIR serves a model from another directory, e.g. in deploy/local_test/simulate_pipeline.py
+model_path = os.environ.get('MODEL_SERVER_MODEL_DIR', os.path.join(prefix, 'model'))
 
 # A singleton for holding the model. This simply loads the model and holds it.
 # It has a predict function that does a prediction based on the model and the input data.
@@ -28,27 +34,42 @@ class ScoringService(object):
     def get_model(cls):
         """Get the model object for this instance, loading it if it's not already loaded."""
         if cls.model == None:
-            cls.model = load(os.path.join(model_path, 'model.joblib'))
+            cls.model = load_model(model_path)
         return cls.model
 
     @classmethod
-    def predict(cls, input):
+    def predict(cls, input, model_id=None):
         """For the input, do the predictions and return them.
 
         Args:
             input (a pandas dataframe): The data on which to do the predictions. There will be
-                one prediction per row in the dataframe"""
-        clf = cls.get_model()
+                one prediction per row in the dataframe
+            model_id (string): In multi-model mode, the model to use (see model_cache.py)"""
+        if model_id is not None:
+            # Cached by directory, so different ids for the same model share one copy
+            clf = models.get(model_cache.get_model_dir(model_id))
+        else:
+            clf = cls.get_model()
         return clf.predict(input)
 
+# The models of a multi-model endpoint, see model_cache.py
+models = model_cache.ModelCache(load=load_model)
+
 # The flask app for serving predictions
 app = flask.Flask(__name__)
 
+# Bounds the work each worker takes on, see admission.py
+admission_controller = admission.AdmissionController()
+
 @app.route('/ping', methods=['GET'])
 def ping():
     """Determine if the container is working and healthy. In this sample container, we declare
     it healthy if we can load the model successfully."""
-    health = ScoringService.get_model() is not None  # You can insert a health check here
+    if model_cache.multi_model:
+        # The models are loaded when they are first requested
+        health = os.path.isdir(model_cache.models_dir)
+    else:
+        health = ScoringService.get_model() is not None  # You can insert a health check here
 
     status = 200 if health else 404
     return flask.Response(response='\n', status=status, mimetype='application/json')
@@ -59,24 +80,72 @@ def transformation():
     it to a pandas data frame for internal use and then convert the predictions back to CSV (which really
     just means one prediction per line, since there's a single column.
     """
-    data = None
-
-    # Convert from CSV to pandas
-    if flask.request.content_type == 'text/csv':
-        data = flask.request.data.decode('utf-8')
-        s = io.StringIO(data)
-        data = pd.read_csv(s, header=None)
-    else:
+    if flask.request.content_type != 'text/csv':
         return flask.Response(response='This predictor only supports CSV data', status=415, mimetype='text/plain')
 
-    print('Invoked with {} records'.format(data.shape[0]))
-
-    # Do the prediction
-    predictions = ScoringService.predict(data)
-
-    # Convert from numpy back to CSV
-    out = io.StringIO()
-    pd.DataFrame({'results':predictions}).to_csv(out, header=False, index=False)
-    result = out.getvalue()
-
-    return flask.Response(response=result, status=200, mimetype='text/csv')
+    model_id = None
+    if model_cache.multi_model:
+        model_id = flask.request.headers.get('X-Amzn-SageMaker-Target-Model')
+        if not model_id:
+            return flask.Response(response='The X-Amzn-SageMaker-Target-Model header is required', status=400, mimetype='text/plain')
+
+    # Decompress the body if it has a Content-Encoding, within a size limit (see content_encoding.py)
+    try:
+        payload = content_encoding.read_body(flask.request.stream, flask.request.headers.get('Content-Encoding'))
+    except content_encoding.UnsupportedEncodingError as e:
+        return flask.Response(response=str(e), status=415, mimetype='text/plain')
+    except content_encoding.PayloadTooLargeError as e:
+        return flask.Response(response=str(e), status=413, mimetype='text/plain')
+    except content_encoding.InvalidPayloadError as e:
+        return flask.Response(response=str(e), status=400, mimetype='text/plain')
+
+    # Reject the request right away if this worker is already busy enough (see admission.py)
+    rows = admission.count_rows(payload)
+    queue_seconds = admission.parse_queue_seconds(flask.request.headers.get('X-Request-Start'))
+    rejection = admission_controller.try_acquire(rows, queue_seconds)
+    if rejection is not None:
+        return flask.Response(
+            response='The server is overloaded ({}). Retry later.'.format(rejection),
+            status=503,
+            mimetype='text/plain',
+            headers={'Retry-After': str(admission.retry_after_seconds)}
+        )
+
+    try:
+        print('Invoked with {} records after {:.3f} seconds in the queue'.format(rows, queue_seconds))
+        try:
+            result = transform_csv(payload, model_id=model_id)
+        except model_cache.ModelNotFoundError as e:
+            return flask.Response(response=str(e), status=404, mimetype='text/plain')
+    finally:
+        admission_controller.release(rows)
+
+    # Compress the response if it is large enough and the client accepts it
+    body, encoding = content_encoding.encode_body(result.encode('utf-8'), flask.request.headers.get('Accept-Encoding'))
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return flask.Response(response=body, status=200, mimetype='text/csv', headers=headers)
+
+def transform_csv(payload, model_id=None):
+    """Score a CSV payload with one record per line, e.g. a MultiRecord batch from Batch Transform
+    with SplitType Line, and return one prediction per line."""
+    # Parse the bytes directly instead of decoding them to a string first
+    data = pd.read_csv(io.BytesIO(payload), header=None)
+    predictions = ScoringService.predict(data, model_id=model_id)
+    # Much faster than writing a data frame with to_csv, for the same output
+    return ''.join('{}\n'.format(x) for x in predictions)
+
+@app.route('/execution-parameters', methods=['GET'])
+def get_execution_parameters():
+    """The concurrency and payload size for SageMaker Batch Transform, see execution_parameters.py"""
+    model = None if model_cache.multi_model else ScoringService.get_model()
+    parameters = execution_parameters.get_execution_parameters(transform_csv, model)
+    return flask.Response(response=json.dumps(parameters), status=200, mimetype='application/json')
+
+@app.route('/models', methods=['GET'])
+def model_stats():
+    """Get the model cache counters and the loaded models of the worker that handles the request"""
+    stats = models.stats()
+    stats['pid'] = os.getpid()
+    return flask.Response(response=json.dumps(stats), status=200, mimetype='application/json')
@@ -0,0 +1,214 @@
+# Preprocessing of the features: imputation of missing values, scaling and encoding of categorical
+# columns. It is fitted on the training data by train.py and saved together with the model as one
+# artifact (PreprocessedModel), so the inference server applies exactly the preprocessing the model
+# was trained with, and callers send the raw columns.
+#
+# The fitted preprocessing is kept as a few flat arrays (fill values, offsets, multipliers and the
+# categories of every categorical column), so transform is a single pass that writes every output
+# column into one preallocated array, instead of a chain of DataFrame operations that copies the data
+# at every step. The numeric columns come first, then the encoded categorical columns.
+#
+# It behaves like the scikit-learn pipeline SimpleImputer -> StandardScaler/MinMaxScaler for the
+# numeric columns and SimpleImputer(most_frequent) -> OneHotEncoder(handle_unknown='ignore') or
+# OrdinalEncoder for the categorical columns (test checks that they agree), except that:
+#   - a numeric column without any values is imputed with 0 instead of being dropped
+#   - a missing categorical value that is not imputed is treated like an unknown category
+#   - ordinal encoding gives unknown categories the code -1
+#
+# Hyperparameters (preprocessing is off unless one of impute, scale or categorical_columns is set):
+#
+#   impute                  none (default), mean, median or most_frequent. Missing categorical values
+#                           are always imputed with the most frequent category.
+#   scale                   none (default), standard or minmax
+#   categorical_columns     the comma separated indices of the categorical feature columns, where 0 is
+#                           the first column after the label, e.g. "0,3"
+#   categorical_encoding    onehot (default) or ordinal
+
+from __future__ import print_function
+
+import numpy as np
+import pandas as pd
+
+from sklearn.base import BaseEstimator, TransformerMixin
+
+IMPUTE_STRATEGIES = ['none', 'mean', 'median', 'most_frequent']
+SCALERS = ['none', 'standard', 'minmax']
+CATEGORICAL_ENCODINGS = ['onehot', 'ordinal']
+
+def parse_settings(hyperparameters):
+    """Get the preprocessing settings from the hyperparameters
+
+    Arguments:
+        hyperparameters {dict} -- the hyperparameters of the training job (all values are strings)
+
+    Returns:
+        dict -- the Preprocessor arguments, or None if there is no preprocessing to do
+    """
+    impute = str(hyperparameters.get('impute', 'none')).lower()
+    scale = str(hyperparameters.get('scale', 'none')).lower()
+    encoding = str(hyperparameters.get('categorical_encoding', 'onehot')).lower()
+    columns = str(hyperparameters.get('categorical_columns', '')).strip()
+    for name, value, valid in [('impute', impute, IMPUTE_STRATEGIES), ('scale', scale, SCALERS), ('categorical_encoding', encoding, CATEGORICAL_ENCODINGS)]:
+        if value not in valid:
+            raise ValueError('Unknown {} "{}". Valid values are: {}'.format(name, value, ', '.join(valid)))
+    categorical_columns = tuple(int(x) for x in columns.split(',') if x.strip()) if columns else ()
+
+    if impute == 'none' and scale == 'none' and not categorical_columns:
+        return None
+    return {'impute': impute, 'scale': scale, 'categorical_columns': categorical_columns, 'categorical_encoding': encoding}
+
+def _to_array(X):
+    """Get the values of a data frame or array without copying them if possible"""
+    return X.to_numpy() if isinstance(X, pd.DataFrame) else np.asarray(X)
+
+def _most_frequent(values):
+    """Get the most frequent value, the smallest one if there is a tie (like SimpleImputer)"""
+    unique, counts = np.unique(values, return_counts=True)
+    return unique[np.argmax(counts)]
+
+def _handle_zeros(scale):
+    """Replace (close to) zero scales with 1, so constant columns are not divided by zero"""
+    scale = scale.copy()
+    scale[scale < 10 * np.finfo(scale.dtype).eps] = 1.0
+    return scale
+
+class Preprocessor(BaseEstimator, TransformerMixin):
+    def __init__(self, impute='none', scale='none', categorical_columns=(), categorical_encoding='onehot'):
+        """Imputes, scales and encodes the feature columns (see the top of this file)
+
+        Keyword Arguments:
+            impute {string} -- the imputation of the numeric columns (default: {'none'})
+            scale {string} -- the scaling of the numeric columns (default: {'none'})
+            categorical_columns {tuple} -- the indices of the categorical columns (default: {()})
+            categorical_encoding {string} -- 'onehot' or 'ordinal' (default: {'onehot'})
+        """
+        self.impute = impute
+        self.scale = scale
+        self.categorical_columns = categorical_columns
+        self.categorical_encoding = categorical_encoding
+
+    def fit(self, X, y=None):
+        """Fit the preprocessing to the training data
+
+        Arguments:
+            X {pandas.DataFrame or numpy.ndarray} -- the feature columns
+
+        Returns:
+            Preprocessor -- self
+        """
+        values = _to_array(X)
+        self.n_features_in_ = values.shape[1]
+        categorical = sorted(set(self.categorical_columns))
+        if any(not 0 <= x < self.n_features_in_ for x in categorical):
+            raise ValueError('The categorical columns {} are not all between 0 and {}.'.format(categorical, self.n_features_in_ - 1))
+        self.categorical_columns_ = np.array(categorical, dtype=np.intp)
+        self.numeric_columns_ = np.array([x for x in range(self.n_features_in_) if x not in categorical], dtype=np.intp)
+
+        numeric = values[:, self.numeric_columns_].astype(np.float64)
+        missing = np.isnan(numeric)
+        self.fill_values_ = None
+        if self.impute != 'none':
+            fill_values = np.zeros(numeric.shape[1])
+            for i in range(numeric.shape[1]):
+                present = numeric[~missing[:, i], i]
+                if len(present) == 0:
+                    continue
+                if self.impute == 'mean':
+                    fill_values[i] = present.mean()
+                elif self.impute == 'median':
+                    fill_values[i] = np.median(present)
+                else:
+                    fill_values[i] = _most_frequent(present)
+            self.fill_values_ = fill_values
+            # The scaling is fitted to the imputed data, like in a pipeline
+            numeric = np.where(missing, fill_values, numeric)
+
+        self.offsets_ = self.multipliers_ = None
+        if self.scale == 'standard':
+            self.offsets_ = np.nanmean(numeric, axis=0)
+            self.multipliers_ = 1.0 / _handle_zeros(np.nanstd(numeric, axis=0))
+        elif self.scale == 'minmax':
+            self.offsets_ = np.nanmin(numeric, axis=0)
+            self.multipliers_ = 1.0 / _handle_zeros(np.nanmax(numeric, axis=0) - self.offsets_)
+
+        # The categories of every categorical column, sorted, and the code to impute missing values with
+        self.categories_ = []
+        self.category_fill_codes_ = []
+        for column in self.categorical_columns_:
+            column_values = values[:, column]
+            present = column_values[~pd.isnull(column_values)]
+            categories = np.unique(present)
+            self.categories_.append(categories)
+            fill_code = -1
+            if self.impute != 'none' and len(present) > 0:
+                fill_code = int(np.searchsorted(categories, _most_frequent(present)))
+            self.category_fill_codes_.append(fill_code)
+
+        if self.categorical_encoding == 'onehot':
+            self.categorical_widths_ = [len(x) for x in self.categories_]
+        else:
+            self.categorical_widths_ = [1] * len(self.categories_)
+        self.n_output_features_ = len(self.numeric_columns_) + sum(self.categorical_widths_)
+        return self
+
+    def transform(self, X):
+        """Preprocess the feature columns
+
+        Arguments:
+            X {pandas.DataFrame or numpy.ndarray} -- the raw feature columns, like in training
+
+        Returns:
+            numpy.ndarray -- the preprocessed features (float64), the numeric columns first
+        """
+        values = _to_array(X)
+        if values.ndim != 2 or values.shape[1] != self.n_features_in_:
+            raise ValueError('Expected {} feature columns, got {}.'.format(self.n_features_in_, values.shape[-1]))
+        rows = values.shape[0]
+        out = np.empty((rows, self.n_output_features_), dtype=np.float64)
+
+        # The numeric columns, updated in place
+        numeric = out[:, :len(self.numeric_columns_)]
+        if values.dtype == np.float64:
+            np.take(values, self.numeric_columns_, axis=1, out=numeric, mode='clip')
+        else:
+            numeric[...] = values[:, self.numeric_columns_]
+        if self.fill_values_ is not None:
+            np.copyto(numeric, self.fill_values_, where=np.isnan(numeric))
+        if self.offsets_ is not None:
+            numeric -= self.offsets_
+            numeric *= self.multipliers_
+
+        # The categorical columns. Unknown categories get the code -1.
+        start = len(self.numeric_columns_)
+        for column, categories, fill_code, width in zip(self.categorical_columns_, self.categories_, self.category_fill_codes_, self.categorical_widths_):
+            column_values = values[:, column]
+            codes = pd.Index(categories).get_indexer(column_values)
+            if fill_code >= 0:
+                codes[pd.isnull(column_values)] = fill_code
+            if self.categorical_encoding == 'onehot':
+                block = out[:, start:start + width]
+                block.fill(0.0)
+                known = np.flatnonzero(codes >= 0)
+                block[known, codes[known]] = 1.0
+            else:
+                out[:, start] = codes
+            start += width
+        return out
+
+class PreprocessedModel(object):
+    """A model with the preprocessing it was trained with, saved and loaded as one artifact"""
+
+    def __init__(self, preprocessor, model):
+        """
+        Arguments:
+            preprocessor {Preprocessor} -- the fitted preprocessing
+            model -- the model, fitted to the output of the preprocessing
+        """
+        self.preprocessor = preprocessor
+        self.model = model
+        self.classes_ = model.classes_
+        # The number of raw feature columns the model takes
+        self.n_features_in_ = self.n_features_ = preprocessor.n_features_in_
+
+    def predict(self, X):
+        return self.model.predict(self.preprocessor.transform(X))
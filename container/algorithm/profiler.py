@@ -0,0 +1,197 @@
+# A lightweight profiler for the training job. It times each phase of training and samples the
+# peak resident memory and CPU utilization of the process while a phase runs. The results are
+# printed in the same "::name::metric::value::" format as the cross-validation accuracy so they
+# can be picked up by the MetricDefinitions in sagemaker-settings.json, and they are also written
+# as a JSON document to the output data directory.
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+
+def get_rss_mb():
+    """Get the current resident set size of this process in MB
+
+    Returns:
+        float -- the current RSS in MB, or None if it could not be read
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * resource.getpagesize() / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def get_peak_rss_mb():
+    """Get the peak resident set size of this process (and any finished children) in MB
+
+    Returns:
+        float -- the peak RSS in MB
+    """
+    # ru_maxrss is reported in kilobytes on Linux
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self_peak, children_peak) / 1024.0
+
+
+def get_cpu_seconds():
+    """Get the CPU time (user + system) used so far by this process and its finished children
+
+    Returns:
+        float -- CPU seconds
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (self_usage.ru_utime + self_usage.ru_stime +
+            children_usage.ru_utime + children_usage.ru_stime)
+
+
+class PhaseProfiler(object):
+    """Times the phases of a training job and samples memory while they run
+
+    The metrics of a phase are printed as soon as it ends, so a job that fails or is killed in a
+    later phase still reports the phases it finished.
+
+    Usage:
+        profiler = PhaseProfiler()
+        with profiler.phase('fit'):
+            clf.fit(X, y)
+        profiler.report()
+        profiler.write(output_data_path)
+    """
+
+    def __init__(self, sample_interval=0.1):
+        """
+        Keyword Arguments:
+            sample_interval {float} -- seconds between memory samples while a phase runs (default: {0.1})
+        """
+        self.sample_interval = sample_interval
+        self.phases = []
+        self.__start_wall = time.time()
+        self.__start_cpu = get_cpu_seconds()
+
+    @contextmanager
+    def phase(self, name):
+        """Profile the code run inside the with-block as the phase called name
+
+        Arguments:
+            name {string} -- the phase name (e.g. "load", "fit", "cv", "dump")
+        """
+        samples = []
+        stop = threading.Event()
+
+        def sample():
+            while not stop.is_set():
+                rss = get_rss_mb()
+                if rss is not None:
+                    samples.append(rss)
+                stop.wait(self.sample_interval)
+
+        sampler = threading.Thread(target=sample)
+        sampler.daemon = True
+
+        start_wall = time.time()
+        start_cpu = get_cpu_seconds()
+        sampler.start()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            stop.set()
+            sampler.join()
+            wall_seconds = time.time() - start_wall
+            cpu_seconds = get_cpu_seconds() - start_cpu
+            rss = get_rss_mb()
+            if rss is not None:
+                samples.append(rss)
+
+            self.phases.append({
+                'name': name,
+                'seconds': wall_seconds,
+                'cpu_seconds': cpu_seconds,
+                'cpu_utilization': self.__utilization(cpu_seconds, wall_seconds),
+                'peak_rss_mb': max(samples) if samples else None,
+                'failed': failed
+            })
+            self.__print_phase(self.phases[-1])
+
+    @staticmethod
+    def __utilization(cpu_seconds, wall_seconds):
+        """CPU utilization as a percentage of one core (so 200 means two cores were busy)"""
+        if wall_seconds <= 0:
+            return 0.0
+        return 100.0 * cpu_seconds / wall_seconds
+
+    def summary(self):
+        """Summarize the profile of the whole job
+
+        Returns:
+            dict -- the overall timings, peak RSS and CPU utilization along with the per-phase results
+        """
+        wall_seconds = time.time() - self.__start_wall
+        cpu_seconds = get_cpu_seconds() - self.__start_cpu
+        phase_peaks = [x['peak_rss_mb'] for x in self.phases if x['peak_rss_mb'] is not None]
+        return {
+            'total_seconds': wall_seconds,
+            'cpu_seconds': cpu_seconds,
+            'cpu_utilization': self.__utilization(cpu_seconds, wall_seconds),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': max([get_peak_rss_mb()] + phase_peaks),
+            'phases': self.phases
+        }
+
+    @staticmethod
+    def __print_phase(phase):
+        """Print the metrics of a phase to the logs
+
+        Each value is printed on its own line so it can be picked up by a regex such as
+        "::profile::fit::seconds::([0-9.]+)::" in the MetricDefinitions. The output is flushed, so
+        the lines are not lost in the buffer if the process is killed (e.g. out of memory).
+        """
+        print('::profile::{}::seconds::{:.6f}::'.format(phase['name'], phase['seconds']))
+        print('::profile::{}::cpu_utilization::{:.2f}::'.format(phase['name'], phase['cpu_utilization']))
+        if phase['peak_rss_mb'] is not None:
+            print('::profile::{}::peak_rss_mb::{:.2f}::'.format(phase['name'], phase['peak_rss_mb']))
+        if phase['failed']:
+            print('Phase {} failed after {:.3f} seconds.'.format(phase['name'], phase['seconds']))
+        sys.stdout.flush()
+
+    def report(self):
+        """Print the totals of the job to the logs
+
+        The phases are printed when they end (see phase), so this only adds the totals, in the
+        same format, e.g. "::profile::total::seconds::([0-9.]+)::".
+        """
+        summary = self.summary()
+        print('::profile::total::seconds::{:.6f}::'.format(summary['total_seconds']))
+        print('::profile::total::cpu_utilization::{:.2f}::'.format(summary['cpu_utilization']))
+        print('::profile::total::peak_rss_mb::{:.2f}::'.format(summary['peak_rss_mb']))
+        sys.stdout.flush()
+        return summary
+
+    def write(self, directory, file_name='profile.json'):
+        """Write the profile as JSON
+
+        Arguments:
+            directory {string} -- the directory to write to (e.g. /opt/ml/output/data)
+
+        Keyword Arguments:
+            file_name {string} -- the name of the JSON file (default: {'profile.json'})
+
+        Returns:
+            string -- the path of the written file
+        """
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        file_path = os.path.join(directory, file_name)
+        with open(file_path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        return file_path
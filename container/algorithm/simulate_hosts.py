@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Simulates a multi-instance training job on one machine. Every host is a separate process with its
+# own /opt/ml-like directory, containing the resourceConfig.json and inputdataconfig.json that
+# SageMaker would write for that host. The hosts find the leader on 127.0.0.1 (see distributed.py).
+#
+# With --distribution ShardedByS3Key the training files are divided over the hosts by key, like
+# SageMaker does. A host without files sends an empty shard to the leader. With FullyReplicated (the
+# default) every host gets all files and keeps its own share of the rows.
+#
+# Usage:
+#   python simulate_hosts.py [--hosts 3] [--distribution FullyReplicated|ShardedByS3Key] [--data ../local_test/test_dir/input/data/train]
+#                            [--hyperparameters '{"max_leaf_nodes": "4"}'] [--directory /tmp/hosts]
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import socket
+import argparse
+import tempfile
+import multiprocessing
+
+import train
+import distributed
+
+def _run_host(prefix, port):
+    """Run train() as one host of the simulated cluster (runs in a child process)"""
+    # All hosts run on this machine
+    os.environ['SHARD_EXCHANGE_LEADER_ADDRESS'] = '127.0.0.1'
+    distributed.shard_exchange_port = port
+    train.param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
+    train.resource_config_path = os.path.join(prefix, 'input/config/resourceConfig.json')
+    train.input_data_config_path = os.path.join(prefix, 'input/config/inputdataconfig.json')
+    train.training_path = os.path.join(prefix, 'input/data', train.channel_name)
+    train.model_path = os.path.join(prefix, 'model')
+    train.output_path = os.path.join(prefix, 'output')
+    train.output_data_path = os.path.join(prefix, 'output/data')
+    train.train()
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def simulate(data_path, host_count, distribution='FullyReplicated', hyperparameters=None, directory=None):
+    """Run a training job on host_count simulated hosts
+
+    Arguments:
+        data_path {string} -- the directory with the training files
+        host_count {int} -- the number of hosts
+
+    Keyword Arguments:
+        distribution {string} -- FullyReplicated or ShardedByS3Key (default: {'FullyReplicated'})
+        hyperparameters {dict} -- the training hyperparameters (default: {None})
+        directory {string} -- the directory for the hosts' files (default: {None}, a temporary directory)
+
+    Returns:
+        string -- the directory of the leader, where the model was saved
+    """
+    directory = directory or tempfile.mkdtemp()
+    hosts = ['algo-{}'.format(x + 1) for x in range(host_count)]
+    files = sorted(os.listdir(data_path))
+    port = _free_port()
+
+    processes = []
+    for rank, host in enumerate(hosts):
+        prefix = os.path.join(directory, host)
+        for path in ['input/config', 'input/data/' + train.channel_name, 'model', 'output/data']:
+            os.makedirs(os.path.join(prefix, path), exist_ok=True)
+        with open(os.path.join(prefix, 'input/config/hyperparameters.json'), 'w') as f:
+            json.dump(hyperparameters or {}, f)
+        with open(os.path.join(prefix, 'input/config/resourceConfig.json'), 'w') as f:
+            json.dump({'current_host': host, 'hosts': hosts}, f)
+        with open(os.path.join(prefix, 'input/config/inputdataconfig.json'), 'w') as f:
+            json.dump({train.channel_name: {'S3DistributionType': distribution, 'TrainingInputMode': 'File'}}, f)
+
+        host_files = files[rank::host_count] if distribution == 'ShardedByS3Key' else files
+        for name in host_files:
+            shutil.copy(os.path.join(data_path, name), os.path.join(prefix, 'input/data', train.channel_name, name))
+
+        process = multiprocessing.get_context('spawn').Process(target=_run_host, args=(prefix, port))
+        process.start()
+        processes.append(process)
+
+    for process in processes:
+        process.join()
+    failed = [host for host, process in zip(hosts, processes) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError('Training failed on {}.'.format(', '.join(failed)))
+    return os.path.join(directory, hosts[0])
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a multi-instance training job with local processes.')
+    parser.add_argument('--hosts', type=int, default=3)
+    parser.add_argument('--distribution', default='FullyReplicated', choices=['FullyReplicated', 'ShardedByS3Key'])
+    parser.add_argument('--data', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '../local_test/test_dir/input/data/train'))
+    parser.add_argument('--hyperparameters', type=json.loads, default=None, help='the hyperparameters as a JSON object')
+    parser.add_argument('--directory', default=None, help="the directory for the hosts' files (default: a temporary directory)")
+    args = parser.parse_args()
+
+    try:
+        leader = simulate(args.data, args.hosts, args.distribution, hyperparameters=args.hyperparameters, directory=args.directory)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    print('The model was saved in {}'.format(os.path.join(leader, 'model')))
+
+if __name__ == '__main__':
+    main()
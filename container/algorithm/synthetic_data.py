@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# Generates synthetic training data with the same layout as the template's training data: CSV files
+# without a header, the label in the first column and the features in the remaining columns.
+#
+# The features of each class are normally distributed around a class center, so the classes can be
+# learned. To make the generator fast enough to use inside benchmarks, the CSV text is not formatted
+# value by value: every feature is written with a fixed width ("+1.2345"), so a whole block of rows
+# can be assembled as one array of characters with numpy and written out in one call.
+#
+# Usage:
+#   python synthetic_data.py <output directory> [--rows 1000000] [--columns 20] [--classes 3] [--shards 4]
+
+from __future__ import print_function
+
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+FEATURE_WIDTH = 8           # "+1.2345," -- sign, digit, point, 4 decimals and the separator
+FEATURE_LIMIT = 9.9999      # the largest magnitude that fits in the fixed width
+
+def _class_centers(columns, classes, seed):
+    """Random class centers, so that the classes are separable but overlap"""
+    rng = np.random.RandomState(seed)
+    return rng.uniform(-2.0, 2.0, size=(classes, columns))
+
+def _label_width(classes):
+    return len(str(classes - 1))
+
+def label_names(classes):
+    """The label of each class, e.g. class_0, class_1, ... (zero padded so they have the same width)"""
+    width = _label_width(classes)
+    return np.array(['class_{}'.format(str(x).zfill(width)) for x in range(classes)])
+
+def generate_block(rows, columns, classes, seed, centers=None):
+    """Generate a block of labels and features
+
+    Arguments:
+        rows {int} -- the number of rows
+        columns {int} -- the number of feature columns
+        classes {int} -- the number of classes
+        seed {int} -- the random seed
+
+    Keyword Arguments:
+        centers {numpy.ndarray} -- the class centers (default: {None}, which derives them from the seed)
+
+    Returns:
+        tuple -- (class index for each row, float32 feature matrix)
+    """
+    if centers is None:
+        centers = _class_centers(columns, classes, seed)
+    rng = np.random.RandomState(seed)
+    y = rng.randint(0, classes, size=rows)
+    X = rng.standard_normal((rows, columns)).astype(np.float32)
+    X += centers[y].astype(np.float32)
+    np.clip(X, -FEATURE_LIMIT, FEATURE_LIMIT, out=X)
+    return y, X
+
+def make_frame(rows, columns=4, classes=3, seed=0):
+    """Generate an in-memory training data frame (label in the first column)
+
+    Arguments:
+        rows {int} -- the number of rows
+
+    Keyword Arguments:
+        columns {int} -- the number of feature columns (default: {4})
+        classes {int} -- the number of classes (default: {3})
+        seed {int} -- the random seed (default: {0})
+
+    Returns:
+        pandas.DataFrame -- the data, drawn from the same distribution that write_shards writes
+    """
+    y, X = generate_block(rows, columns, classes, seed)
+    frame = pd.DataFrame(np.round(X.astype(np.float64), 4), columns=range(1, columns + 1))
+    frame.insert(0, 0, label_names(classes)[y])
+    return frame
+
+def format_block(y, X, classes, include_labels=True):
+    """Format a block of rows as CSV bytes
+
+    Arguments:
+        y {numpy.ndarray} -- the class index of each row
+        X {numpy.ndarray} -- the features
+        classes {int} -- the number of classes
+
+    Keyword Arguments:
+        include_labels {bool} -- False to only write the features, like an /invocations payload (default: {True})
+
+    Returns:
+        bytes -- the CSV text
+    """
+    rows, columns = X.shape
+    label_width = len('class_') + _label_width(classes) + 1 if include_labels else 0
+    line = np.empty((rows, label_width + columns * FEATURE_WIDTH), dtype=np.uint8)
+
+    if include_labels:
+        line[:, :label_width] = np.frombuffer(
+            b''.join(x.encode('ascii') + b',' for x in label_names(classes)), dtype=np.uint8
+        ).reshape(classes, label_width)[y]
+
+    # Fixed point digits of every feature: sign, units, '.', 4 decimals, ','
+    scaled = np.rint(np.abs(X) * 10000).astype(np.int32)
+    fields = line[:, label_width:].reshape(rows, columns, FEATURE_WIDTH)
+    fields[:, :, 0] = np.where(X < 0, ord('-'), ord('+'))
+    fields[:, :, 1] = ord('0') + scaled // 10000
+    fields[:, :, 2] = ord('.')
+    fields[:, :, 3] = ord('0') + scaled // 1000 % 10
+    fields[:, :, 4] = ord('0') + scaled // 100 % 10
+    fields[:, :, 5] = ord('0') + scaled // 10 % 10
+    fields[:, :, 6] = ord('0') + scaled % 10
+    fields[:, :, 7] = ord(',')
+    line[:, -1] = ord('\n')
+    return line.tobytes()
+
+def write_shards(directory, rows, columns=4, classes=3, shards=1, seed=0, block_rows=100000, include_labels=True):
+    """Write synthetic data as CSV shards
+
+    Arguments:
+        directory {string} -- the directory to write the shards to (e.g. an input channel)
+        rows {int} -- the total number of rows
+
+    Keyword Arguments:
+        columns {int} -- the number of feature columns (default: {4})
+        classes {int} -- the number of classes (default: {3})
+        shards {int} -- the number of files to split the rows over (default: {1})
+        seed {int} -- the random seed (default: {0})
+        block_rows {int} -- the number of rows generated in memory at a time (default: {100000})
+        include_labels {bool} -- False to leave out the label column (default: {True})
+
+    Returns:
+        list -- the paths of the written files
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    centers = _class_centers(columns, classes, seed)
+
+    paths = []
+    block = 0
+    for shard in range(shards):
+        path = os.path.join(directory, 'synthetic-{:05d}.csv'.format(shard))
+        shard_rows = rows // shards + (1 if shard < rows % shards else 0)
+        with open(path, 'wb') as f:
+            for start in range(0, shard_rows, block_rows):
+                size = min(block_rows, shard_rows - start)
+                y, X = generate_block(size, columns, classes, seed + block, centers=centers)
+                f.write(format_block(y, X, classes, include_labels=include_labels))
+                block += 1
+        paths.append(path)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic training data as CSV shards')
+    parser.add_argument('directory', help='where to write the shards')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--classes', type=int, default=3)
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-labels', action='store_true', help='only write the features (for scoring)')
+    args = parser.parse_args()
+
+    paths = write_shards(args.directory, args.rows, args.columns, args.classes, args.shards, args.seed,
+                         include_labels=not args.no_labels)
+    print('Wrote {} rows to {} files in {}'.format(args.rows, len(paths), args.directory))
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,6 @@ from __future__ import print_function
 
 import os
 import json
-from joblib import dump
 import sys
 import traceback
 
@@ -16,16 +15,27 @@ import numpy as np
 import pandas as pd
 
 from sklearn import tree
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
+from sklearn.pipeline import make_pipeline
 from sklearn.model_selection import cross_val_score, StratifiedKFold
 
+import compaction
+import distributed
+import preprocessing
+from artifacts import save_model, parse_format
+from profiler import PhaseProfiler
+
 # These are the paths to where SageMaker mounts interesting things in your container.
 
 prefix = '/opt/ml/'
 
 input_path = prefix + 'input/data'
 output_path = os.path.join(prefix, 'output')
+output_data_path = os.path.join(output_path, 'data')
 model_path = os.path.join(prefix, 'model')
 param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
+resource_config_path = os.path.join(prefix, 'input/config/resourceConfig.json')
+input_data_config_path = os.path.join(prefix, 'input/config/inputdataconfig.json')
 
 # This algorithm has a single channel of input data called 'training'. Since we run in
 # File mode, the input files are copied to the directory specified here.
@@ -35,50 +45,130 @@ training_path = os.path.join(input_path, channel_name)
 # The function to execute the training.
 def train():
     print('Starting the training.')
+    # Times each phase of the training and samples its memory usage
+    profiler = PhaseProfiler()
     try:
         # Read in any hyperparameters that the user passed with the training job
         with open(param_path, 'r') as tc:
             trainingParams = json.load(tc)
+        # The format of the saved model (see artifacts.py), checked before any of the work is done
+        model_format = trainingParams.get('model_format', None)
+        parse_format(model_format)
+
+        # With several instances, every host trains on its own shard of the data (see distributed.py)
+        host_info = distributed.read_host_info(resource_config_path)
+        host_count = len(host_info['hosts'])
 
         # Take the set of files and read them all into a single pandas dataframe
         input_files = [ os.path.join(training_path, file) for file in os.listdir(training_path) ]
+        if len(input_files) == 0 and host_count > 1:
+            # With ShardedByS3Key a host can get no files. It still sends its (empty) shard, so the
+            # leader doesn't wait for it, and the leader fails if none of the hosts has data
+            print('There are no files in {}. Sending an empty shard.'.format(training_path))
+            with profiler.phase('combine'):
+                clf, cv_accuracy = distributed.exchange(host_info, None, rows=0, cv_accuracy=None)
+            if clf is not None:
+                print('Combined the models of {} hosts.'.format(len(clf.models)))
+                print_cross_validation_score(5, cv_accuracy)
+                with profiler.phase('dump'):
+                    save_model(clf, model_path, model_format=model_format)
+            profiler.report()
+            profiler.write(output_data_path)
+            print('Training complete.')
+            return
         if len(input_files) == 0:
             raise ValueError(('There are no files in {}.\n' +
                               'This usually indicates that the channel ({}) was incorrectly specified,\n' +
                               'the data specification in S3 was incorrectly specified or the role specified\n' +
                               'does not have permission to access the data.').format(training_path, channel_name))
-        raw_data = [ pd.read_csv(file, header=None) for file in input_files ]
-        train_data = pd.concat(raw_data)
+        with profiler.phase('load'):
+            raw_data = [ pd.read_csv(file, header=None) for file in input_files ]
+            train_data = pd.concat(raw_data)
+            if host_count > 1 and distributed.read_distribution(input_data_config_path, channel_name) != 'ShardedByS3Key':
+                train_data = distributed.select_shard(train_data, host_info['rank'], host_count)
 
         # labels are in the first column
         train_y = train_data.iloc[:,0]
         train_X = train_data.iloc[:,1:]
 
-        # Here we only support a single hyperparameter. Note that hyperparameters are always passed in as
-        # strings, so we need to do any necessary conversions.
+        # Note that hyperparameters are always passed in as strings, so we need to do any necessary conversions.
         max_leaf_nodes = trainingParams.get('max_leaf_nodes', None)
         if max_leaf_nodes is not None:
             max_leaf_nodes = int(max_leaf_nodes)
 
-        # Now use scikit-learn's decision tree classifier to train the model.
-        clf = tree.DecisionTreeClassifier(max_leaf_nodes=max_leaf_nodes)
-        clf = clf.fit(train_X, train_y)
-
-        # Evaluate the model using cross-validation
-        cross_validate(
-            model=clf,
-            X=train_X,
-            y=train_y,
-            K=5
-        )
-
-        # save the model
-        dump(clf, os.path.join(model_path, 'model.joblib'))
+        # Optionally fit a preprocessing of the features (see preprocessing.py), which is saved with the model
+        preprocessing_settings = preprocessing.parse_settings(trainingParams)
+
+        # Now use scikit-learn's decision tree classifier (or an ensemble of trees) to train the model.
+        clf = make_estimator(trainingParams, max_leaf_nodes)
+
+        # Optionally compact the fitted model before saving it (see compaction.py). The compact model
+        # is checked on the training rows, except for pruning an ensemble, which needs a hold-out set
+        # that is kept out of the fit.
+        compact_model = str(trainingParams.get('compact_model', 'false')).lower() == 'true'
+        # The largest drop in hold-out accuracy allowed when dropping members of an ensemble
+        tolerance = trainingParams.get('compaction_tolerance', '0')
+        tolerance = None if str(tolerance).lower() == 'none' else float(tolerance)
+        fit_X, fit_y = train_X, train_y
+        holdout_X = holdout_y = None
+        if compact_model and compaction.needs_holdout(clf, tolerance):
+            holdout_fraction = float(trainingParams.get('compaction_holdout_fraction', 0.2))
+            fit_X, holdout_X, fit_y, holdout_y = compaction.split_holdout(train_X, train_y, holdout_fraction)
+
+        preprocessor = None
+        if preprocessing_settings is not None:
+            with profiler.phase('preprocess'):
+                preprocessor = preprocessing.Preprocessor(**preprocessing_settings).fit(fit_X)
+                fit_X = preprocessor.transform(fit_X)
+                if holdout_X is not None:
+                    holdout_X = preprocessor.transform(holdout_X)
+
+        with profiler.phase('fit'):
+            clf = clf.fit(fit_X, fit_y)
+
+        # Evaluate the model using cross-validation. The preprocessing is fitted again in every fold,
+        # so the score doesn't see the statistics of the validation fold.
+        with profiler.phase('cv'):
+            cv_accuracy = cross_validate(
+                model=clf if preprocessor is None else make_pipeline(preprocessing.Preprocessor(**preprocessing_settings), clf),
+                X=train_X,
+                y=train_y,
+                K=5,
+                print_score=host_count == 1
+            )
+
+        if compact_model:
+            check_X, check_y = (fit_X, fit_y) if holdout_X is None else (holdout_X, holdout_y)
+            with profiler.phase('compact'):
+                clf, report = compaction.compact(clf, check_X, check_y, tolerance=tolerance)
+            compaction.print_report(report)
+
+        if preprocessor is not None:
+            # The server applies the preprocessing to the raw request columns
+            clf = preprocessing.PreprocessedModel(preprocessor, clf)
+
+        if host_count > 1:
+            # Send the shard model to the first host, which saves an ensemble of all of them
+            with profiler.phase('combine'):
+                clf, cv_accuracy = distributed.exchange(host_info, clf, rows=len(train_y), cv_accuracy=cv_accuracy)
+            if clf is not None:
+                print('Combined the models of {} hosts.'.format(len(clf.models)))
+                print_cross_validation_score(5, cv_accuracy)
+
+        # save the model. The format can be changed with the "model_format" hyperparameter
+        # (see artifacts.py for the available formats).
+        if clf is not None:
+            with profiler.phase('dump'):
+                save_model(clf, model_path, model_format=model_format)
 
         # Example of writing data to the output data path
-        with open(os.path.join(output_path, 'data/sample.csv'), 'w') as f:
+        with open(os.path.join(output_data_path, 'sample.csv'), 'w') as f:
             f.write('1,2,3,4')
 
+        # The phases were printed as they ended. Add the totals and keep a copy with the output data
+        profiler.report()
+        profiler.write(output_data_path)
+
         print('Training complete.')
     except Exception as e:
         # Write out an error file. This will be returned as the failureReason in the
@@ -88,10 +178,33 @@ def train():
             s.write('Exception during training: ' + str(e) + '\n' + trc)
         # Printing this causes the exception to be in the training job logs, as well.
         print('Exception during training: ' + str(e) + '\n' + trc, file=sys.stderr)
+        # Keep the profile of the phases that ran, to see where the job failed
+        profiler.report()
+        profiler.write(output_data_path)
         # A non-zero exit code causes the training job to be marked as Failed.
         sys.exit(255)
 
-def cross_validate(model, X, y, K):
+def make_estimator(training_params, max_leaf_nodes):
+    """Create the estimator selected with the "estimator" hyperparameter
+
+    Arguments:
+        training_params {dict} -- the hyperparameters. "estimator" is decision_tree (the default),
+            random_forest or extra_trees, and "n_estimators" the number of trees of an ensemble (default 100)
+        max_leaf_nodes {int} -- the largest number of leaves of a tree, or None
+
+    Returns:
+        the (unfitted) scikit-learn estimator
+    """
+    estimator = str(training_params.get('estimator', 'decision_tree')).lower()
+    if estimator == 'decision_tree':
+        return tree.DecisionTreeClassifier(max_leaf_nodes=max_leaf_nodes)
+    ensembles = {'random_forest': RandomForestClassifier, 'extra_trees': ExtraTreesClassifier}
+    if estimator not in ensembles:
+        raise ValueError('Unknown estimator "{}". Valid estimators are: decision_tree, {}'.format(estimator, ', '.join(sorted(ensembles))))
+    n_estimators = int(training_params.get('n_estimators', 100))
+    return ensembles[estimator](n_estimators=n_estimators, max_leaf_nodes=max_leaf_nodes)
+
+def cross_validate(model, X, y, K, print_score=True):
     """Evaluate the model using K-fold cross-validation
     
     Arguments:
@@ -99,6 +212,13 @@ def cross_validate(model, X, y, K):
         X {[pandas.core.frame.DataFrame]} -- feature data
         y {[pandas.core.series.Series]} -- label data
         K {[int]} -- the number of folds to use for cross-validation
+
+    Keyword Arguments:
+        print_score {bool} -- False to only return the score, e.g. when it is combined with the scores
+            of other hosts first (default: {True})
+
+    Returns:
+        float -- the mean accuracy
     """
     score = cross_val_score(
         estimator=model,
@@ -106,9 +226,14 @@ def cross_validate(model, X, y, K):
         y=y,
         cv=StratifiedKFold(K)
     )
+    if print_score:
+        print_cross_validation_score(K, np.mean(score))
+    return np.mean(score)
+
+def print_cross_validation_score(K, accuracy):
     # Print this to CloudWatch logs so hyperparameter tuning jobs can pick up on it
     # with the following regex:	-Fold-Cross-Validated::accuracy::([0-9.]+)::
-    print('::{}-Fold-Cross-Validated::accuracy::{}::'.format(K, np.mean(score) * 100))
+    print('::{}-Fold-Cross-Validated::accuracy::{}::'.format(K, accuracy * 100))
 
 if __name__ == '__main__':
     train()
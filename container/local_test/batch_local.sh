@@ -0,0 +1,15 @@
+#!/bin/sh
+
+image=$1
+
+mkdir -p test_dir/input/data/score
+mkdir -p test_dir/output/data
+
+# Score the sample payload if nothing else was put in the scoring channel
+if [ -z "$(ls -A test_dir/input/data/score)" ]; then
+    cp payload.csv test_dir/input/data/score/
+fi
+
+rm -f test_dir/output/data/*.out
+
+docker run -v /${PWD}/test_dir:/opt/ml --rm ${image} predict
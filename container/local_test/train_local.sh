@@ -6,6 +6,12 @@ mkdir -p test_dir/model
 mkdir -p test_dir/output
 
 rm test_dir/model/*
-rm test_dir/output/*
+rm -rf test_dir/output/*
+mkdir -p test_dir/output/data
 
 docker run -v /${PWD}/test_dir:/opt/ml --rm ${image} train
+
+# Show where the training time and memory went
+if [ -f test_dir/output/data/profile.json ]; then
+    cat test_dir/output/data/profile.json
+fi
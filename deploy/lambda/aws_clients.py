@@ -0,0 +1,83 @@
+import os
+import threading
+
+# The AWS clients of the Lambda functions. A client is created the first time it is needed, not when
+# the function is imported, so a cold start only pays for the clients that the invocation uses (and
+# boto3 is only imported once a client is needed). The clients are kept for the life of the execution
+# environment, so warm invocations reuse them along with their connection pools.
+#
+# The clients are created from boto3's default session, so event handlers registered on it (e.g. by
+# tests) apply to the clients created afterwards.
+
+# Connections in the S3 pool. push_output.py uploads and deletes with up to 8 threads (UPLOAD_CONCURRENCY,
+# DELETE_CONCURRENCY) and managed copies use up to 10, so the default pool of 10 connections is too small.
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', 16))
+
+# botocore.config.Config arguments by service. Services that are not listed use DEFAULT_CLIENT_CONFIG.
+DEFAULT_CLIENT_CONFIG = {
+    'retries': {'mode': 'standard', 'total_max_attempts': 3},
+    'connect_timeout': 5,
+    'read_timeout': 30
+}
+CLIENT_CONFIGS = {
+    # S3 asks clients to slow down with 503s when a prefix is busy, which is worth a few more attempts
+    's3': {
+        'retries': {'mode': 'standard', 'total_max_attempts': 5},
+        'max_pool_connections': S3_MAX_POOL_CONNECTIONS,
+        'connect_timeout': 5,
+        'read_timeout': 60
+    },
+    # The SageMaker API has low request rate limits, which the status checks of concurrent executions
+    # share. Adaptive retries also slow down the client's own requests after it was throttled.
+    'sagemaker': {
+        'retries': {'mode': 'adaptive', 'total_max_attempts': 5},
+        'connect_timeout': 5,
+        'read_timeout': 30
+    },
+    # The state store reads and writes small items, a slow request is better retried than waited for
+    'dynamodb': {
+        'retries': {'mode': 'standard', 'total_max_attempts': 3},
+        'connect_timeout': 2,
+        'read_timeout': 5
+    }
+}
+
+_clients = {}
+_lock = threading.Lock()
+
+def get_client_config(service_name):
+    """Get the botocore.config.Config arguments for a service
+
+    Arguments:
+        service_name {string} -- the service name, e.g. 's3'
+
+    Returns:
+        dict -- the Config arguments
+    """
+    return dict(CLIENT_CONFIGS.get(service_name, DEFAULT_CLIENT_CONFIG))
+
+def client(service_name):
+    """Get the client of a service, creating it on first use
+
+    Arguments:
+        service_name {string} -- the service name, e.g. 's3'
+
+    Returns:
+        object -- the boto3 client, the same one for every call in the execution environment
+    """
+    service_client = _clients.get(service_name)
+    if service_client is not None:
+        return service_client
+
+    # Creating clients on a session is not thread safe
+    with _lock:
+        if service_name not in _clients:
+            import boto3
+            from botocore.config import Config
+            _clients[service_name] = boto3.client(service_name, config=Config(**get_client_config(service_name)))
+        return _clients[service_name]
+
+def reset():
+    """Forget the clients, so they are created again on their next use (e.g. in a test with mocked AWS)"""
+    with _lock:
+        _clients.clear()
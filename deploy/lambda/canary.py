@@ -0,0 +1,328 @@
+import os
+import datetime
+import threading
+import logging
+from botocore.exceptions import ClientError
+
+import aws_clients
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+ENDPOINT_NAME = os.getenv('ENDPOINT_NAME')
+PRODUCT_TAG_VALUE = os.getenv('PRODUCT_TAG_VALUE')
+SERVICE_TAG_VALUE = os.getenv('SERVICE_TAG_VALUE')
+STAGE_TAG_VALUE = os.getenv('STAGE_TAG_VALUE')
+
+# The variant of the endpoint configs that send all traffic to one model (see model-server.yaml)
+ALL_TRAFFIC_VARIANT_NAME = 'AllTraffic'
+BASELINE_VARIANT_NAME = 'Baseline'
+CANARY_VARIANT_NAME = 'Canary'
+
+# Used for the settings that are missing from EndpointConfig.Canary in sagemaker-settings.json
+DEFAULT_CANARY_SETTINGS = {
+    'Enabled': False,
+    # The share of the traffic that goes to the new model
+    'TrafficWeight': 0.1,
+    # How long to wait between two evaluations, and how long to keep evaluating before giving up
+    'ObservationSeconds': 600,
+    'MaxObservationSeconds': 3600,
+    # The new model is rolled back if its p99 model latency is more than this many times the baseline's
+    'MaxLatencyRatio': 1.5,
+    # ... or if its error rate is this much higher than the baseline's (0.01 is one percentage point)
+    'MaxErrorRateIncrease': 0.01,
+    # The number of invocations each variant needs before they are compared
+    'MinInvocations': 100,
+    # What to do when there were not enough invocations within MaxObservationSeconds
+    'InsufficientDataDecision': 'Rollback'
+}
+
+def get_canary_settings(sagemaker_settings):
+    """Get the canary settings from the SageMaker settings, with defaults for the missing ones"""
+    settings = dict(DEFAULT_CANARY_SETTINGS)
+    settings.update(sagemaker_settings.get('EndpointConfig', {}).get('Canary', {}))
+    return settings
+
+class CloudWatchMetricsSource:
+    def __init__(self, client=None):
+        """Reads the invocation metrics that SageMaker publishes for every production variant
+
+        Keyword Arguments:
+            client -- the CloudWatch client to use (default: {None}, the shared client of aws_clients)
+        """
+        self.__client = client
+
+    def get_variant_metrics(self, endpoint_name, variant_names, start_time, end_time):
+        """Get the invocation metrics of production variants
+
+        Arguments:
+            endpoint_name {string} -- the SageMaker endpoint name
+            variant_names {list} -- the production variant names
+            start_time {datetime} -- the start of the period
+            end_time {datetime} -- the end of the period
+
+        Returns:
+            dict -- for each variant, a dict with the number of invocations, the number of errors and
+                    the p99 model latency in milliseconds (None if there were no invocations)
+        """
+        # One period that covers the whole observation, in whole minutes
+        period = max(60, int((end_time - start_time).total_seconds() + 59) // 60 * 60)
+        queries = []
+        for i, variant_name in enumerate(variant_names):
+            dimensions = [
+                {'Name': 'EndpointName', 'Value': endpoint_name},
+                {'Name': 'VariantName', 'Value': variant_name}
+            ]
+            for query_id, metric_name, stat in [
+                ('invocations', 'Invocations', 'Sum'),
+                ('errors', 'Invocation5XXErrors', 'Sum'),
+                ('latency', 'ModelLatency', 'p99')
+            ]:
+                queries.append({
+                    'Id': f'{query_id}{i}',
+                    'MetricStat': {
+                        'Metric': {'Namespace': 'AWS/SageMaker', 'MetricName': metric_name, 'Dimensions': dimensions},
+                        'Period': period,
+                        'Stat': stat
+                    }
+                })
+
+        values = {}
+        paginator = (self.__client or aws_clients.client('cloudwatch')).get_paginator('get_metric_data')
+        for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time):
+            for result in page['MetricDataResults']:
+                values.setdefault(result['Id'], []).extend(result['Values'])
+
+        metrics = {}
+        for i, variant_name in enumerate(variant_names):
+            latency = values.get(f'latency{i}')
+            metrics[variant_name] = {
+                'invocations': int(sum(values.get(f'invocations{i}', []))),
+                'errors': int(sum(values.get(f'errors{i}', []))),
+                # ModelLatency is reported in microseconds
+                'latency_p99_ms': max(latency) / 1000.0 if latency else None
+            }
+        return metrics
+
+class InMemoryMetricsSource:
+    def __init__(self):
+        """A stand-in for CloudWatchMetricsSource for tests and local runs
+
+        Record the invocations of each variant with record_invocation, e.g. from a local load test.
+        The metrics are computed over the invocations recorded between start_time and end_time.
+        """
+        self.__invocations = []
+        self.__lock = threading.Lock()
+
+    def record_invocation(self, endpoint_name, variant_name, latency_ms, error=False, timestamp=None):
+        """Record one invocation of a production variant"""
+        timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc)
+        with self.__lock:
+            self.__invocations.append((endpoint_name, variant_name, latency_ms, error, timestamp))
+
+    def get_variant_metrics(self, endpoint_name, variant_names, start_time, end_time):
+        """Get the invocation metrics of production variants, see CloudWatchMetricsSource"""
+        with self.__lock:
+            invocations = list(self.__invocations)
+
+        metrics = {}
+        for variant_name in variant_names:
+            selected = [x for x in invocations if x[0] == endpoint_name and x[1] == variant_name and start_time <= x[4] <= end_time]
+            latencies = sorted(x[2] for x in selected)
+            metrics[variant_name] = {
+                'invocations': len(selected),
+                'errors': sum(1 for x in selected if x[3]),
+                # Nearest rank percentile
+                'latency_p99_ms': latencies[max(0, -(-99 * len(latencies) // 100) - 1)] if latencies else None
+            }
+        return metrics
+
+metrics_source = CloudWatchMetricsSource()
+
+def compare_variants(baseline, canary, settings):
+    """Compare the metrics of the canary variant with those of the baseline variant
+
+    Arguments:
+        baseline {dict} -- the metrics of the baseline variant (see CloudWatchMetricsSource)
+        canary {dict} -- the metrics of the canary variant
+        settings {dict} -- the canary settings
+
+    Returns:
+        tuple -- (the decision: Promote, Rollback or Wait, a list of the reasons)
+    """
+    if min(baseline['invocations'], canary['invocations']) < max(settings['MinInvocations'], 1):
+        return 'Wait', ['Not enough invocations yet (baseline {}, canary {}, need {}).'.format(
+            baseline['invocations'], canary['invocations'], settings['MinInvocations'])]
+
+    reasons = []
+    error_rate_increase = canary['errors'] / canary['invocations'] - baseline['errors'] / baseline['invocations']
+    if error_rate_increase > settings['MaxErrorRateIncrease']:
+        reasons.append('The error rate is {:.2%} higher than the baseline (allowed {:.2%}).'.format(
+            error_rate_increase, settings['MaxErrorRateIncrease']))
+
+    if canary['latency_p99_ms'] is not None and baseline['latency_p99_ms']:
+        ratio = canary['latency_p99_ms'] / baseline['latency_p99_ms']
+        if ratio > settings['MaxLatencyRatio']:
+            reasons.append('The p99 model latency is {:.2f} times the baseline ({:.1f} ms vs {:.1f} ms, allowed {} times).'.format(
+                ratio, canary['latency_p99_ms'], baseline['latency_p99_ms'], settings['MaxLatencyRatio']))
+
+    if reasons:
+        return 'Rollback', reasons
+    return 'Promote', ['The canary is within the latency and error thresholds.']
+
+class CanaryDeployment:
+    def __init__(self, endpoint_name, tags):
+        """Deploys a new model next to the current one with a small share of the traffic
+
+        Arguments:
+            endpoint_name {string} -- the SageMaker endpoint name
+            tags {list} -- the tags for the endpoint configs
+        """
+        self.__endpoint_name = endpoint_name
+        self.__tags = tags
+
+    def start(self, model_name, instance_type, settings):
+        """Update the endpoint to a config with the current model and the new model as two variants
+
+        Arguments:
+            model_name {string} -- the SageMaker model name of the new model
+            instance_type {string} -- the instance type for the new model
+            settings {dict} -- the canary settings
+
+        Returns:
+            dict -- the canary state. Mode is Full if there is no endpoint to compare with yet, in which
+                    case the new model should be deployed to all traffic.
+        """
+        sagemaker = aws_clients.client('sagemaker')
+        try:
+            endpoint = sagemaker.describe_endpoint(EndpointName=self.__endpoint_name)
+        except ClientError:
+            logger.info(f'Endpoint {self.__endpoint_name} does not exist yet. Deploying the new model to all traffic.')
+            return {'Mode': 'Full'}
+
+        previous_config_name = endpoint['EndpointConfigName']
+        previous_config = sagemaker.describe_endpoint_config(EndpointConfigName=previous_config_name)
+        # After a promotion the endpoint has a single variant with the current model
+        variants = {x['VariantName']: x for x in previous_config['ProductionVariants']}
+        if ALL_TRAFFIC_VARIANT_NAME not in variants:
+            raise ValueError(f'Endpoint config {previous_config_name} of {self.__endpoint_name} has the variants '
+                             f'{", ".join(sorted(variants))}, not {ALL_TRAFFIC_VARIANT_NAME}. Deploy a model to all '
+                             'traffic before starting a canary.')
+        baseline = variants[ALL_TRAFFIC_VARIANT_NAME]
+
+        canary_config_name = f'{model_name}-canary'
+        weight = settings['TrafficWeight']
+        sagemaker.create_endpoint_config(
+            EndpointConfigName=canary_config_name,
+            ProductionVariants=[
+                {
+                    'VariantName': BASELINE_VARIANT_NAME,
+                    'ModelName': baseline['ModelName'],
+                    'InstanceType': baseline['InstanceType'],
+                    'InitialInstanceCount': baseline['InitialInstanceCount'],
+                    'InitialVariantWeight': 1 - weight
+                },
+                {
+                    'VariantName': CANARY_VARIANT_NAME,
+                    'ModelName': model_name,
+                    'InstanceType': instance_type,
+                    'InitialInstanceCount': 1,
+                    'InitialVariantWeight': weight
+                }
+            ],
+            Tags=self.__tags
+        )
+        sagemaker.update_endpoint(EndpointName=self.__endpoint_name, EndpointConfigName=canary_config_name)
+        logger.info(f'Sending {weight:.0%} of the traffic of {self.__endpoint_name} to {model_name}.')
+
+        return {
+            'Mode': 'Canary',
+            'PreviousEndpointConfigName': previous_config_name,
+            'CanaryEndpointConfigName': canary_config_name
+        }
+
+    def evaluate(self, state, settings, now=None):
+        """Compare the variants' metrics since the canary went into service
+
+        Arguments:
+            state {dict} -- the canary state returned by start (and a previous evaluate)
+            settings {dict} -- the canary settings
+
+        Keyword Arguments:
+            now {datetime} -- the current time (default: {None}, the current time)
+
+        Returns:
+            dict -- the canary state with the Decision (Promote, Rollback or Wait), Reasons and Metrics
+        """
+        state = dict(state)
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        # The first evaluation starts the observation, once the canary is in service
+        if 'ObservationStart' not in state:
+            state['ObservationStart'] = now.strftime('%Y-%m-%dT%H:%M:%SZ')
+            state.update({'Decision': 'Wait', 'Reasons': ['Started observing the canary.'], 'Metrics': {}})
+            return state
+
+        start = datetime.datetime.strptime(state['ObservationStart'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc)
+        metrics = metrics_source.get_variant_metrics(self.__endpoint_name, [BASELINE_VARIANT_NAME, CANARY_VARIANT_NAME], start, now)
+        decision, reasons = compare_variants(metrics[BASELINE_VARIANT_NAME], metrics[CANARY_VARIANT_NAME], settings)
+        if decision == 'Wait' and (now - start).total_seconds() >= settings['MaxObservationSeconds']:
+            decision = settings['InsufficientDataDecision']
+            reasons.append(f'Stopped observing after {settings["MaxObservationSeconds"]} seconds.')
+
+        logger.info(f'Canary decision: {decision}. {" ".join(reasons)}')
+        state.update({'Decision': decision, 'Reasons': reasons, 'Metrics': metrics})
+        return state
+
+    def rollback(self, state):
+        """Send all traffic back to the previous endpoint config
+
+        Arguments:
+            state {dict} -- the canary state returned by start
+
+        Returns:
+            dict -- the canary state
+        """
+        aws_clients.client('sagemaker').update_endpoint(EndpointName=self.__endpoint_name, EndpointConfigName=state['PreviousEndpointConfigName'])
+        logger.info(f'Rolled {self.__endpoint_name} back to {state["PreviousEndpointConfigName"]}.')
+        return dict(state, Decision='Rollback')
+
+def lambda_handler(event, context):
+    """The main entrypoint to the lambda function
+
+    Arguments:
+        event {dict} -- the event that triggered the lambda, with the action (start, evaluate or
+                        rollback), the state machine input and the canary state of the previous action
+        context -- lambda context
+
+    Returns:
+        dict -- the canary state
+    """
+    logger.info(f'event: {event}')
+    settings = get_canary_settings(event['input']['sagemaker'])
+    deployment = CanaryDeployment(
+        endpoint_name=ENDPOINT_NAME,
+        tags=[
+            {'Key': 'product', 'Value': PRODUCT_TAG_VALUE},
+            {'Key': 'service', 'Value': SERVICE_TAG_VALUE},
+            {'Key': 'stage', 'Value': STAGE_TAG_VALUE}
+        ]
+    )
+
+    action = event['action']
+    if action == 'start':
+        state = deployment.start(
+            model_name=event['model_name'],
+            instance_type=event['input']['sagemaker']['EndpointConfig']['InstanceType'],
+            settings=settings
+        )
+    elif action == 'evaluate':
+        state = deployment.evaluate(event['canary'], settings)
+    elif action == 'rollback':
+        state = deployment.rollback(event['canary'])
+    else:
+        raise ValueError(f'Unknown canary action {action}.')
+
+    # The state machine waits this long before the next evaluation
+    state['ObservationSeconds'] = settings['ObservationSeconds']
+    return state
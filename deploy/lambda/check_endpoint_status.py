@@ -1,13 +1,15 @@
-import boto3
 import os
 import logging
 
+import aws_clients
+from waiter import StatusWaiter, ENDPOINT_EXPECTED_SECONDS
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sagemaker = boto3.client('sagemaker')
-
 ENDPOINT_NAME = os.getenv('ENDPOINT_NAME')
+# How long to keep checking inside one invocation before handing the wait back to the state machine
+ENDPOINT_STATUS_LONG_WAIT_SECONDS = float(os.getenv('ENDPOINT_STATUS_LONG_WAIT_SECONDS', 0))
 
 def lambda_handler(event, context):
     """The main entrypoint to the lambda function
@@ -21,11 +23,21 @@ def lambda_handler(event, context):
     """
     logger.info(f'event: {event}')
 
-    endpoint_info = sagemaker.describe_endpoint(EndpointName=ENDPOINT_NAME)
+    waiter = StatusWaiter(
+        describe=lambda: aws_clients.client('sagemaker').describe_endpoint(EndpointName=ENDPOINT_NAME),
+        get_status=lambda x: x['EndpointStatus'],
+        terminal_statuses=['InService', 'OutOfService', 'Failed'],
+        expected_seconds=ENDPOINT_EXPECTED_SECONDS,
+        long_wait_seconds=ENDPOINT_STATUS_LONG_WAIT_SECONDS
+    )
+    # The state of the waiter is kept in the output of the previous check
+    endpoint_info, waiter_state = waiter.check(event.get('PreviousStep', {}).get('Waiter'), context)
     
     return {
         'EndpointName': endpoint_info['EndpointName'],
         'EndpointConfigName': endpoint_info['EndpointConfigName'],
         'EndpointStatus': endpoint_info['EndpointStatus'],
-        'FailureReason': endpoint_info.get('FailureReason',None)
+        'FailureReason': endpoint_info.get('FailureReason',None),
+        'WaitSeconds': waiter_state['WaitSeconds'],
+        'Waiter': waiter_state
     }
\ No newline at end of file
@@ -1,12 +1,10 @@
-import boto3
-import os
 import logging
 
+import aws_clients
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sagemaker = boto3.client('sagemaker')
-
 def transform_metric_data_list(final_metric_data_list):
     """Change the structure of the FinalMetricDataList from SageMaker describeTrainingJob
     
@@ -37,9 +35,11 @@ def lambda_handler(event, context):
 
     training_job_name = event['PreviousStep']['TrainingJobName']
 
-    job_info = sagemaker.describe_training_job(TrainingJobName=training_job_name)
+    job_info = aws_clients.client('sagemaker').describe_training_job(TrainingJobName=training_job_name)
 
     logger.info(f'job_info: {job_info}')
+
+    metrics = transform_metric_data_list(job_info.get('FinalMetricDataList', None))
     
     return {
         'TrainingJobName': job_info['TrainingJobName'],
@@ -47,7 +47,7 @@ def lambda_handler(event, context):
         'TrainingJobStatus': job_info['TrainingJobStatus'],
         'SecondaryStatus': job_info['SecondaryStatus'],
         'FailureReason': job_info.get('FailureReason',''),
-        'Metrics': transform_metric_data_list(job_info.get('FinalMetricDataList', None)),
+        'Metrics': metrics,
         'AlgorithmSpecification': job_info.get('AlgorithmSpecification', None),
         'ModelArtifacts': job_info.get('ModelArtifacts', None)
     }
\ No newline at end of file
@@ -1,14 +1,13 @@
-import boto3
 import os
 import json
 from botocore.exceptions import ClientError
 import logging
 
+import aws_clients
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sagemaker = boto3.client('sagemaker')
-
 ENDPOINT_NAME = os.getenv('ENDPOINT_NAME')
 PRODUCT_TAG_VALUE = os.getenv('PRODUCT_TAG_VALUE')
 SERVICE_TAG_VALUE = os.getenv('SERVICE_TAG_VALUE')
@@ -26,7 +25,7 @@ class SageMakerClient:
             bool -- True if the endpoint exists, else False
         """
         try:
-            sagemaker.describe_endpoint(EndpointName=endpoint_name)
+            aws_clients.client('sagemaker').describe_endpoint(EndpointName=endpoint_name)
             return True
         except ClientError as e:
             return False
@@ -44,12 +43,12 @@ class SageMakerClient:
             dict -- a dict with the endpoint ARN (key "EndpointArn")
         """
         if SageMakerClient.__endpoint_exists(endpoint_name):
-            response = sagemaker.update_endpoint(
+            response = aws_clients.client('sagemaker').update_endpoint(
                 EndpointName=endpoint_name,
                 EndpointConfigName=endpoint_config_name
             )
         else:
-            response = sagemaker.create_endpoint(
+            response = aws_clients.client('sagemaker').create_endpoint(
                 EndpointName=endpoint_name,
                 EndpointConfigName=endpoint_config_name,
                 Tags=tags
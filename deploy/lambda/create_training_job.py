@@ -1,4 +1,3 @@
-import boto3
 import os
 import json
 import logging
@@ -6,8 +5,6 @@ import logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-sagemaker = boto3.client('sagemaker')
-
 SAGEMAKER_ROLE_ARN = os.getenv('SAGEMAKER_ROLE_ARN')
 OUTPUT_BUCKET_NAME = os.getenv('OUTPUT_BUCKET_NAME')
 PRODUCT_TAG_VALUE = os.getenv('PRODUCT_TAG_VALUE')
@@ -31,6 +28,7 @@ class SageMakerClient:
         s3_info = step_func_input['input']['s3']
         ecr_info = step_func_input['input']['ecr']
         sagemaker_settings = step_func_input['input']['sagemaker']
+        resource_config = sagemaker_settings['TrainingJob']['TrainingResourceConfig']
 
         # Change the prefix for the output s3 bucket depending on which ECR
         # repository triggered the step function workflow
@@ -56,7 +54,8 @@ class SageMakerClient:
                         'S3DataSource': {
                             'S3DataType': 'S3Prefix',
                             'S3Uri': f"s3://{s3_info['bucket_name']}",
-                            'S3DataDistributionType': 'FullyReplicated',
+                            # ShardedByS3Key gives every instance a different subset of the files
+                            'S3DataDistributionType': sagemaker_settings['TrainingJob'].get('S3DataDistributionType', 'FullyReplicated'),
                         }
                     }
                 }
@@ -65,9 +64,9 @@ class SageMakerClient:
                 'S3OutputPath': f's3://{OUTPUT_BUCKET_NAME}/{s3_output_prefix_map[source_ecr_repo_name]}'
             },
             'ResourceConfig': {
-                'InstanceType': sagemaker_settings['TrainingJob']['TrainingResourceConfig']['InstanceType'],
-                'InstanceCount': 1,
-                'VolumeSizeInGB': sagemaker_settings['TrainingJob']['TrainingResourceConfig']['VolumeSizeInGB'],
+                'InstanceType': resource_config['InstanceType'],
+                'InstanceCount': resource_config.get('InstanceCount', 1),
+                'VolumeSizeInGB': resource_config['VolumeSizeInGB'],
             },
             'StoppingCondition': sagemaker_settings['TrainingJob']['StoppingCondition'],
             'EnableNetworkIsolation': True,
@@ -1,12 +1,18 @@
+import io
 import json
-import boto3
 import uuid
 from zipfile import ZipFile
 from botocore.exceptions import ClientError
 import os
+import time
+import datetime
 from dateutil.tz import tzlocal
 import logging
 
+import aws_clients
+from state_store import create_state_store
+from run_index import RunIndex, compute_fingerprint
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -15,22 +21,23 @@ SOURCE_CODE_BUCKET_NAME = os.getenv('SOURCE_CODE_BUCKET_NAME')
 DATA_SOURCE_OBJECT_KEY = os.getenv('DATA_SOURCE_OBJECT_KEY')
 MASTER_ECR_REPOSITORY_NAME = os.getenv('MASTER_ECR_REPOSITORY_NAME')
 STEP_FUNCTIONS_STATE_MACHINE_ARN = os.getenv('STEP_FUNCTIONS_STATE_MACHINE_ARN')
-
-s3 = boto3.resource('s3')
-s3_client = boto3.client('s3')
-ecr = boto3.client('ecr')
-sfn = boto3.client('stepfunctions')
-
-def generate_file_path(path):
-    """Prepend all file paths with "/tmp/" because that is the only place we can write to in an AWS Lambda
-    
-    Arguments:
-        path {string} -- the file path 
-    
-    Returns:
-        string -- the input file path prepended with "/tmp/"
-    """
-    return '/tmp/' + path
+REPOSITORY_URI_CACHE_TTL_SECONDS = float(os.getenv('REPOSITORY_URI_CACHE_TTL_SECONDS', 300))
+# Triggers that arrive within this many seconds of each other start a single execution (0 disables it)
+TRIGGER_COALESCE_WINDOW_SECONDS = float(os.getenv('TRIGGER_COALESCE_WINDOW_SECONDS', 0))
+# An open trigger window is taken over by the next trigger this long after it should have closed
+# (the maximum Lambda timeout, so the owner has certainly stopped)
+TRIGGER_OWNER_TIMEOUT_SECONDS = 900
+# Trigger windows are removed from the state store after a day
+TRIGGER_STATE_TTL_SECONDS = 24 * 60 * 60
+# Minimum number of bytes fetched per request when reading the source code bundle
+S3_READ_BLOCK_SIZE = 64 * 1024
+
+# ECR repository URIs by repository name, kept across warm invocations
+repository_uri_cache = {}
+# Configuration files of the source code bundles by (bucket name, bundle name), kept across warm invocations
+source_code_cache = {}
+state_store = create_state_store()
+run_index = RunIndex(state_store)
 
 class EventParser:
     @staticmethod
@@ -105,29 +112,33 @@ class EventParser:
         """
         request_params = ecr_event['detail']['requestParameters']
 
-        return {
+        ecr_info = {
             'repository_name': request_params['repositoryName'],
             'image_tags': [request_params['imageTag']]
         }
+        try:
+            ecr_info['image_digest'] = ecr_event['detail']['responseElements']['image']['imageId']['imageDigest']
+        except (KeyError, TypeError):
+            pass
+        return ecr_info
 
 class S3Client:
     @staticmethod
-    def __object_exists(bucket, key):
-        """Check if a particular S3 object exists
+    def __head_object(bucket, key):
+        """Get the metadata of a particular S3 object
         
         Arguments:
             bucket {string} -- the S3 bucket to check
             key {string} -- the S3 key to check
         
         Returns:
-            bool -- True if it exists, else false
+            dict -- the HeadObject response, or None if the object does not exist
         """
         try:
-            s3.Object(bucket, key).load()
-            return True
+            return aws_clients.client('s3').head_object(Bucket=bucket, Key=key)
         except ClientError as e:
             if e.response['Error']['Code'] == "404":
-                return False
+                return None
             else:
                 # Something else has gone wrong.
                 raise
@@ -147,12 +158,8 @@ class S3Client:
             logger.error('Must supply bucket and key names')
             return None
 
-        if S3Client.__object_exists(bucket, key):
-            s3Object = s3.Object(bucket, key)
-            version = s3Object.version_id
-        else:
-            version = None
-        return version
+        head = S3Client.__head_object(bucket, key)
+        return head.get('VersionId') if head is not None else None
 
     @staticmethod
     def get_source_object_info(bucket, key):
@@ -177,39 +184,126 @@ class S3Client:
             }
         
     @staticmethod
-    def download_file(bucket_name, object_name, new_file_path):
-        """Download a file from S3
+    def open_object(bucket_name, object_name):
+        """Open an S3 object as a seekable, read-only file that fetches only the byte ranges that are read
         
         Arguments:
             bucket_name {string} -- the name of the S3 bucket where the file is stored
             object_name {string} -- the S3 key for the file/object
-            new_file_path {string} -- the local path where you want to store the downloaded file
         
         Returns:
-            bool -- True if successful, else throws an exception
+            S3ObjectReader -- the file object, or throws an exception
         """
         try:
-            with open(new_file_path, 'wb') as f:
-                s3_client.download_fileobj(bucket_name, object_name, f)
+            return S3ObjectReader(bucket_name, object_name)
         except ClientError as e:
-            logger.error('Error retreiving source code bundle from {}: {}'.format(bucket_name + '/' + object_name, e.response['Error']['Message']))
+            logger.error('Error retreiving {}: {}'.format(bucket_name + '/' + object_name, e.response['Error']['Message']))
             raise
+
+class S3ObjectReader(io.RawIOBase):
+    def __init__(self, bucket_name, object_name, block_size=S3_READ_BLOCK_SIZE):
+        """A seekable file object for an S3 object that reads it with ranged GET requests
+
+        Every request fetches at least block_size bytes, and the last block is kept, so the small
+        reads that ZipFile makes are served from memory. The first request gets the last block of the
+        object, where a zip file keeps its central directory, and that block is kept as well.
+
+        Arguments:
+            bucket_name {string} -- the name of the S3 bucket where the file is stored
+            object_name {string} -- the S3 key for the file/object
+
+        Keyword Arguments:
+            block_size {int} -- the minimum number of bytes per request (default: {S3_READ_BLOCK_SIZE})
+        """
+        self.__bucket_name = bucket_name
+        self.__object_name = object_name
+        self.__block_size = block_size
+        self.__position = 0
+        self.requests = 0
+        self.bytes_read = 0
+
+        response = self.__get_range(f'bytes=-{block_size}')
+        data = response['Body'].read()
+        content_range = response.get('ContentRange')
+        # e.g. "bytes 1000-2047/2048". Objects smaller than the range are returned whole.
+        self.__size = int(content_range.split('/')[-1]) if content_range else len(data)
+        self.__tail_start = self.__size - len(data)
+        self.__tail = data
+        self.__block_start = self.__tail_start
+        self.__block = data
+
+    def __get_range(self, byte_range):
+        self.requests += 1
+        response = aws_clients.client('s3').get_object(Bucket=self.__bucket_name, Key=self.__object_name, Range=byte_range)
+        self.bytes_read += response['ContentLength']
+        return response
+
+    def readable(self):
+        return True
+
+    def seekable(self):
         return True
 
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.__position = offset
+        elif whence == io.SEEK_CUR:
+            self.__position += offset
+        elif whence == io.SEEK_END:
+            self.__position = self.__size + offset
+        else:
+            raise ValueError('Invalid whence ({})'.format(whence))
+        self.__position = max(self.__position, 0)
+        return self.__position
+
+    def readinto(self, buffer):
+        end = min(self.__position + len(buffer), self.__size)
+        if end <= self.__position:
+            return 0
+
+        if self.__position >= self.__tail_start:
+            block_start, block = self.__tail_start, self.__tail
+        else:
+            if self.__position < self.__block_start or end > self.__block_start + len(self.__block):
+                # Fetch a new block that starts at the current position
+                fetch_end = min(max(end, self.__position + self.__block_size), self.__size)
+                self.__block = self.__get_range(f'bytes={self.__position}-{fetch_end - 1}')['Body'].read()
+                self.__block_start = self.__position
+            block_start, block = self.__block_start, self.__block
+
+        start = self.__position - block_start
+        count = end - self.__position
+        buffer[:count] = block[start:start + count]
+        self.__position = end
+        return count
+
 class EcrClient:
     @staticmethod
-    def __get_image_details(repository_name):
-        """Get details about all the images in an ECR repository
+    def __get_latest_image(repository_name):
+        """Get attributes about the tagged ECR image that was uploaded most recently
+
+        The images are listed page by page and only the newest one seen so far is kept.
         
         Arguments:
             repository_name {string} -- ECR repository name
         
         Returns:
-            list -- list of attributes for each image in the repository
+            dict -- attributes about the ECR image that was uploaded to ECR most recently, or None if
+                    the repository does not exist or has no tagged images
         """
+        latest_image = None
         try:
-            response = ecr.describe_images(repositoryName=repository_name)
-            return response.get('imageDetails')
+            pages = aws_clients.client('ecr').get_paginator('describe_images').paginate(
+                repositoryName=repository_name,
+                filter={'tagStatus': 'TAGGED'}
+            )
+            for page in pages:
+                for image in page.get('imageDetails', []):
+                    if latest_image is None or image['imagePushedAt'] > latest_image['imagePushedAt']:
+                        latest_image = image
         except ClientError as e:
             if e.response['Error']['Code'] == "RepositoryNotFoundException":
                 logger.error(e.response['Error']['Message'])
@@ -217,38 +311,7 @@ class EcrClient:
             else:
                 # Something else has gone wrong.
                 raise
-
-    @staticmethod
-    def __get_latest_image(image_details):
-        """Get attributes about the ECR image that was uploaded most recently
-        
-        Arguments:
-            image_details {list} -- a list of details regarding ECR images
-        
-        Returns:
-            dict -- attributes about the ECR image that was uploaded to ECR most recently
-        """
-        if len(image_details) > 0:
-            return sorted(image_details, key = lambda x: x['imagePushedAt'], reverse=True)[0]
-        else:
-            return None
-
-    @staticmethod
-    def __get_latest_image_tags(repository_name):
-        """Get the image tags from the most recent ECR image
-        
-        Arguments:
-            repository_name {string} -- the ECR repository name
-        
-        Returns:
-            list -- a list of string tags
-        """
-        image_details = EcrClient.__get_image_details(repository_name)
-        if image_details is None:
-            return None
-        else:
-            latest_image = EcrClient.__get_latest_image(image_details)
-            return None if not latest_image else latest_image.get('imageTags')
+        return latest_image
 
     @staticmethod
     def get_ecr_image_info(repository_name):
@@ -263,14 +326,18 @@ class EcrClient:
         if not repository_name:
             return None
 
-        image_tags = EcrClient.__get_latest_image_tags(repository_name)
+        latest_image = EcrClient.__get_latest_image(repository_name)
+        if not latest_image or not latest_image.get('imageTags'):
+            return None
+        image_tags = latest_image['imageTags']
         repository_uri = EcrClient.get_repository_uri(repository_name)
 
         if image_tags and repository_uri:
             return {
                 'repository_name': repository_name,
                 'image_uri': repository_uri + ':' + image_tags[0],
-                'image_tags': image_tags
+                'image_tags': image_tags,
+                'image_digest': latest_image['imageDigest']
             }
         else:
             return None
@@ -278,6 +345,9 @@ class EcrClient:
     @staticmethod
     def get_repository_uri(repository_name):
         """Get the full URI for a repository
+
+        The URIs are cached for REPOSITORY_URI_CACHE_TTL_SECONDS, so warm invocations of the Lambda
+        function don't look them up again.
         
         Arguments:
             repository_name {string} -- the repository name
@@ -285,13 +355,21 @@ class EcrClient:
         Returns:
             string -- repository URI 
         """
+        cached = repository_uri_cache.get(repository_name)
+        if cached and cached['expires'] > time.monotonic():
+            return cached['uri']
+
         try:
-            repositories = ecr.describe_repositories()
+            repositories = aws_clients.client('ecr').describe_repositories(repositoryNames=[repository_name])
             uri_list = [x['repositoryUri'] for x in repositories['repositories'] if x['repositoryName'] == repository_name]
             if uri_list:
+                repository_uri_cache[repository_name] = {
+                    'uri': uri_list[0],
+                    'expires': time.monotonic() + REPOSITORY_URI_CACHE_TTL_SECONDS
+                }
                 return uri_list[0]
             else:
-                logger.error('Could not get repository URI for {}. There was no repository with that name.')
+                logger.error('Could not get repository URI for {}. There was no repository with that name.'.format(repository_name))
                 return None
         except ClientError as e:
             logger.error('Could not get repository URI for {}: {}.'.format(repository_name, e))
@@ -333,6 +411,101 @@ class EcrService:
         """
         return EcrClient.get_ecr_image_info(repository_name)
 
+class TriggerCoalescer:
+    def __init__(self, state_store, window_seconds, owner_timeout_seconds=TRIGGER_OWNER_TIMEOUT_SECONDS):
+        """Collapse the pipeline triggers that arrive within a time window into one execution
+
+        The first trigger opens a window in the state store and its invocation becomes the owner of the
+        window. Triggers that arrive while the window is open are merged into it and their invocations
+        return right away. When the window closes, the owner marks it as launched and starts a single
+        execution with the latest S3 data version and ECR image of all the merged triggers.
+
+        Every change to the window is a conditional write on the version that was read, so concurrent
+        invocations always agree on the owner and a trigger is either merged before the owner launches
+        or opens the next window.
+
+        Arguments:
+            state_store -- a state store (see state_store.py)
+            window_seconds {float} -- how long to wait for more triggers after the first one
+
+        Keyword Arguments:
+            owner_timeout_seconds {float} -- after this long past the end of the window, an open window is
+                considered abandoned (e.g. the owner timed out) and the next trigger takes it over
+                (default: {TRIGGER_OWNER_TIMEOUT_SECONDS})
+        """
+        self.__state_store = state_store
+        self.__window_seconds = window_seconds
+        self.__owner_timeout_seconds = owner_timeout_seconds
+
+    @staticmethod
+    def create_trigger(s3_info, ecr_info, s3_time, ecr_time):
+        """Create a trigger
+
+        Arguments:
+            s3_info {dict} -- the S3 data version information
+            ecr_info {dict} -- the ECR image information
+            s3_time {string} -- when s3_info was observed (ISO 8601 UTC, e.g. the event time)
+            ecr_time {string} -- when ecr_info was observed
+
+        Returns:
+            dict -- the trigger
+        """
+        return {'s3': s3_info, 'ecr': ecr_info, 's3_time': s3_time, 'ecr_time': ecr_time, 'count': 1}
+
+    @staticmethod
+    def __merge(trigger, other):
+        """Merge two triggers, keeping the most recently observed data version and image"""
+        merged = dict(trigger, count=trigger['count'] + other['count'])
+        for name in ['s3', 'ecr']:
+            if other[f'{name}_time'] > trigger[f'{name}_time']:
+                merged[name] = other[name]
+                merged[f'{name}_time'] = other[f'{name}_time']
+        return merged
+
+    def coalesce(self, key, trigger):
+        """Add a trigger to the open window for the key, or open a new window and wait for it to close
+
+        Arguments:
+            key {string} -- triggers with the same key are coalesced
+            trigger {dict} -- the trigger, see create_trigger
+
+        Returns:
+            dict -- the merged trigger to start an execution for, or None if the trigger was handed to
+                    another invocation
+        """
+        owner = str(uuid.uuid4())
+        while True:
+            window, version = self.__state_store.get_item(key)
+            now = time.time()
+            if window is None or window['status'] == 'launched':
+                pending = trigger
+            elif now > window['deadline'] + self.__owner_timeout_seconds:
+                logger.info('Taking over the abandoned trigger window {} of {}.'.format(key, window['owner']))
+                pending = self.__merge(window['trigger'], trigger)
+            else:
+                window = dict(window, trigger=self.__merge(window['trigger'], trigger))
+                if self.__state_store.put_item(key, window, version, ttl_seconds=TRIGGER_STATE_TTL_SECONDS) is not None:
+                    logger.info('Merged the trigger into the window {} of {}.'.format(key, window['owner']))
+                    return None
+                continue
+
+            window = {'status': 'open', 'owner': owner, 'deadline': now + self.__window_seconds, 'trigger': pending}
+            if self.__state_store.put_item(key, window, version, ttl_seconds=TRIGGER_STATE_TTL_SECONDS) is not None:
+                break
+
+        logger.info('Opened the trigger window {}. Waiting {} seconds for more triggers.'.format(key, self.__window_seconds))
+        while True:
+            time.sleep(max(window['deadline'] - time.time(), 0))
+            window, version = self.__state_store.get_item(key)
+            if window is None or window['owner'] != owner or window['status'] != 'open':
+                logger.error('Lost the trigger window {} to {}.'.format(key, None if window is None else window['owner']))
+                return None
+            launched = dict(window, status='launched')
+            if self.__state_store.put_item(key, launched, version, ttl_seconds=TRIGGER_STATE_TTL_SECONDS) is not None:
+                logger.info('Closed the trigger window {} with {} triggers.'.format(key, window['trigger']['count']))
+                return window['trigger']
+            # A trigger was merged in the meantime, read the window again
+
 class StepFuncClient:
 
     @staticmethod
@@ -352,7 +525,7 @@ class StepFuncClient:
         execution_name = str(uuid.uuid1())
 
         try:
-            sfn_response = sfn.start_execution(
+            sfn_response = aws_clients.client('stepfunctions').start_execution(
                 stateMachineArn=STEP_FUNCTIONS_STATE_MACHINE_ARN,
                 name=execution_name,
                 input=json.dumps(input_data)
@@ -381,28 +554,48 @@ class StepFuncClient:
         return response
 
 class SourceCodeRepository:
+    SETTINGS_FILE = 'deploy/sagemaker-settings.json'
+    HYPERPARAMETERS_FILE = 'container/local_test/test_dir/input/config/hyperparameters.json'
+
     def __init__(self, s3_bucket_name, s3_object_name):
-        """Initialize the repository by downloading the source code from S3 and unzipping it to local storage
+        """Initialize the repository by reading the SageMaker settings from the source code zip bundle in S3
+
+        Only the two configuration files are read from the bundle, with ranged reads of the zip file in
+        S3, so nothing is written to local storage. The bundles are named after the git commit, so the
+        settings are cached by bundle name across warm invocations.
         
         Arguments:
             s3_bucket_name {string} -- the name of the S3 bucket where the source code zip bundle is stored
             s3_object_name {string} -- the S3 key for the source code zip file/object
         """
         self.init_success = False
-        # Get source code from S3 bucket
-        src_code_zip_file_name = s3_object_name
-        S3Client.download_file(
-            bucket_name=s3_bucket_name, 
-            object_name=s3_object_name, 
-            new_file_path=generate_file_path(src_code_zip_file_name)
-        )
-
-        # Unzip source code
-        with ZipFile(generate_file_path(src_code_zip_file_name), 'r') as f:
-            f.extractall(generate_file_path(''))
+        self.__files = source_code_cache.get((s3_bucket_name, s3_object_name))
+
+        if self.__files is None:
+            with S3Client.open_object(s3_bucket_name, s3_object_name) as source_code_bundle:
+                with ZipFile(source_code_bundle, 'r') as f:
+                    names = set(f.namelist())
+                    self.__files = {x: f.read(x) for x in [self.SETTINGS_FILE, self.HYPERPARAMETERS_FILE] if x in names}
+                logger.info('Read {} from {} with {} requests ({} bytes).'.format(
+                    list(self.__files), s3_bucket_name + '/' + s3_object_name,
+                    source_code_bundle.requests, source_code_bundle.bytes_read
+                ))
+            source_code_cache[(s3_bucket_name, s3_object_name)] = self.__files
 
         self.init_success = True
 
+    def __load_json(self, file_name):
+        """Parse a JSON file from the source code bundle
+
+        Returns:
+            dict -- the parsed file, or None if unsuccessful
+        """
+        try:
+            return json.loads(self.__files[file_name])
+        except Exception as e:
+            logger.error('Error retrieving SageMaker settings from {}. {}'.format(file_name, e))
+            return None
+
     def __get_hyperparameters(self):
         """Retrieve the hyperparameters from the local test directory
         
@@ -411,16 +604,7 @@ class SourceCodeRepository:
         """
         if not self.init_success: return None
 
-        file_path = generate_file_path('container/local_test/test_dir/input/config/hyperparameters.json')
-
-        try:
-            with open(file_path) as f:
-                hyperparameters = json.load(f)
-        except Exception as e:
-            logger.error('Error retrieving SageMaker settings from {}. {}'.format(file_path, e))
-            return None
-
-        return hyperparameters
+        return self.__load_json(self.HYPERPARAMETERS_FILE)
 
     def get_sagemaker_settings(self):
         """Retrieve the SageMaker training/deployment settings from the config. file
@@ -430,13 +614,8 @@ class SourceCodeRepository:
         """
         if not self.init_success: return None
 
-        file_path = generate_file_path('deploy/sagemaker-settings.json')
-
-        try:
-            with open(file_path) as f:
-                settings = json.load(f)
-        except Exception as e:
-            logger.error('Error retrieving SageMaker settings from {}. {}'.format(file_path, e))
+        settings = self.__load_json(self.SETTINGS_FILE)
+        if settings is None:
             return None
 
         # Get hyperparameters from a different file
@@ -475,14 +654,20 @@ def lambda_handler(event, context):
             'body': json.dumps('Environment variables not populated.')
         })
 
+    # When the S3 and ECR information were observed, used to pick the latest when triggers are coalesced
+    now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    event_time = event.get('time', now)
+
     if EventParser.is_new_data_event(event):
         # Get latest data version
         s3_info = EventParser.get_source_object_info(event)
         ecr_info = EcrService.get_ecr_info_from_repo_name(MASTER_ECR_REPOSITORY_NAME)
+        s3_time, ecr_time = event_time, now
     elif EventParser.is_new_ecr_image_event(event):
         s3_info = S3Client.get_source_object_info(DATA_SOURCE_BUCKET_NAME, DATA_SOURCE_OBJECT_KEY)
         # Get latest "develop" branch ECR image
         ecr_info = EcrService.get_ecr_info_from_event(event)
+        s3_time, ecr_time = now, event_time
     else:
         return log_and_return_input({
             'statusCode': 400,
@@ -501,6 +686,20 @@ def lambda_handler(event, context):
             'body': json.dumps('ECR image could not be retrieved.')
         })
 
+    if TRIGGER_COALESCE_WINDOW_SECONDS > 0:
+        # Collapse the triggers for the same repository that arrive within the window
+        coalescer = TriggerCoalescer(state_store, TRIGGER_COALESCE_WINDOW_SECONDS)
+        trigger = coalescer.coalesce(
+            key='trigger#{}'.format(ecr_info['repository_name']),
+            trigger=TriggerCoalescer.create_trigger(s3_info, ecr_info, s3_time, ecr_time)
+        )
+        if trigger is None:
+            return log_and_return_input({
+                'statusCode': 202,
+                'body': json.dumps('Trigger merged into a pending execution.')
+            })
+        s3_info, ecr_info = trigger['s3'], trigger['ecr']
+
     # Get SageMaker settings from source code
     source_code_repository = SourceCodeRepository(
         s3_bucket_name=SOURCE_CODE_BUCKET_NAME,
@@ -513,11 +712,23 @@ def lambda_handler(event, context):
             'body': json.dumps('Could not retrieve SageMaker settings.')
         })
 
+    # Skip the training if a run with the same data, image and settings has already completed
+    fingerprint = compute_fingerprint(s3_info, ecr_info, sagemaker_settings)
+    completed_run = run_index.get_completed_run(fingerprint)
+    if completed_run:
+        return log_and_return_input({
+            'statusCode': 200,
+            'body': json.dumps('Skipped the execution. Training job {} already trained on the same data, image and settings.'.format(
+                completed_run['training_job_name']
+            ))
+        })
+
     # Start execution of AWS Step Functions state machine
     state_machine_input = {
         's3': s3_info,
         'ecr': ecr_info,
-        'sagemaker': sagemaker_settings
+        'sagemaker': sagemaker_settings,
+        'fingerprint': fingerprint
     }
     step_func_response = StepFuncClient.start_execution(state_machine_input)
 
@@ -1,36 +1,139 @@
-import boto3
 import os
 import logging
 import json
-import tempfile
+import hashlib
+import datetime
 import tarfile
+import tempfile
+import threading
 from concurrent.futures import ThreadPoolExecutor, wait
-from io import BytesIO
+
+import aws_clients
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 OUTPUT_BUCKET_NAME = os.getenv('OUTPUT_BUCKET_NAME')
 DESTINATION_PREFIX = 'result'
+MANIFEST_KEY = f'{DESTINATION_PREFIX}/manifest.json'
+
+MB = 1024 * 1024
+# Number of concurrent uploads when extracting a tarfile
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', 8))
+# Maximum number of bytes of extracted data held in memory while waiting to be uploaded
+UPLOAD_MEMORY_BUDGET = int(os.getenv('UPLOAD_MEMORY_BUDGET_MB', 64)) * MB
+# Members larger than this are uploaded with a multipart upload (S3 requires parts of at least 5 MB)
+MULTIPART_PART_SIZE = max(int(os.getenv('MULTIPART_PART_SIZE_MB', 8)), 5) * MB
+# Number of concurrent DeleteObjects requests when deleting a prefix
+DELETE_CONCURRENCY = int(os.getenv('DELETE_CONCURRENCY', 8))
+# Keys per DeleteObjects request (S3 accepts at most 1000)
+DELETE_BATCH_SIZE = 1000
+# Number of keys included in the log messages of a deletion
+DELETE_LOG_SAMPLE_SIZE = 10
+
+class MemoryBudget:
+    def __init__(self, max_bytes):
+        """A counting semaphore for bytes, used to bound the memory of data waiting to be uploaded
+
+        Arguments:
+            max_bytes {int} -- the maximum number of bytes that can be held at once
+        """
+        self.__max_bytes = max_bytes
+        self.__available = max_bytes
+        self.__condition = threading.Condition()
+
+    def acquire(self, num_bytes):
+        """Block until num_bytes are available and take them
+
+        Arguments:
+            num_bytes {int} -- the number of bytes to take
+
+        Returns:
+            int -- the number of bytes taken (to pass to release)
+        """
+        # A single request larger than the whole budget waits for everything else to be released
+        num_bytes = min(num_bytes, self.__max_bytes)
+        with self.__condition:
+            while self.__available < num_bytes:
+                self.__condition.wait()
+            self.__available -= num_bytes
+        return num_bytes
+
+    def release(self, num_bytes):
+        """Give back bytes taken with acquire
+
+        Arguments:
+            num_bytes {int} -- the value returned by acquire
+        """
+        with self.__condition:
+            self.__available += num_bytes
+            self.__condition.notify_all()
 
 class S3Client:
     def __init__(self):
-        self.__s3 = boto3.resource('s3')
-        self.__bucket = self.__s3.Bucket(OUTPUT_BUCKET_NAME)
+        # The client is thread safe, so it is shared by the concurrent uploads and deletes
+        self.__client = aws_clients.client('s3')
 
     def delete_objects_with_prefix(self, prefix):
         """Delete all S3 objects in OUTPUT_BUCKET_NAME whose keys start with the given prefix
+
+        The keys are listed page by page, and every page (up to DELETE_BATCH_SIZE keys) is deleted
+        with one DeleteObjects request on a thread pool while the next page is listed.
         
         Arguments:
             prefix {string} -- the S3 key prefix
         
         Returns:
-            object -- the response from S3
+            dict -- the number of deleted keys and a list of {'Key', 'Code', 'Message'} for the keys
+                that could not be deleted
+        """
+        paginator = self.__client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=OUTPUT_BUCKET_NAME,
+            Prefix=prefix,
+            PaginationConfig={'PageSize': DELETE_BATCH_SIZE}
+        )
+
+        batches = []
+        sampled_keys = []
+        with ThreadPoolExecutor(max_workers=DELETE_CONCURRENCY) as executor:
+            for page in pages:
+                keys = [x['Key'] for x in page.get('Contents', [])]
+                if len(keys) == 0:
+                    continue
+                sampled_keys += keys[:DELETE_LOG_SAMPLE_SIZE - len(sampled_keys)]
+                batches.append(executor.submit(self.__delete_batch, keys))
+
+        deleted = 0
+        errors = []
+        for batch in batches:
+            batch_deleted, batch_errors = batch.result()
+            deleted += batch_deleted
+            errors += batch_errors
+
+        logger.info(f'Deleted {deleted} objects with prefix {prefix} in {len(batches)} batches, e.g. {sampled_keys}.')
+        if len(errors) > 0:
+            logger.error(f'Failed to delete {len(errors)} objects with prefix {prefix}, e.g. {errors[:DELETE_LOG_SAMPLE_SIZE]}.')
+        return {'deleted': deleted, 'errors': errors}
+
+    def __delete_batch(self, keys):
+        """Delete up to DELETE_BATCH_SIZE keys with one request (runs in the executor)
+
+        Returns:
+            tuple -- (the number of deleted keys, a list of errors for the keys that were not deleted)
         """
-        objects_to_delete = self.__bucket.objects.filter(Prefix=prefix)
-        key_list = [x.key for x in objects_to_delete.all()]
-        logger.info(f'Deleting the following objects: {key_list}')
-        return objects_to_delete.delete()
+        try:
+            response = self.__client.delete_objects(
+                Bucket=OUTPUT_BUCKET_NAME,
+                Delete={'Objects': [{'Key': x} for x in keys], 'Quiet': True}
+            )
+        except Exception as e:
+            # The whole request failed, so none of the keys were deleted
+            return 0, [{'Key': x, 'Code': type(e).__name__, 'Message': str(e)} for x in keys]
+
+        # In quiet mode the response only lists the keys that could not be deleted
+        errors = [{'Key': x['Key'], 'Code': x.get('Code'), 'Message': x.get('Message')} for x in response.get('Errors', [])]
+        return len(keys) - len(errors), errors
 
     def copy_object(self, source_key, destination_key):
         """Copy an object in OUTPUT_BUCKET_NAME
@@ -47,7 +150,7 @@ class S3Client:
             'Key': source_key
         }
         logger.info(f'Copying {source_key} to {destination_key}')
-        return self.__bucket.copy(source_object_info, destination_key)
+        return self.__client.copy(source_object_info, OUTPUT_BUCKET_NAME, destination_key)
 
     def create_object(self, key, contents):
         """Create an object in the OUTPUT_BUCKET_NAME S3 bucket
@@ -60,13 +163,39 @@ class S3Client:
             object -- the response from S3
         """
         logger.info(f'Creating object - Key: {key}, Value: {contents}')
-        return self.__bucket.put_object(
+        return self.__client.put_object(
+            Bucket=OUTPUT_BUCKET_NAME,
             Body=contents,
             Key=key
         )
 
-    def unzip_tarfile(self, source_key, destination_key_prefix, delete_source_file=False):
+    def get_json_object(self, key):
+        """Read a JSON object from OUTPUT_BUCKET_NAME
+
+        Arguments:
+            key {string} -- the S3 key
+
+        Returns:
+            dict -- the parsed object, or None if it does not exist
+        """
+        try:
+            body = self.__client.get_object(Bucket=OUTPUT_BUCKET_NAME, Key=key)['Body']
+        except self.__client.exceptions.NoSuchKey:
+            return None
+        return json.loads(body.read())
+
+    def unzip_tarfile(self, source_key, destination_key_prefix, delete_source_file=False, previous_files=None):
         """Unzip a gzipped tarfile (.tar.gz) file in S3
+
+        The archive is streamed from S3 through the gzip/tar reader, so nothing is written to local
+        storage. Members are uploaded concurrently while the rest of the archive is being read, and
+        members larger than MULTIPART_PART_SIZE are uploaded in parts. The extracted data waiting to
+        be uploaded is limited to UPLOAD_MEMORY_BUDGET bytes.
+
+        Members whose content hash matches the same file in previous_files are not uploaded again;
+        the returned file list points at the existing object instead. A large member with the same
+        size as its previous version is spooled to local storage while it is hashed, so it is only
+        uploaded when it changed.
         
         Arguments:
             source_key {string} -- the S3 key of the source file (should end in .tar.gz)
@@ -76,55 +205,206 @@ class S3Client:
                 <destination_key_prefix><file_two_name>, etc.)
             delete_source_file {boolean} -- True if you want to delete the source file, otherwise False
                 default is False
+            previous_files {dict} -- the files of a previous extraction, as returned by this method
+                default is None
         Returns:
-            boolean -- True if extraction successful, else False
+            tuple -- (True if extraction successful else False, dict with the S3 key, sha256 and size
+                of each extracted file keyed by its name in the archive)
         """
-        # Fetch and load source file
+        previous_files = previous_files or {}
+
+        # Open the source file as a stream
         try:
-            temp_file = tempfile.NamedTemporaryFile()
-            self.__bucket.download_file(source_key, temp_file.name)
-            tar_file = tarfile.open(temp_file.name)
+            body = self.__client.get_object(Bucket=OUTPUT_BUCKET_NAME, Key=source_key)['Body']
+            tar_file = tarfile.open(fileobj=body, mode='r|gz')
         except Exception as e:
             logger.error(f'Could not download or open source file {source_key}. {e}')
             raise e
 
         # Extract files and stream them to S3
+        budget = MemoryBudget(UPLOAD_MEMORY_BUDGET)
+        uploads = []
         success = True
-        for file_name in tar_file.getnames():
-            success &= self.__extract(tar_file, file_name, destination_key_prefix)
-            if not success:
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            try:
+                for member in tar_file:
+                    if not member.isfile():
+                        continue
+                    uploads.append((member.name, self.__extract(
+                        executor, budget, tar_file, member, destination_key_prefix, previous_files.get(member.name)
+                    )))
+            except Exception as e:
+                logger.error(f'Failed to read {source_key}. {e}')
+                success = False
+            finally:
                 tar_file.close()
-                return False
-        
-        tar_file.close()
+
+            files = {}
+            for file_name, wait_for_upload in uploads:
+                files[file_name] = wait_for_upload()
+                success &= files[file_name] is not None
+
+        if not success:
+            return False, files
 
         if delete_source_file:
             self.delete_objects_with_prefix(source_key)
 
-        return True
+        return True, files
+
+    def __extract(self, executor, budget, tar_file, member, destination_key_prefix, previous_file):
+        """Read a file from a tar archive stream and start uploading it to S3
+
+        The member is read completely before this returns (the archive is a stream), but the
+        upload continues in the background.
 
-    def __extract(self, tar_file, file_name_to_extract, destination_key_prefix):
-        """Extract a file from a tar archive and upload it to S3
-        
         Arguments:
-            tar_file {string} -- the name of the file in the tar archive
-            file_name_to_extract {string} -- the name of the file in the tar archive
+            executor {ThreadPoolExecutor} -- the executor that runs the uploads
+            budget {MemoryBudget} -- limits the bytes waiting to be uploaded
+            tar_file {TarFile} -- the tar archive, opened in stream mode
+            member {TarInfo} -- the file in the tar archive to extract
             destination_key_prefix {string} -- the S3 prefix for the extracted file
-        
+            previous_file {dict} -- the same file from a previous extraction, or None
+
         Returns:
-            boolean -- True if extraction succeeds, else False
+            function -- waits for the upload to finish and returns the file information if it
+                succeeds, else None
         """
+        key = os.path.join(destination_key_prefix, member.name)
+        file_obj = tar_file.extractfile(member)
+
+        if member.size <= MULTIPART_PART_SIZE:
+            data = file_obj.read()
+            file_info = {'key': key, 'sha256': hashlib.sha256(data).hexdigest(), 'size': len(data)}
+            if previous_file and previous_file['sha256'] == file_info['sha256']:
+                logger.info(f'Skipped {member.name}, it is unchanged.')
+                return lambda: previous_file
+            reserved = budget.acquire(len(data))
+            return executor.submit(self.__put_object, file_info, data, budget, reserved).result
+
+        if previous_file and previous_file['size'] == member.size:
+            return self.__upload_if_changed(executor, budget, file_obj, key, member.name, previous_file)
+
+        return self.__multipart_upload(executor, budget, file_obj, key, member.name)
+
+    def __put_object(self, file_info, data, budget, reserved):
+        """Upload a small extracted file (runs in the executor)"""
+        key = file_info['key']
+        try:
+            self.__client.put_object(Bucket=OUTPUT_BUCKET_NAME, Key=key, Body=data)
+            logger.info(f'Extracted {key}.')
+            return file_info
+        except Exception as e:
+            logger.error(f'Failed to extract {key}. {e}')
+            return None
+        finally:
+            budget.release(reserved)
+
+    def __upload_part(self, key, upload_id, part_number, data, budget, reserved):
+        """Upload one part of a multipart upload (runs in the executor)"""
         try:
-            self.__bucket.upload_fileobj(
-                Fileobj=tar_file.extractfile(file_name_to_extract),
-                Key=os.path.join(destination_key_prefix, file_name_to_extract)
+            response = self.__client.upload_part(
+                Bucket=OUTPUT_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=data
             )
-            logger.info(f'Extracted {file_name_to_extract}.')
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        finally:
+            budget.release(reserved)
+
+    def __upload_if_changed(self, executor, budget, file_obj, key, file_name, previous_file):
+        """Upload a large extracted file in parts, unless it is the same as the previous file
+
+        The content hash is only known once the whole file has been read from the archive stream,
+        so the file is written to a temporary file while it is hashed, and uploaded from there.
+
+        Returns:
+            function -- waits for the upload to finish and returns the file information if it
+                succeeds (or the previous file information if it is unchanged), else None
+        """
+        with tempfile.TemporaryFile() as spool:
+            sha256 = hashlib.sha256()
+            while True:
+                data = file_obj.read(MULTIPART_PART_SIZE)
+                if not data:
+                    break
+                sha256.update(data)
+                spool.write(data)
+
+            if previous_file['sha256'] == sha256.hexdigest():
+                logger.info(f'Skipped {file_name}, it is unchanged.')
+                return lambda: previous_file
+
+            spool.seek(0)
+            return self.__multipart_upload(executor, budget, spool, key, file_name)
+
+    def __multipart_upload(self, executor, budget, file_obj, key, file_name):
+        """Upload a large extracted file in parts
+
+        The parts are read from the file one after another and uploaded concurrently.
+
+        Returns:
+            function -- waits for the upload to finish and returns the file information if it
+                succeeds, else None
+        """
+        upload_id = self.__client.create_multipart_upload(Bucket=OUTPUT_BUCKET_NAME, Key=key)['UploadId']
+        parts = []
+        sha256 = hashlib.sha256()
+        size = 0
+        try:
+            part_number = 1
+            while True:
+                data = file_obj.read(MULTIPART_PART_SIZE)
+                if not data:
+                    break
+                sha256.update(data)
+                size += len(data)
+                reserved = budget.acquire(len(data))
+                parts.append(executor.submit(self.__upload_part, key, upload_id, part_number, data, budget, reserved))
+                part_number += 1
+        except Exception as e:
+            # The rest of the member can't be read, so wait for the parts in flight and give up
+            wait(parts)
+            self.__abort_multipart_upload(key, upload_id)
+            logger.error(f'Failed to extract {file_name}. {e}')
+            return lambda: None
+
+        file_info = {'key': key, 'sha256': sha256.hexdigest(), 'size': size}
+
+        # The upload is completed once all of its parts are done. The caller does that after reading
+        # the rest of the archive, so the parts upload in the meantime.
+        return lambda: self.__complete_multipart_upload(file_info, upload_id, parts)
+
+    def __complete_multipart_upload(self, file_info, upload_id, parts):
+        """Complete a multipart upload once all of its parts have been uploaded
+
+        Returns:
+            dict -- the file information if the upload succeeds, else None
+        """
+        key = file_info['key']
+        try:
+            part_info = [x.result() for x in parts]
+            self.__client.complete_multipart_upload(
+                Bucket=OUTPUT_BUCKET_NAME,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': part_info}
+            )
+            logger.info(f'Extracted {key}.')
+            return file_info
         except Exception as e:
-            logger.error(f'Failed to extract {file_name_to_extract}. {e}')
-            return False
+            wait(parts)
+            self.__abort_multipart_upload(key, upload_id)
+            logger.error(f'Failed to extract {key}. {e}')
+            return None
 
-        return True
+    def __abort_multipart_upload(self, key, upload_id):
+        try:
+            self.__client.abort_multipart_upload(Bucket=OUTPUT_BUCKET_NAME, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logger.error(f'Failed to abort the multipart upload of {key}. {e}')
 
 class EventParser:
     def __init__(self, event):
@@ -141,9 +421,32 @@ class EventParser:
         output_zip_url = model_artifacts_zip_url.replace('model.tar.gz', 'output.tar.gz')
         return output_zip_url.replace(f's3://{OUTPUT_BUCKET_NAME}/','')
 
+    def get_run_id(self):
+        """Get a name for this run, used for its S3 prefix
+
+        Returns:
+            string -- the SageMaker training job name, or the folder of the output key if the
+                event does not contain it
+        """
+        training_job_name = self.__event['PreviousStep'].get('TrainingJobName')
+        if training_job_name:
+            return training_job_name
+        return self.get_sagemaker_output_key().split('/output/')[0].replace('/', '-')
+
 
 def lambda_handler(event, context):
     """The main entrypoint to the lambda function
+
+    The output of every run is extracted to its own prefix (result/runs/<run id>/) and is never
+    modified afterwards. When the extraction is complete, result/manifest.json is replaced with a
+    manifest that lists the S3 key of every file of the run. Readers should get the manifest and
+    read the files it lists, which gives them a consistent set of files even while a new run is
+    being published. Files that did not change since the previous run are not uploaded again; the
+    manifest points at the copy from the earlier run.
+
+    The run prefixes are kept: a file of the current manifest can be stored under the prefix of any
+    earlier run, so deleting the prefix of an old run would break it. Old runs should be cleaned up
+    by deleting the objects under result/runs/ that the current manifest does not list.
     
     Arguments:
         event {dict} -- the event that triggered the lambda
@@ -156,27 +459,44 @@ def lambda_handler(event, context):
 
     s3 = S3Client()
     event_parser = EventParser(event)
+    source_key = event_parser.get_sagemaker_output_key()
+    run_id = event_parser.get_run_id()
+    run_prefix = f'{DESTINATION_PREFIX}/runs/{run_id}'
+
+    previous_manifest = s3.get_json_object(MANIFEST_KEY) or {}
+    previous_files = previous_manifest.get('files', {})
 
-    # Copy result zip to final destination
-    extraction_successful = s3.unzip_tarfile(
-        source_key=event_parser.get_sagemaker_output_key(),
-        destination_key_prefix=DESTINATION_PREFIX,
-        delete_source_file=False
+    # Extract the result zip to the run prefix
+    extraction_successful, files = s3.unzip_tarfile(
+        source_key=source_key,
+        destination_key_prefix=run_prefix,
+        delete_source_file=False,
+        previous_files=previous_files
     )
 
-    # Update the file that shows where the output.tar.gz came from
     if extraction_successful:
-        create_result = s3.create_object(
-            key=f'{DESTINATION_PREFIX}/output_source.txt',
-            contents=f'The data files in this folder came from {event_parser.get_sagemaker_output_key()}'
-        )
+        manifest = {
+            'run_id': run_id,
+            'source_key': source_key,
+            'created': datetime.datetime.utcnow().isoformat() + 'Z',
+            'previous_run_id': previous_manifest.get('run_id'),
+            'files': files
+        }
+        # Keep a copy of the manifest with the run, then point readers at the new run
+        s3.create_object(key=f'{run_prefix}/manifest.json', contents=json.dumps(manifest))
+        s3.create_object(key=MANIFEST_KEY, contents=json.dumps(manifest))
     else:
-        create_result = s3.create_object(
-            key=f'{DESTINATION_PREFIX}/error.txt',
-            contents=f'There was an error in extracting new data. Some of the data files in this folder may have been overwritten erroneously. Please replace them with the data described in output_source.txt.'
+        s3.create_object(
+            key=f'{run_prefix}/error.txt',
+            contents=f'There was an error in extracting the data from {source_key}. {MANIFEST_KEY} was not updated and still points at the previous run.'
         )
 
+    uploaded = [x for x, info in files.items() if info is not None and info['key'].startswith(run_prefix + '/')]
     return {
-        'source_key': event_parser.get_sagemaker_output_key(),
-        'destination_prefix': DESTINATION_PREFIX
-    }
\ No newline at end of file
+        'source_key': source_key,
+        'destination_prefix': run_prefix,
+        'manifest_key': MANIFEST_KEY if extraction_successful else None,
+        'extraction_successful': extraction_successful,
+        'files_uploaded': len(uploaded),
+        'files_unchanged': len([x for x in files.values() if x is not None]) - len(uploaded)
+    }
@@ -0,0 +1,42 @@
+import logging
+
+import aws_clients
+from state_store import create_state_store
+from run_index import RunIndex
+from check_training_job_status import transform_metric_data_list
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+run_index = RunIndex(create_state_store())
+
+def lambda_handler(event, context):
+    """The main entrypoint to the lambda function
+
+    Records the run of the execution in the run index, so the same data, image and settings are not
+    trained again. The state machines call it as their last step before Success, so a run is only
+    recorded when it was published or deployed too.
+
+    Arguments:
+        event {dict} -- the training job name (the execution name) and the state machine input
+        context -- lambda context
+
+    Returns:
+        dict -- whether the run was recorded
+    """
+    logger.info(f'event: {event}')
+
+    fingerprint = event['input'].get('fingerprint')
+    training_job_name = event['training_job_name']
+    if not fingerprint:
+        logger.info('The execution has no fingerprint. Not recording the run.')
+        return {'Recorded': False}
+
+    job_info = aws_clients.client('sagemaker').describe_training_job(TrainingJobName=training_job_name)
+    recorded = run_index.record_completed_run(
+        fingerprint=fingerprint,
+        training_job_name=training_job_name,
+        model_artifacts=job_info.get('ModelArtifacts', None),
+        metrics=transform_metric_data_list(job_info.get('FinalMetricDataList', None))
+    )
+    return {'Recorded': recorded, 'Fingerprint': fingerprint}
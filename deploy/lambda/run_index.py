@@ -0,0 +1,79 @@
+import json
+import hashlib
+import datetime
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+def compute_fingerprint(s3_info, ecr_info, sagemaker_settings):
+    """Compute a fingerprint of everything that determines the result of a training run
+
+    Arguments:
+        s3_info {dict} -- the training data version information
+        ecr_info {dict} -- the training docker image information
+        sagemaker_settings {dict} -- the SageMaker settings, including the hyperparameters
+
+    Returns:
+        string -- the fingerprint, or None if the image digest or data version is not known
+    """
+    if not ecr_info.get('image_digest') or not s3_info.get('version'):
+        return None
+
+    inputs = {
+        'data': [s3_info['bucket_name'], s3_info['key'], s3_info['version']],
+        # Outputs are published per repository, so the same image in another repository is another run
+        'image': [ecr_info['repository_name'], ecr_info['image_digest']],
+        'settings': hashlib.sha256(json.dumps(sagemaker_settings, sort_keys=True).encode('utf-8')).hexdigest()
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+class RunIndex:
+    def __init__(self, state_store):
+        """An index of the completed training runs by fingerprint
+
+        Arguments:
+            state_store -- a state store (see state_store.py)
+        """
+        self.__state_store = state_store
+
+    @staticmethod
+    def __key(fingerprint):
+        return 'run#{}'.format(fingerprint)
+
+    def get_completed_run(self, fingerprint):
+        """Look up a training run whose execution succeeded
+
+        Arguments:
+            fingerprint {string} -- the fingerprint of the run, see compute_fingerprint
+
+        Returns:
+            dict -- the run that was recorded with record_completed_run, or None
+        """
+        if fingerprint is None:
+            return None
+        run, _ = self.__state_store.get_item(self.__key(fingerprint))
+        return run
+
+    def record_completed_run(self, fingerprint, training_job_name, model_artifacts, metrics):
+        """Record a training run whose execution succeeded
+
+        Arguments:
+            fingerprint {string} -- the fingerprint of the run, see compute_fingerprint
+            training_job_name {string} -- the name of the SageMaker training job
+            model_artifacts {dict} -- the model artifacts of the training job
+            metrics {dict} -- the final metrics of the training job
+
+        Returns:
+            bool -- True if the run was recorded, False if a run with the same fingerprint already was
+        """
+        run = {
+            'training_job_name': training_job_name,
+            'model_artifacts': model_artifacts,
+            'metrics': metrics,
+            'completed': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        }
+        recorded = self.__state_store.put_item(self.__key(fingerprint), run) is not None
+        if recorded:
+            logger.info('Recorded training run {} with fingerprint {}.'.format(training_job_name, fingerprint))
+        return recorded
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+import logging
+
+import aws_clients
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+STATE_TABLE_NAME = os.getenv('STATE_TABLE_NAME')
+
+class DynamoDbStateStore:
+    def __init__(self, table_name, client=None):
+        """A small key/value store on a DynamoDB table, with optimistic concurrency
+
+        Every item has a version number. A write only succeeds if the item still has the version
+        the caller read, so concurrent Lambda invocations can't overwrite each other's changes.
+        The table needs a string partition key called "key". Items written with a ttl_seconds
+        have an "expires_at" attribute that can be used as the table's time to live attribute.
+
+        Arguments:
+            table_name {string} -- the name of the DynamoDB table
+
+        Keyword Arguments:
+            client -- the DynamoDB client to use (default: {None}, the shared client of aws_clients)
+        """
+        self.__table_name = table_name
+        self.__own_client = client
+
+    @property
+    def __client(self):
+        # Created on first use, so a Lambda function that doesn't touch the store doesn't pay for it
+        return self.__own_client or aws_clients.client('dynamodb')
+
+    def get_item(self, key):
+        """Get an item
+
+        Arguments:
+            key {string} -- the item key
+
+        Returns:
+            tuple -- (the item's data as a dict, the item's version), or (None, None) if it does not exist
+        """
+        response = self.__client.get_item(
+            TableName=self.__table_name,
+            Key={'key': {'S': key}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        if item is None:
+            return None, None
+        return json.loads(item['data']['S']), int(item['version']['N'])
+
+    def put_item(self, key, data, expected_version=None, ttl_seconds=None):
+        """Write an item if it has not changed since it was read
+
+        Arguments:
+            key {string} -- the item key
+            data {dict} -- the item's data (must be JSON serializable)
+
+        Keyword Arguments:
+            expected_version {int} -- the version returned by get_item, or None to only write the
+                item if it does not exist (default: {None})
+            ttl_seconds {int} -- the number of seconds to keep the item for (default: {None}, keep it)
+
+        Returns:
+            int -- the new version of the item, or None if the item was changed by someone else
+        """
+        version = 1 if expected_version is None else expected_version + 1
+        item = {
+            'key': {'S': key},
+            'version': {'N': str(version)},
+            'data': {'S': json.dumps(data)}
+        }
+        if ttl_seconds is not None:
+            item['expires_at'] = {'N': str(int(time.time() + ttl_seconds))}
+
+        if expected_version is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(#key)', 'ExpressionAttributeNames': {'#key': 'key'}}
+        else:
+            condition = {
+                'ConditionExpression': '#version = :expected_version',
+                'ExpressionAttributeNames': {'#version': 'version'},
+                'ExpressionAttributeValues': {':expected_version': {'N': str(expected_version)}}
+            }
+
+        try:
+            self.__client.put_item(TableName=self.__table_name, Item=item, **condition)
+        except self.__client.exceptions.ConditionalCheckFailedException:
+            return None
+        return version
+
+class InMemoryStateStore:
+    def __init__(self):
+        """A stand-in for DynamoDbStateStore that keeps the items in memory
+
+        It is safe to use from several threads, so it can stand in for concurrent Lambda invocations
+        in tests and local runs.
+        """
+        self.__items = {}
+        self.__lock = threading.Lock()
+
+    def get_item(self, key):
+        """Get an item
+
+        Arguments:
+            key {string} -- the item key
+
+        Returns:
+            tuple -- (the item's data as a dict, the item's version), or (None, None) if it does not exist
+        """
+        with self.__lock:
+            if key not in self.__items:
+                return None, None
+            data, version, expires_at = self.__items[key]
+            if expires_at is not None and expires_at <= time.time():
+                return None, None
+            # Return a copy, like a real store would
+            return json.loads(data), version
+
+    def put_item(self, key, data, expected_version=None, ttl_seconds=None):
+        """Write an item if it has not changed since it was read
+
+        Arguments:
+            key {string} -- the item key
+            data {dict} -- the item's data (must be JSON serializable)
+
+        Keyword Arguments:
+            expected_version {int} -- the version returned by get_item, or None to only write the
+                item if it does not exist (default: {None})
+            ttl_seconds {int} -- the number of seconds to keep the item for (default: {None}, keep it)
+
+        Returns:
+            int -- the new version of the item, or None if the item was changed by someone else
+        """
+        with self.__lock:
+            current = self.__items.get(key)
+            if current is not None and current[2] is not None and current[2] <= time.time():
+                current = None
+            current_version = None if current is None else current[1]
+            if current_version != expected_version:
+                return None
+
+            version = 1 if expected_version is None else expected_version + 1
+            expires_at = None if ttl_seconds is None else time.time() + ttl_seconds
+            self.__items[key] = (json.dumps(data), version, expires_at)
+            return version
+
+def create_state_store():
+    """Create the state store for this Lambda function
+
+    Returns:
+        object -- a DynamoDbStateStore on STATE_TABLE_NAME, or an InMemoryStateStore if it is not set
+    """
+    if STATE_TABLE_NAME:
+        return DynamoDbStateStore(STATE_TABLE_NAME)
+    logger.info('STATE_TABLE_NAME is not set. Keeping the state in memory.')
+    return InMemoryStateStore()
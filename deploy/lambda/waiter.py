@@ -0,0 +1,122 @@
+import time
+import random
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Bounds for the time between two status checks
+MIN_WAIT_SECONDS = 5
+MAX_WAIT_SECONDS = 120
+# Once a status lasts longer than expected, the waits grow by this factor up to OVERDUE_MAX_WAIT_SECONDS
+OVERDUE_BACKOFF = 1.5
+OVERDUE_MAX_WAIT_SECONDS = 30
+# Seconds to keep in reserve when waiting inside a Lambda invocation
+LAMBDA_TIME_MARGIN_SECONDS = 10
+
+# Roughly how long SageMaker resources stay in each status. Statuses that are not listed use the default.
+DEFAULT_EXPECTED_SECONDS = 300
+ENDPOINT_EXPECTED_SECONDS = {
+    'Creating': 420,
+    'Updating': 420,
+    'SystemUpdating': 300,
+    'RollingBack': 300,
+    'Deleting': 120
+}
+
+def next_wait_seconds(expected_seconds, elapsed_seconds, overdue_attempt, min_seconds=MIN_WAIT_SECONDS, max_seconds=MAX_WAIT_SECONDS):
+    """Get the number of seconds to wait before checking a status again
+
+    While the status is expected to last a while longer, the next check is halfway to the expected
+    end of the status, so the checks get closer together as the end approaches. Once the status
+    has lasted longer than expected, the waits grow exponentially from min_seconds, but stay short
+    (OVERDUE_MAX_WAIT_SECONDS) because the status can change any moment. The result is jittered so
+    that executions that started together don't check in lockstep.
+
+    Arguments:
+        expected_seconds {float} -- how long the status is expected to last
+        elapsed_seconds {float} -- how long the status has lasted so far
+        overdue_attempt {int} -- the number of checks since the status lasted longer than expected
+
+    Keyword Arguments:
+        min_seconds {float} -- the shortest wait (default: {MIN_WAIT_SECONDS})
+        max_seconds {float} -- the longest wait (default: {MAX_WAIT_SECONDS})
+
+    Returns:
+        int -- the number of seconds to wait (at least 1)
+    """
+    remaining = expected_seconds - elapsed_seconds
+    if remaining > min_seconds:
+        wait = remaining / 2
+    else:
+        wait = min(min_seconds * OVERDUE_BACKOFF ** overdue_attempt, OVERDUE_MAX_WAIT_SECONDS)
+    wait = min(max(wait, min_seconds), max_seconds)
+    # "Equal jitter": at least half of the wait, plus a random part of the other half
+    return max(int(wait / 2 + random.uniform(0, wait / 2)), 1)
+
+class StatusWaiter:
+    def __init__(self, describe, get_status, terminal_statuses, expected_seconds, long_wait_seconds=0):
+        """Check the status of a resource and decide how long to wait before the next check
+
+        The state of the waiter is returned by check and passed back in on the next check, so it can
+        be carried between Lambda invocations by the Step Functions state machine. The state machine
+        then waits for WaitSeconds (with a Wait state that uses SecondsPath) before the next check.
+
+        The waiter can also wait inside the Lambda invocation (long_wait_seconds), which saves state
+        transitions and invocations when the resource is expected to be ready soon.
+
+        Arguments:
+            describe {function} -- gets the description of the resource
+            get_status {function} -- gets the status from the description
+            terminal_statuses {list} -- the statuses that don't change anymore
+            expected_seconds {dict} -- how long the resource stays in each status
+
+        Keyword Arguments:
+            long_wait_seconds {float} -- how long to keep checking inside the Lambda invocation (default: {0})
+        """
+        self.__describe = describe
+        self.__get_status = get_status
+        self.__terminal_statuses = terminal_statuses
+        self.__expected_seconds = expected_seconds
+        self.__long_wait_seconds = long_wait_seconds
+
+    def check(self, state=None, context=None):
+        """Check the status, waiting inside the invocation if the long wait allows it
+
+        Arguments:
+            state {dict} -- the state returned by the previous check, or None for the first check
+            context -- the Lambda context, used to stop waiting before the Lambda times out
+
+        Returns:
+            tuple -- (the description of the resource, the new state with the keys Status, StatusSince,
+                     Checks, OverdueChecks and WaitSeconds, which is 0 once the status is terminal)
+        """
+        state = dict(state or {})
+        start = time.time()
+        while True:
+            description = self.__describe()
+            status = self.__get_status(description)
+            now = time.time()
+
+            if status != state.get('Status'):
+                state.update({'Status': status, 'StatusSince': now, 'Checks': 0, 'OverdueChecks': 0})
+            state['Checks'] += 1
+
+            if status in self.__terminal_statuses:
+                state['WaitSeconds'] = 0
+                return description, state
+
+            expected = self.__expected_seconds.get(status, DEFAULT_EXPECTED_SECONDS)
+            elapsed = now - state['StatusSince']
+            state['WaitSeconds'] = next_wait_seconds(expected, elapsed, state['OverdueChecks'])
+            if expected - elapsed <= MIN_WAIT_SECONDS:
+                state['OverdueChecks'] += 1
+
+            # Keep waiting here if the next check fits in the long wait and in the Lambda invocation
+            budget = self.__long_wait_seconds - (now - start)
+            if context is not None:
+                budget = min(budget, context.get_remaining_time_in_millis() / 1000.0 - LAMBDA_TIME_MARGIN_SECONDS)
+            if state['WaitSeconds'] > budget:
+                logger.info(f"Status {status} for {elapsed:.0f} seconds. Next check in {state['WaitSeconds']} seconds.")
+                return description, state
+            time.sleep(state['WaitSeconds'])
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# Benchmarks the cold start of the Lambda functions in deploy/lambda. Every function is imported in a
+# fresh process, like a new Lambda execution environment, and its handler (or the part of it that
+# talks to AWS) is called twice: the first call includes the creation of the AWS clients it needs, the
+# second one shows the latency of a warm invocation.
+# The AWS endpoints are replaced by a local HTTP server (through AWS_ENDPOINT_URL) that answers with
+# canned responses, so the requests go through the real client, serialization and connection pool.
+#
+# Usage:
+#   python benchmark_cold_start.py [--repeat 5]
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+
+# Canned responses by X-Amz-Target
+RESPONSES = {
+    'SageMaker.DescribeEndpoint': {
+        'EndpointName': 'benchmark', 'EndpointArn': 'arn:aws:sagemaker:us-east-1:123456789012:endpoint/benchmark',
+        'EndpointConfigName': 'benchmark', 'EndpointStatus': 'InService', 'CreationTime': 0, 'LastModifiedTime': 0
+    },
+    'SageMaker.UpdateEndpoint': {'EndpointArn': 'arn:aws:sagemaker:us-east-1:123456789012:endpoint/benchmark'},
+    'SageMaker.DescribeTrainingJob': {
+        'TrainingJobName': 'benchmark', 'TrainingJobArn': 'arn:aws:sagemaker:us-east-1:123456789012:training-job/benchmark',
+        'TrainingJobStatus': 'InProgress', 'SecondaryStatus': 'Training',
+        'ModelArtifacts': {'S3ModelArtifacts': 's3://bucket/model.tar.gz'}
+    }
+}
+
+TRAINING_JOB_INPUT = {
+    'execution_name': 'benchmark',
+    'input': {
+        's3': {'bucket_name': 'data'},
+        'ecr': {'repository_name': 'master', 'image_uri': 'image'},
+        'sagemaker': {'TrainingJob': {
+            'HyperParameters': {}, 'MetricDefinitions': [], 'StoppingCondition': {},
+            'TrainingResourceConfig': {'InstanceType': 'ml.m5.large', 'VolumeSizeInGB': 10}
+        }}
+    }
+}
+
+# (Lambda module, the function to call, its arguments)
+CASES = [
+    ('create_training_job', 'lambda_handler', [TRAINING_JOB_INPUT, None]),
+    ('check_endpoint_status', 'lambda_handler', [{}, None]),
+    ('create_or_update_endpoint', 'lambda_handler', [{'endpoint_config_name': 'benchmark'}, None]),
+    ('check_training_job_status', 'lambda_handler', [{'PreviousStep': {'TrainingJobName': 'benchmark'}}, None]),
+    ('record_run', 'lambda_handler', [{'training_job_name': 'benchmark', 'input': {'fingerprint': 'benchmark'}}, None]),
+    ('canary', None, None),
+    # The training data version, the first S3 request of an execution
+    ('initiate_step_functions', 'S3Client.get_source_object_info', ['data', 'data.csv']),
+    # Every invocation creates an S3Client
+    ('push_output', 'S3Client', [])
+]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, don't let Nagle's algorithm delay the body
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps(RESPONSES.get(self.headers.get('X-Amz-Target'), {})).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('x-amz-version-id', 'benchmark')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def run_case(module_name, function_name, arguments):
+    """Import a Lambda module and call one of its functions twice (runs in a fresh process)"""
+    sys.path.insert(0, LAMBDA_DIR)
+    start = time.time()
+    module = __import__(module_name)
+    import_seconds = time.time() - start
+
+    invocations = []
+    if function_name is not None:
+        function = module
+        for name in function_name.split('.'):
+            function = getattr(function, name)
+        for _ in range(2):
+            start = time.time()
+            function(*json.loads(json.dumps(arguments)))
+            invocations.append(time.time() - start)
+
+    print(json.dumps({
+        'import_ms': import_seconds * 1000,
+        'first_ms': invocations[0] * 1000 if invocations else None,
+        'warm_ms': invocations[1] * 1000 if invocations else None,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    }))
+
+def measure(case, endpoint_url):
+    environment = dict(
+        os.environ,
+        AWS_ENDPOINT_URL=endpoint_url,
+        AWS_DEFAULT_REGION='us-east-1',
+        AWS_ACCESS_KEY_ID='testing',
+        AWS_SECRET_ACCESS_KEY='testing',
+        ENDPOINT_NAME='benchmark',
+        OUTPUT_BUCKET_NAME='output',
+        MASTER_ECR_REPOSITORY_NAME='master'
+    )
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', json.dumps(case)],
+        env=environment,
+        stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(x for x in values if x is not None)
+    return values[len(values) // 2] if values else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the Lambda functions.')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of fresh processes per function')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_case(*json.loads(args.child))
+        return
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    def ms(x):
+        return '-' if x is None else '{:.0f}'.format(x)
+    print('Medians of {} fresh processes'.format(args.repeat))
+    print('{:<28}{:>12}{:>12}{:>12}{:>14}'.format('function', 'import ms', 'first ms', 'warm ms', 'peak RSS MB'))
+    for case in CASES:
+        results = [measure(case, endpoint_url) for _ in range(args.repeat)]
+        print('{:<28}{:>12}{:>12}{:>12}{:>14.1f}'.format(
+            case[0],
+            ms(median([x['import_ms'] for x in results])),
+            ms(median([x['first_ms'] for x in results])),
+            ms(median([x['warm_ms'] for x in results])),
+            median([x['peak_rss_mb'] for x in results])))
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
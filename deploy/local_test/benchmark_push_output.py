@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Benchmarks the extraction of the training job's output.tar.gz in push_output.S3Client.unzip_tarfile
+# against the previous implementation (download the archive to a temporary file, then upload the
+# members one after another). S3 is replaced by moto's in-process stand-in. Since moto answers
+# immediately, --latency-ms adds a delay to every S3 request to mimic the round trip to S3.
+#
+# Usage:
+#   python benchmark_push_output.py [--files 200] [--file-mb 0.5] [--large-files 2] [--large-file-mb 64] [--latency-ms 20]
+
+import io
+import os
+import sys
+import time
+import tarfile
+import argparse
+import tempfile
+import tracemalloc
+
+import boto3
+from moto import mock_aws
+
+BUCKET_NAME = 'benchmark-output-bucket'
+os.environ['OUTPUT_BUCKET_NAME'] = BUCKET_NAME
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import push_output
+
+def legacy_unzip_tarfile(source_key, destination_key_prefix):
+    """The previous implementation of S3Client.unzip_tarfile
+
+    Returns:
+        int -- the number of bytes written to local storage
+    """
+    bucket = boto3.resource('s3').Bucket(BUCKET_NAME)
+    temp_file = tempfile.NamedTemporaryFile()
+    bucket.download_file(source_key, temp_file.name)
+    local_bytes = os.path.getsize(temp_file.name)
+    with tarfile.open(temp_file.name) as tar_file:
+        for file_name in tar_file.getnames():
+            bucket.upload_fileobj(
+                Fileobj=tar_file.extractfile(file_name),
+                Key=os.path.join(destination_key_prefix, file_name)
+            )
+    return local_bytes
+
+def build_archive(files, file_mb, large_files, large_file_mb):
+    """Build an output.tar.gz with many small files and a few large ones"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz', compresslevel=1) as tar:
+        sizes = [int(file_mb * 1e6)] * files + [int(large_file_mb * 1e6)] * large_files
+        for index, size in enumerate(sizes):
+            # Random data, so the archive is as large as its contents
+            info = tarfile.TarInfo(name='data/file-{:05d}.bin'.format(index))
+            info.size = size
+            tar.addfile(info, io.BytesIO(os.urandom(size)))
+    return buffer.getvalue()
+
+def add_latency(latency_ms):
+    """Delay every S3 request by the given number of milliseconds"""
+    if latency_ms <= 0:
+        return
+    def delay(**kwargs):
+        time.sleep(latency_ms / 1000.0)
+    boto3.DEFAULT_SESSION or boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register('before-send.s3', delay)
+
+def run(name, function):
+    tracemalloc.start()
+    start = time.time()
+    local_bytes = function()
+    seconds = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The peak memory includes the objects that moto keeps in memory for its stand-in of S3
+    print('{:<10} {:>8.2f} s   peak python memory {:>8.1f} MB   local storage {:>8.1f} MB'.format(
+        name, seconds, peak / 1e6, (local_bytes or 0) / 1e6))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the extraction of output.tar.gz')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--file-mb', type=float, default=0.5)
+    parser.add_argument('--large-files', type=int, default=2)
+    parser.add_argument('--large-file-mb', type=float, default=64)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    args = parser.parse_args()
+
+    with mock_aws():
+        add_latency(args.latency_ms)
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        archive = build_archive(args.files, args.file_mb, args.large_files, args.large_file_mb)
+        s3.put_object(Bucket=BUCKET_NAME, Key='job/output/output.tar.gz', Body=archive)
+        print('Archive: {:.1f} MB, {} files'.format(len(archive) / 1e6, args.files + args.large_files))
+        del archive
+
+        run('legacy', lambda: legacy_unzip_tarfile('job/output/output.tar.gz', 'legacy'))
+        run('streaming', lambda: push_output.S3Client().unzip_tarfile('job/output/output.tar.gz', 'streaming') and 0)
+
+        for prefix in ['legacy', 'streaming']:
+            objects = [x for page in s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET_NAME, Prefix=prefix)
+                       for x in page.get('Contents', [])]
+            print('{} objects ({:.1f} MB) under {}/'.format(len(objects), sum(x['Size'] for x in objects) / 1e6, prefix))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1155 @@
+#!/usr/bin/env python
+
+# Runs the training and deployment pipeline end to end on this machine and shows where the time goes,
+# from the arrival of new training data to a model that answers predictions. This is the regression
+# benchmark for the latency of the pipeline.
+#
+# The state machine of deploy/cloudformation/<pipeline>.yaml is run by a small interpreter of the
+# Amazon States Language (the parts of it the templates use). Its Lambda tasks call the handlers in
+# deploy/lambda in this process, with the environment variables the templates give them, and its
+# SageMaker and SNS tasks call the AWS APIs through aws_clients.py, like the Lambda functions do. The
+# AWS services are replaced by local stand-ins:
+#
+#   S3, ECR, SNS, DynamoDB   moto
+#   Step Functions           StartExecution is recorded and the execution is run by the interpreter
+#   SageMaker                LocalSageMaker. A training job downloads its input from the S3 stand-in,
+#                            runs container/algorithm/train.py on one process per instance (see
+#                            simulate_hosts.py), uploads model.tar.gz and output.tar.gz and reports the
+#                            metrics of its MetricDefinitions found in the training output. An endpoint
+#                            downloads its model and serves it with gunicorn and wsgi.py, and is
+#                            InService once /ping answers. InvokeEndpoint is sent to that server.
+#
+# Every run starts with the event initiate_step_functions.py receives for a new version of the training
+# data (or for a new image in the master ECR repository with --trigger image). The source code bundle it
+# reads the settings from is made of deploy/sagemaker-settings.json and the hyperparameters in
+# container/local_test. A second run with the model-server pipeline updates the endpoint of the first.
+#
+# The Wait states would wait as long as the status checks ask for (see waiter.py), which is sized for
+# SageMaker. The stand-ins are much faster, so every wait is cut to --max-wait seconds. The report shows
+# both, and the total with the requested waits.
+#
+# It needs boto3 and moto, and the packages in container/requirements.txt in the same environment. nginx
+# is not used: the endpoint is gunicorn alone, with gevent workers if gevent is installed.
+#
+# Usage:
+#   python simulate_pipeline.py [--pipeline model-server|batch-job] [--runs 1] [--trigger data|image]
+#                               [--instance-count 2] [--max-wait 1] [--json timings.json] [--verbose]
+
+import io
+import os
+import re
+import sys
+import copy
+import json
+import time
+import uuid
+import shutil
+import socket
+import logging
+import tarfile
+import zipfile
+import argparse
+import datetime
+import tempfile
+import importlib
+import importlib.util
+import threading
+import subprocess
+import multiprocessing
+import urllib.request
+
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+LOCAL_TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.normpath(os.path.join(LOCAL_TEST_DIR, '..', '..'))
+LAMBDA_DIR = os.path.join(REPOSITORY_DIR, 'deploy', 'lambda')
+TEMPLATE_DIR = os.path.join(REPOSITORY_DIR, 'deploy', 'cloudformation')
+ALGORITHM_DIR = os.path.join(REPOSITORY_DIR, 'container', 'algorithm')
+DATA_DIR = os.path.join(REPOSITORY_DIR, 'container', 'local_test', 'test_dir', 'input', 'data', 'train')
+PAYLOAD_FILE = os.path.join(REPOSITORY_DIR, 'container', 'local_test', 'payload.csv')
+sys.path.insert(0, LAMBDA_DIR)
+
+import aws_clients
+
+PIPELINES = ['model-server', 'batch-job']
+REGION = os.environ['AWS_DEFAULT_REGION']
+ACCOUNT_ID = '123456789012'
+
+# The values of !Ref for the parameters and resources of the templates
+RESOURCES = {
+    'ProductName': 'demo',
+    'ServiceName': 'pipeline',
+    'EnvironmentName': 'local',
+    # A trigger starts its execution right away (the window only matters for bursts of triggers)
+    'TriggerCoalesceWindowSeconds': '0',
+    'DataSourceBucket': 'local-pipeline-data-source',
+    'OutputBucket': 'local-pipeline-output',
+    'SourceCodeBucket': 'local-pipeline-source-code',
+    'MasterEcrRepository': 'local-pipeline-master',
+    'StagingEcrRepository': 'local-pipeline-staging',
+    'PipelineStateTable': 'local-pipeline-state',
+    'PipelineStatusSnsTopic': 'arn:aws:sns:{}:{}:local-pipeline-status'.format(REGION, ACCOUNT_ID),
+    'TrainAndDeployStateMachine': 'arn:aws:states:{}:{}:stateMachine:local-pipeline-train-deploy'.format(REGION, ACCOUNT_ID),
+    'SageMakerExecutionRole': 'arn:aws:iam::{}:role/local-pipeline-sagemaker'.format(ACCOUNT_ID)
+}
+
+# How long a training job or an endpoint may take to start before it fails
+ENDPOINT_START_TIMEOUT_SECONDS = 120
+# How often a .sync task checks the status of its job
+SYNC_POLL_SECONDS = 0.1
+
+logger = logging.getLogger(__name__)
+
+class StatesError(Exception):
+    def __init__(self, error, cause=''):
+        """An error of a state, which a Catch of the state or of an enclosing Parallel state can handle
+
+        Arguments:
+            error {string} -- the error name, e.g. States.TaskFailed
+            cause {string} -- the details
+        """
+        super().__init__('{}: {}'.format(error, cause))
+        self.error = error
+        self.cause = cause
+
+# ---------------------------------------------------------------------------------------------------
+# The CloudFormation templates
+
+class Template:
+    def __init__(self, pipeline):
+        """The template of a pipeline, base.yaml followed by <pipeline>.yaml like in deploy.sh
+
+        Only the parts this script needs are read, with regular expressions instead of a YAML parser
+        (the templates use the CloudFormation tags !Ref, !GetAtt, !Join and !Sub).
+
+        Arguments:
+            pipeline {string} -- model-server or batch-job
+        """
+        self.text = ''
+        for name in ['base.yaml', '{}.yaml'.format(pipeline)]:
+            with open(os.path.join(TEMPLATE_DIR, name)) as f:
+                self.text += f.read() + '\n'
+
+    def get_block(self, logical_id):
+        """Get the lines of a resource or parameter of the template"""
+        match = re.search(r'^  {}:[ \t]*\n((?:(?:[ \t]{{4}}.*)?\n)*)'.format(re.escape(logical_id)), self.text, re.M)
+        if match is None:
+            raise KeyError('The template has no resource {}.'.format(logical_id))
+        return match.group(1)
+
+    def is_function(self, logical_id):
+        return re.search(r'^\s+Type:\s*AWS::Lambda::Function\s*$', self.get_block(logical_id), re.M) is not None
+
+    def evaluate(self, value):
+        """Get the value of !Ref X, !GetAtt X.Arn or a literal"""
+        value = value.strip()
+        if value.startswith('!Ref '):
+            return RESOURCES[value[len('!Ref '):].strip()]
+        if value.startswith('!GetAtt '):
+            logical_id = value[len('!GetAtt '):].strip().split('.')[0]
+            if self.is_function(logical_id):
+                return 'arn:aws:lambda:{}:{}:function:{}'.format(REGION, ACCOUNT_ID, logical_id)
+            return RESOURCES[logical_id]
+        return value.strip('\'"')
+
+    def get_function(self, logical_id):
+        """Get the handler, timeout and environment variables of a Lambda function
+
+        Returns:
+            dict -- with the keys handler, timeout (seconds) and environment
+        """
+        block = self.get_block(logical_id)
+        handler = re.search(r'^\s+Handler:\s*(\S+)', block, re.M).group(1)
+        timeout = re.search(r'^\s+Timeout:\s*(\d+)', block, re.M)
+
+        environment = {}
+        lines = block.split('\n')
+        start = next((i for i, x in enumerate(lines) if x.strip() == 'Variables:'), None)
+        if start is not None:
+            indent = len(lines[start + 1]) - len(lines[start + 1].lstrip())
+            i = start + 1
+            while i < len(lines) and lines[i].strip() and len(lines[i]) - len(lines[i].lstrip()) == indent:
+                name, _, value = lines[i].strip().partition(':')
+                # The lines of a !Join are indented deeper: the separator, then the list
+                nested = []
+                i += 1
+                while i < len(lines) and lines[i].strip() and len(lines[i]) - len(lines[i].lstrip()) > indent:
+                    nested.append(lines[i].strip())
+                    i += 1
+                if value.strip() == '!Join':
+                    separator = self.evaluate(nested[0][2:])
+                    environment[name] = separator.join(self.evaluate(x.lstrip('- ')) for x in nested[1:])
+                else:
+                    environment[name] = self.evaluate(value)
+
+        return {
+            'handler': handler,
+            # The default timeout of a Lambda function is 3 seconds
+            'timeout': int(timeout.group(1)) if timeout else 3,
+            'environment': environment
+        }
+
+    def get_state_machine(self):
+        """Get the definition of TrainAndDeployStateMachine, with the !Sub variables replaced
+
+        Returns:
+            tuple -- (the definition, the logical ids of the Lambda functions it calls)
+        """
+        lines = self.get_block('TrainAndDeployStateMachine').split('\n')
+        start = next(i for i, x in enumerate(lines) if x.strip().startswith('DefinitionString:')) + 1
+        indent = len(lines[start]) - len(lines[start].lstrip())
+        # The definition, then the variables ("- { Name: value, ... }") at the indentation of "- |"
+        end = next(i for i in range(start + 1, len(lines)) if lines[i].strip() and len(lines[i]) - len(lines[i].lstrip()) <= indent)
+        definition = '\n'.join(lines[start + 1:end])
+        variables_end = next(i for i in range(end, len(lines)) if '}' in lines[i])
+        variables = {}
+        for match in re.finditer(r'(\w+):\s*(![A-Za-z]+\s+[\w.]+)', '\n'.join(lines[end:variables_end + 1])):
+            variables[match.group(1)] = self.evaluate(match.group(2))
+
+        functions = sorted(set(x.split(':')[-1] for x in variables.values() if x.startswith('arn:aws:lambda:')))
+        definition = re.sub(r'\$\{(\w+)\}', lambda x: variables[x.group(1)], definition)
+        return json.loads(definition), functions
+
+# ---------------------------------------------------------------------------------------------------
+# The interpreter of the state machine
+
+PATH_TOKEN = re.compile(r'\.([^.\[\]]+)|\[(\d+)\]')
+
+def get_path(data, path, context=None):
+    """Get the value at a JSONPath like $, $.a.b, $.a[0] or $$.Execution.Name (for the context object)
+
+    Raises:
+        StatesError -- States.Runtime if the path does not exist
+    """
+    if path.startswith('$$'):
+        data, path = context, path[1:]
+    if not path.startswith('$'):
+        raise StatesError('States.Runtime', 'Invalid path {}.'.format(path))
+    position = 1
+    while position < len(path):
+        match = PATH_TOKEN.match(path, position)
+        if match is None:
+            raise StatesError('States.Runtime', 'Unsupported path {}.'.format(path))
+        key, index = match.group(1), match.group(2)
+        try:
+            data = data[key] if key is not None else data[int(index)]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError('States.Runtime', 'The path {} does not exist in the input.'.format(path))
+        position = match.end()
+    return data
+
+def set_path(data, path, value):
+    """Apply a ResultPath: put the value at the path of a copy of the data
+
+    Arguments:
+        data -- the state input
+        path {string} -- the ResultPath, e.g. $ or $.PreviousStep, or None to discard the value
+        value -- the state result
+
+    Returns:
+        the state output
+    """
+    if path is None:
+        return data
+    if path == '$':
+        return value
+    keys = [match.group(1) for match in PATH_TOKEN.finditer(path, 1)]
+    data = copy.deepcopy(data)
+    target = data
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+    return data
+
+def resolve_parameters(template, data, context):
+    """Build the Parameters of a state, replacing the values of the keys that end with .$"""
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                resolved[key[:-2]] = copy.deepcopy(get_path(data, value, context))
+            else:
+                resolved[key] = resolve_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [resolve_parameters(x, data, context) for x in template]
+    return template
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+COMPARISONS = {
+    'StringEquals': lambda a, b: isinstance(a, str) and a == b,
+    'NumericEquals': lambda a, b: _is_number(a) and a == b,
+    'NumericLessThan': lambda a, b: _is_number(a) and a < b,
+    'NumericLessThanEquals': lambda a, b: _is_number(a) and a <= b,
+    'NumericGreaterThan': lambda a, b: _is_number(a) and a > b,
+    'NumericGreaterThanEquals': lambda a, b: _is_number(a) and a >= b,
+    'BooleanEquals': lambda a, b: isinstance(a, bool) and a == b
+}
+
+def matches(rule, data):
+    """Check if a rule of a Choice state matches its input"""
+    if 'And' in rule:
+        return all(matches(x, data) for x in rule['And'])
+    if 'Or' in rule:
+        return any(matches(x, data) for x in rule['Or'])
+    if 'Not' in rule:
+        return not matches(rule['Not'], data)
+
+    try:
+        value, present = get_path(data, rule['Variable']), True
+    except StatesError:
+        value, present = None, False
+    if 'IsPresent' in rule:
+        return present == rule['IsPresent']
+    if not present:
+        raise StatesError('States.Runtime', 'The Choice rule variable {} does not exist in the input.'.format(rule['Variable']))
+    for name, compare in COMPARISONS.items():
+        if name in rule:
+            return compare(value, rule[name])
+    raise StatesError('States.Runtime', 'Unsupported Choice rule {}.'.format(rule))
+
+class LambdaContext:
+    def __init__(self, function_name, timeout_seconds):
+        """The parts of the Lambda context object the handlers use"""
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.__deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.__deadline - time.time()) * 1000), 0)
+
+class LocalFunction:
+    def __init__(self, logical_id, handler, timeout):
+        """A Lambda function of deploy/lambda, called in this process
+
+        The module is imported again by the first invocation, so the first one includes the cold
+        start and the module reads the environment variables of this pipeline.
+
+        Arguments:
+            logical_id {string} -- the logical id of the function in the template
+            handler {string} -- module.function
+            timeout {int} -- the timeout of the function in seconds
+        """
+        self.logical_id = logical_id
+        self.module_name, self.function_name = handler.rsplit('.', 1)
+        self.timeout = timeout
+        self.module = None
+
+    def invoke(self, event):
+        if self.module is None:
+            module = sys.modules.get(self.module_name)
+            self.module = importlib.reload(module) if module is not None else importlib.import_module(self.module_name)
+        module = self.module
+        try:
+            result = getattr(module, self.function_name)(copy.deepcopy(event), LambdaContext(self.logical_id, self.timeout))
+        except Exception as e:
+            # Like the error of a Lambda task: the exception type and message
+            logger.exception('{} failed.'.format(self.logical_id))
+            raise StatesError(type(e).__name__, str(e))
+        # The result goes through JSON, like every state output
+        return json.loads(json.dumps(result, default=str))
+
+# The job status to wait for in the .sync integrations: (describe operation, name parameter, status key, done, failed)
+SYNC_INTEGRATIONS = {
+    ('sagemaker', 'createTrainingJob'): ('describe_training_job', 'TrainingJobName', 'TrainingJobStatus', ['Completed'], ['Failed', 'Stopped'])
+}
+
+class Execution:
+    def __init__(self, definition, functions, name, max_wait_seconds):
+        """An execution of a state machine
+
+        Arguments:
+            definition {dict} -- the state machine definition
+            functions {dict} -- the LocalFunction of each Lambda function ARN
+            name {string} -- the execution name
+            max_wait_seconds {float} -- the longest a Wait state actually waits
+        """
+        self.definition = definition
+        self.functions = functions
+        self.name = name
+        self.max_wait_seconds = max_wait_seconds
+        self.context = {'Execution': {'Name': name, 'Id': RESOURCES['TrainAndDeployStateMachine'].replace(':stateMachine:', ':execution:') + ':' + name}}
+        # The Task and Wait states in the order they ran
+        self.stages = []
+        # The errors handled by a Catch
+        self.caught_errors = []
+
+    def run(self, input_data):
+        """Run the execution
+
+        Returns:
+            dict -- with the keys status (SUCCEEDED or FAILED), output, error and cause
+        """
+        try:
+            output = self.run_states(self.definition, input_data)
+            return {'status': 'SUCCEEDED', 'output': output, 'error': None, 'cause': None}
+        except StatesError as e:
+            return {'status': 'FAILED', 'output': None, 'error': e.error, 'cause': e.cause}
+
+    def run_states(self, machine, data):
+        """Run the states of a state machine or a Parallel branch from StartAt to the end"""
+        name = machine['StartAt']
+        while name is not None:
+            state = machine['States'][name]
+            try:
+                data, name = self.run_state(name, state, data)
+            except StatesError as e:
+                catcher = next((x for x in state.get('Catch', []) if 'States.ALL' in x['ErrorEquals'] or e.error in x['ErrorEquals']), None)
+                if catcher is None:
+                    raise
+                logger.info('{} failed with {}. Caught by {}.'.format(name, e, catcher['Next']))
+                self.caught_errors.append({'state': name, 'error': e.error, 'cause': e.cause})
+                data = set_path(data, catcher.get('ResultPath', '$'), {'Error': e.error, 'Cause': e.cause})
+                name = catcher['Next']
+        return data
+
+    def run_state(self, name, state, data):
+        """Run a state
+
+        Returns:
+            tuple -- (the state output, the name of the next state or None at the end)
+        """
+        kind = state['Type']
+        effective = get_path(data, state.get('InputPath', '$'))
+        next_name = None if state.get('End') else state.get('Next')
+
+        if kind == 'Succeed':
+            return effective, None
+        if kind == 'Fail':
+            raise StatesError(state.get('Error', name), state.get('Cause', ''))
+        if kind == 'Choice':
+            choice = next((x for x in state['Choices'] if matches(x, effective)), None)
+            next_name = choice['Next'] if choice else state.get('Default')
+            if next_name is None:
+                raise StatesError('States.NoChoiceMatched', 'No Choice of {} matched.'.format(name))
+            return get_path(effective, state.get('OutputPath', '$')), next_name
+        if kind == 'Wait':
+            requested = state['Seconds'] if 'Seconds' in state else get_path(effective, state['SecondsPath'])
+            start = time.time()
+            time.sleep(min(requested, self.max_wait_seconds))
+            self.stages.append({'stage': name, 'kind': 'wait', 'seconds': time.time() - start, 'requested_seconds': requested})
+            return get_path(effective, state.get('OutputPath', '$')), next_name
+
+        if 'Parameters' in state:
+            effective = resolve_parameters(state['Parameters'], effective, self.context)
+        if kind == 'Pass':
+            result = state.get('Result', effective)
+        elif kind == 'Parallel':
+            # The branches run one after the other (the templates have a single branch)
+            result = [self.run_states(x, effective) for x in state['Branches']]
+        elif kind == 'Task':
+            resource = state['Resource']
+            # lambda, or the service of an integration, e.g. arn:aws:states:::sagemaker:createModel
+            stage = {'stage': name, 'kind': 'lambda' if resource.startswith('arn:aws:lambda:') else resource.split(':')[-2]}
+            start = time.time()
+            try:
+                result = self.run_task(resource, effective)
+            finally:
+                stage['seconds'] = time.time() - start
+                self.stages.append(stage)
+        else:
+            raise StatesError('States.Runtime', 'Unsupported state type {} of {}.'.format(kind, name))
+
+        output = set_path(data, state.get('ResultPath', '$'), result)
+        return get_path(output, state.get('OutputPath', '$')), next_name
+
+    def run_task(self, resource, payload):
+        """Run the resource of a Task state
+
+        Returns:
+            the result of the task
+        """
+        if resource.startswith('arn:aws:lambda:'):
+            return self.functions[resource].invoke(payload)
+
+        match = re.match(r'^arn:aws:states:::([\w-]+):(\w+)(\.sync)?$', resource)
+        if match is None:
+            raise StatesError('States.Runtime', 'Unsupported resource {}.'.format(resource))
+        service, action, sync = match.groups()
+        client = aws_clients.client(service)
+        try:
+            result = getattr(client, xform_name(action))(**payload)
+            if sync:
+                describe, name_key, status_key, done, failed = SYNC_INTEGRATIONS[(service, action)]
+                while True:
+                    result = getattr(client, describe)(**{name_key: payload[name_key]})
+                    if result[status_key] in done:
+                        break
+                    if result[status_key] in failed:
+                        raise StatesError('States.TaskFailed', result.get('FailureReason', result[status_key]))
+                    time.sleep(SYNC_POLL_SECONDS)
+        except ClientError as e:
+            raise StatesError('{}.{}'.format(client.meta.service_model.service_id.replace(' ', ''), e.response['Error']['Code']), e.response['Error']['Message'])
+        result.pop('ResponseMetadata', None)
+        return json.loads(json.dumps(result, default=str))
+
+# ---------------------------------------------------------------------------------------------------
+# The stand-ins for Step Functions and SageMaker
+
+class LocalServiceError(Exception):
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+def install_stand_in(client, operations):
+    """Answer the API calls of a client with local functions instead of requests
+
+    Arguments:
+        client -- a botocore client
+        operations {dict} -- a function for every supported operation name (e.g. DescribeEndpoint),
+            called with the parameters of the call. It returns the response or raises LocalServiceError.
+    """
+    service_id = client.meta.service_model.service_id.hyphenize()
+
+    def capture_parameters(params, context, **kwargs):
+        context['local_parameters'] = params
+
+    def respond(model, context, **kwargs):
+        operation = operations.get(model.name)
+        try:
+            if operation is None:
+                raise LocalServiceError('UnsupportedOperation', 'The local stand-in does not support {}.'.format(model.name))
+            return AWSResponse(None, 200, {}, None), operation(**context['local_parameters'])
+        except LocalServiceError as e:
+            return AWSResponse(None, e.status, {}, None), {'Error': {'Code': e.code, 'Message': e.message}}
+
+    client.meta.events.register('before-parameter-build.{}'.format(service_id), capture_parameters)
+    client.meta.events.register('before-call.{}'.format(service_id), respond)
+
+class LocalStepFunctions:
+    def __init__(self):
+        """Records the started executions, for the interpreter to run"""
+        self.executions = []
+
+    def start_execution(self, stateMachineArn, name, input='{}', **kwargs):
+        self.executions.append({'name': name, 'input': json.loads(input)})
+        return {
+            'executionArn': '{}:{}'.format(stateMachineArn.replace(':stateMachine:', ':execution:'), name),
+            'startDate': datetime.datetime.now(datetime.timezone.utc)
+        }
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _split_s3_uri(uri):
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+def _make_tarfile(path, directory):
+    """Write a tar.gz of the contents of a directory, like SageMaker does with the model and the output"""
+    with tarfile.open(path, 'w:gz') as f:
+        for name in sorted(os.listdir(directory)):
+            f.add(os.path.join(directory, name), arcname=name)
+
+class LocalSageMaker:
+    def __init__(self, work_dir):
+        """SageMaker training jobs and endpoints as local processes
+
+        The jobs and the endpoints change their status in background threads, like the real ones, and
+        the time of every step is kept in steps.
+
+        Arguments:
+            work_dir {string} -- the directory for the files of the training jobs and the endpoints
+        """
+        self.work_dir = work_dir
+        self.training_jobs = {}
+        self.models = {}
+        self.endpoint_configs = {}
+        self.endpoints = {}
+        # The steps inside the stand-in: dicts with the keys resource, name, step and seconds
+        self.steps = []
+        self.__threads = []
+        self.__lock = threading.Lock()
+
+    def operations(self):
+        return {
+            'CreateTrainingJob': self.create_training_job,
+            'DescribeTrainingJob': self.describe_training_job,
+            'CreateModel': self.create_model,
+            'CreateEndpointConfig': self.create_endpoint_config,
+            'CreateEndpoint': self.create_endpoint,
+            'UpdateEndpoint': self.update_endpoint,
+            'DescribeEndpoint': self.describe_endpoint
+        }
+
+    def runtime_operations(self):
+        return {'InvokeEndpoint': self.invoke_endpoint}
+
+    def __arn(self, kind, name):
+        return 'arn:aws:sagemaker:{}:{}:{}/{}'.format(REGION, ACCOUNT_ID, kind, name.lower())
+
+    def __start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.__threads.append(thread)
+
+    def __update(self, record, **changes):
+        with self.__lock:
+            record.update(changes, LastModifiedTime=datetime.datetime.now(datetime.timezone.utc))
+
+    def __step(self, resource, name, step, start):
+        self.steps.append({'resource': resource, 'name': name, 'step': step, 'seconds': time.time() - start})
+
+    @staticmethod
+    def __public(record):
+        return {x: copy.deepcopy(y) for x, y in record.items() if not x.startswith('_')}
+
+    # Training jobs
+
+    def create_training_job(self, TrainingJobName, AlgorithmSpecification, RoleArn, OutputDataConfig, ResourceConfig, StoppingCondition, InputDataConfig=None, HyperParameters=None, **kwargs):
+        if TrainingJobName in self.training_jobs:
+            raise LocalServiceError('ResourceInUse', 'Training job {} already exists.'.format(TrainingJobName))
+        now = datetime.datetime.now(datetime.timezone.utc)
+        job = {
+            'TrainingJobName': TrainingJobName,
+            'TrainingJobArn': self.__arn('training-job', TrainingJobName),
+            'TrainingJobStatus': 'InProgress',
+            'SecondaryStatus': 'Starting',
+            'AlgorithmSpecification': AlgorithmSpecification,
+            'RoleArn': RoleArn,
+            'HyperParameters': HyperParameters or {},
+            'InputDataConfig': InputDataConfig or [],
+            'OutputDataConfig': OutputDataConfig,
+            'ResourceConfig': ResourceConfig,
+            'StoppingCondition': StoppingCondition,
+            'CreationTime': now,
+            'LastModifiedTime': now
+        }
+        self.training_jobs[TrainingJobName] = job
+        self.__start(self.__train, job)
+        return {'TrainingJobArn': job['TrainingJobArn']}
+
+    def describe_training_job(self, TrainingJobName):
+        job = self.training_jobs.get(TrainingJobName)
+        if job is None:
+            raise LocalServiceError('ValidationException', 'Requested resource not found.')
+        with self.__lock:
+            return self.__public(job)
+
+    def __train(self, job):
+        name = job['TrainingJobName']
+        job_dir = os.path.join(self.work_dir, 'training-jobs', name)
+        data_dir = os.path.join(job_dir, 'data')
+        hosts_dir = os.path.join(job_dir, 'hosts')
+        os.makedirs(data_dir)
+        s3 = aws_clients.client('s3')
+        try:
+            self.__update(job, SecondaryStatus='Downloading', TrainingStartTime=datetime.datetime.now(datetime.timezone.utc))
+            start = time.time()
+            distribution = 'FullyReplicated'
+            for channel in job['InputDataConfig']:
+                if channel['ChannelName'] != 'train':
+                    continue
+                source = channel['DataSource']['S3DataSource']
+                distribution = source.get('S3DataDistributionType', distribution)
+                bucket, prefix = _split_s3_uri(source['S3Uri'])
+                for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+                    for item in page.get('Contents', []):
+                        path = os.path.join(data_dir, os.path.relpath(item['Key'], prefix or '.'))
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        s3.download_file(bucket, item['Key'], path)
+            self.__step('training job', name, 'download input', start)
+
+            self.__update(job, SecondaryStatus='Training')
+            start = time.time()
+            process = subprocess.Popen(
+                [sys.executable, 'simulate_hosts.py',
+                 '--hosts', str(job['ResourceConfig'].get('InstanceCount', 1)),
+                 '--distribution', distribution,
+                 '--data', data_dir,
+                 '--hyperparameters', json.dumps(job['HyperParameters']),
+                 '--directory', hosts_dir],
+                cwd=ALGORITHM_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+            )
+            try:
+                output, _ = process.communicate(timeout=job['StoppingCondition'].get('MaxRuntimeInSeconds'))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                output, _ = process.communicate()
+                self.__update(job, TrainingJobStatus='Stopped', SecondaryStatus='MaxRuntimeExceeded', FailureReason='The training job exceeded MaxRuntimeInSeconds.')
+                return
+            finally:
+                with open(os.path.join(job_dir, 'training.log'), 'w') as f:
+                    f.write(output or '')
+                self.__step('training job', name, 'train ({} hosts)'.format(job['ResourceConfig'].get('InstanceCount', 1)), start)
+
+            leader_dir = os.path.join(hosts_dir, 'algo-1')
+            if process.returncode != 0:
+                failure_path = os.path.join(leader_dir, 'output', 'failure')
+                reason = open(failure_path).read() if os.path.exists(failure_path) else output[-1000:]
+                self.__update(job, TrainingJobStatus='Failed', SecondaryStatus='Failed', FailureReason=reason)
+                return
+
+            # The last value of every metric, like FinalMetricDataList
+            now = datetime.datetime.now(datetime.timezone.utc)
+            metrics = []
+            for definition in job['AlgorithmSpecification'].get('MetricDefinitions', []):
+                values = re.findall(definition['Regex'], output)
+                if values:
+                    metrics.append({'MetricName': definition['Name'], 'Value': float(values[-1]), 'Timestamp': now})
+
+            self.__update(job, SecondaryStatus='Uploading')
+            start = time.time()
+            bucket, prefix = _split_s3_uri(job['OutputDataConfig']['S3OutputPath'].rstrip('/'))
+            key_prefix = '/'.join(x for x in [prefix, name, 'output'] if x)
+            for archive, directory in [('model.tar.gz', 'model'), ('output.tar.gz', 'output/data')]:
+                path = os.path.join(job_dir, archive)
+                _make_tarfile(path, os.path.join(leader_dir, directory))
+                s3.upload_file(path, bucket, '{}/{}'.format(key_prefix, archive))
+            self.__step('training job', name, 'upload artifacts', start)
+
+            self.__update(
+                job, TrainingJobStatus='Completed', SecondaryStatus='Completed', FinalMetricDataList=metrics,
+                ModelArtifacts={'S3ModelArtifacts': 's3://{}/{}/model.tar.gz'.format(bucket, key_prefix)},
+                TrainingEndTime=datetime.datetime.now(datetime.timezone.utc)
+            )
+        except Exception as e:
+            logger.exception('Training job {} failed.'.format(name))
+            self.__update(job, TrainingJobStatus='Failed', SecondaryStatus='Failed', FailureReason=str(e))
+
+    # Models and endpoints
+
+    def create_model(self, ModelName, PrimaryContainer, ExecutionRoleArn=None, **kwargs):
+        if ModelName in self.models:
+            raise LocalServiceError('ValidationException', 'Cannot create already existing model "{}".'.format(ModelName))
+        self.models[ModelName] = {'ModelName': ModelName, 'PrimaryContainer': PrimaryContainer}
+        return {'ModelArn': self.__arn('model', ModelName)}
+
+    def create_endpoint_config(self, EndpointConfigName, ProductionVariants, **kwargs):
+        if EndpointConfigName in self.endpoint_configs:
+            raise LocalServiceError('ValidationException', 'Cannot create already existing endpoint configuration "{}".'.format(EndpointConfigName))
+        for variant in ProductionVariants:
+            if variant['ModelName'] not in self.models:
+                raise LocalServiceError('ValidationException', 'Could not find model "{}".'.format(variant['ModelName']))
+        self.endpoint_configs[EndpointConfigName] = {'EndpointConfigName': EndpointConfigName, 'ProductionVariants': ProductionVariants}
+        return {'EndpointConfigArn': self.__arn('endpoint-config', EndpointConfigName)}
+
+    def __get_config(self, endpoint_config_name):
+        config = self.endpoint_configs.get(endpoint_config_name)
+        if config is None:
+            raise LocalServiceError('ValidationException', 'Could not find endpoint configuration "{}".'.format(endpoint_config_name))
+        if len(config['ProductionVariants']) != 1:
+            raise LocalServiceError('UnsupportedOperation', 'The local stand-in serves endpoint configurations with one production variant.')
+        return config
+
+    def create_endpoint(self, EndpointName, EndpointConfigName, **kwargs):
+        if EndpointName in self.endpoints:
+            raise LocalServiceError('ValidationException', 'Cannot create already existing endpoint "{}".'.format(self.__arn('endpoint', EndpointName)))
+        config = self.__get_config(EndpointConfigName)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        endpoint = {
+            'EndpointName': EndpointName,
+            'EndpointArn': self.__arn('endpoint', EndpointName),
+            'EndpointConfigName': EndpointConfigName,
+            'EndpointStatus': 'Creating',
+            'CreationTime': now,
+            'LastModifiedTime': now,
+            '_server': None
+        }
+        self.endpoints[EndpointName] = endpoint
+        self.__start(self.__deploy, endpoint, config)
+        return {'EndpointArn': endpoint['EndpointArn']}
+
+    def update_endpoint(self, EndpointName, EndpointConfigName, **kwargs):
+        endpoint = self.endpoints.get(EndpointName)
+        if endpoint is None:
+            raise LocalServiceError('ValidationException', 'Could not find endpoint "{}".'.format(self.__arn('endpoint', EndpointName)))
+        if endpoint['EndpointStatus'] != 'InService':
+            raise LocalServiceError('ValidationException', 'Cannot update in-progress endpoint "{}".'.format(endpoint['EndpointArn']))
+        config = self.__get_config(EndpointConfigName)
+        self.__update(endpoint, EndpointStatus='Updating')
+        self.__start(self.__deploy, endpoint, config)
+        return {'EndpointArn': endpoint['EndpointArn']}
+
+    def describe_endpoint(self, EndpointName):
+        endpoint = self.endpoints.get(EndpointName)
+        if endpoint is None:
+            raise LocalServiceError('ValidationException', 'Could not find endpoint "{}".'.format(self.__arn('endpoint', EndpointName)))
+        with self.__lock:
+            return self.__public(endpoint)
+
+    def __deploy(self, endpoint, config):
+        """Start a server for the endpoint configuration, then replace the endpoint's server with it"""
+        name = endpoint['EndpointName']
+        config_name = config['EndpointConfigName']
+        model = self.models[config['ProductionVariants'][0]['ModelName']]
+        model_dir = os.path.join(self.work_dir, 'endpoints', config_name, 'model')
+        os.makedirs(model_dir)
+        server = None
+        try:
+            start = time.time()
+            bucket, key = _split_s3_uri(model['PrimaryContainer']['ModelDataUrl'])
+            body = aws_clients.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+            with tarfile.open(fileobj=io.BytesIO(body.read()), mode='r:gz') as f:
+                f.extractall(model_dir)
+            self.__step('endpoint', name, 'download model', start)
+
+            start = time.time()
+            server = self.__start_server(model_dir, os.path.join(self.work_dir, 'endpoints', config_name, 'server.log'))
+            self.__step('endpoint', name, 'start server (until /ping answers)', start)
+        except Exception as e:
+            logger.exception('Deploying {} to {} failed.'.format(config_name, name))
+            if server is not None:
+                server['process'].kill()
+            if endpoint['EndpointStatus'] == 'Creating':
+                self.__update(endpoint, EndpointStatus='Failed', FailureReason=str(e))
+            else:
+                # A failed update leaves the endpoint on its previous configuration
+                self.__update(endpoint, EndpointStatus='InService', FailureReason=str(e))
+            return
+
+        previous = endpoint['_server']
+        self.__update(endpoint, EndpointStatus='InService', EndpointConfigName=config_name, _server=server)
+        if previous is not None:
+            previous['process'].terminate()
+            previous['process'].wait()
+
+    @staticmethod
+    def __start_server(model_dir, log_path):
+        """Start the inference server like the serve script, with gunicorn alone, and wait for /ping
+
+        Returns:
+            dict -- with the keys process and url
+        """
+        port = _free_port()
+        command = [sys.executable, '-m', 'gunicorn',
+                   '--timeout', str(os.environ.get('MODEL_SERVER_TIMEOUT', 60)),
+                   '-w', str(os.environ.get('MODEL_SERVER_WORKERS', multiprocessing.cpu_count())),
+                   '-b', '127.0.0.1:{}'.format(port)]
+        if importlib.util.find_spec('gevent') is not None:
+            command += ['-k', 'gevent']
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(
+                command + ['wsgi:app'], cwd=ALGORITHM_DIR, stdout=log, stderr=subprocess.STDOUT,
+                env=dict(os.environ, MODEL_SERVER_MODEL_DIR=model_dir)
+            )
+        url = 'http://127.0.0.1:{}'.format(port)
+        deadline = time.time() + ENDPOINT_START_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError('The inference server exited with {}. See {}.'.format(process.returncode, log_path))
+            try:
+                with urllib.request.urlopen(url + '/ping', timeout=1) as response:
+                    if response.status == 200:
+                        return {'process': process, 'url': url}
+            except OSError:
+                pass
+            time.sleep(0.05)
+        process.kill()
+        raise RuntimeError('The inference server did not answer /ping within {} seconds. See {}.'.format(ENDPOINT_START_TIMEOUT_SECONDS, log_path))
+
+    def invoke_endpoint(self, EndpointName, Body, ContentType='text/csv', Accept=None, **kwargs):
+        endpoint = self.endpoints.get(EndpointName)
+        if endpoint is None or endpoint['_server'] is None:
+            raise LocalServiceError('ValidationError', 'Endpoint {} not found.'.format(self.__arn('endpoint', EndpointName)))
+        body = Body.encode() if isinstance(Body, str) else (Body.read() if hasattr(Body, 'read') else Body)
+        headers = {'Content-Type': ContentType}
+        if Accept:
+            headers['Accept'] = Accept
+        request = urllib.request.Request(endpoint['_server']['url'] + '/invocations', data=body, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                data = response.read()
+                content_type = response.headers.get('Content-Type')
+        except urllib.error.HTTPError as e:
+            raise LocalServiceError('ModelError', 'Received client error ({}) from the model: {}'.format(e.code, e.read()[:200]), status=424)
+        return {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ContentType': content_type}
+
+    def close(self):
+        """Stop the inference servers"""
+        for thread in self.__threads:
+            thread.join(timeout=ENDPOINT_START_TIMEOUT_SECONDS)
+        for endpoint in self.endpoints.values():
+            if endpoint['_server'] is not None:
+                endpoint['_server']['process'].terminate()
+                endpoint['_server']['process'].wait()
+
+# ---------------------------------------------------------------------------------------------------
+# The pipeline
+
+class PipelineSimulator:
+    def __init__(self, pipeline, work_dir, data_path=DATA_DIR, instance_count=None, max_wait_seconds=1.0):
+        """The AWS resources of a pipeline stack, the stand-ins and the Lambda functions
+
+        Must be created and used inside moto's mock_aws.
+
+        Arguments:
+            pipeline {string} -- model-server or batch-job
+            work_dir {string} -- the directory for the files of the stand-ins
+
+        Keyword Arguments:
+            data_path {string} -- the directory with the training data (default: {DATA_DIR})
+            instance_count {int} -- overrides the InstanceCount of the training jobs (default: {None})
+            max_wait_seconds {float} -- the longest a Wait state actually waits (default: {1.0})
+        """
+        self.pipeline = pipeline
+        self.data_path = data_path
+        self.instance_count = instance_count
+        self.max_wait_seconds = max_wait_seconds
+        self.data_files = sorted(os.listdir(data_path))
+        RESOURCES['TrainingDataS3Key'] = self.data_files[0]
+
+        template = Template(pipeline)
+        self.definition, function_ids = template.get_state_machine()
+        self.functions = {}
+        self.initiate = None
+        for logical_id in function_ids + ['InitiateStepFunctionsLambda']:
+            function = template.get_function(logical_id)
+            # The Lambda modules read their environment variables when they are imported
+            os.environ.update(function['environment'])
+            local_function = LocalFunction(logical_id, function['handler'], function['timeout'])
+            self.functions[template.evaluate('!GetAtt {}.Arn'.format(logical_id))] = local_function
+        self.initiate = self.functions.pop(template.evaluate('!GetAtt InitiateStepFunctionsLambda.Arn'))
+
+        aws_clients.reset()
+        self.step_functions = LocalStepFunctions()
+        install_stand_in(aws_clients.client('stepfunctions'), {'StartExecution': self.step_functions.start_execution})
+        self.sagemaker = LocalSageMaker(work_dir)
+        install_stand_in(aws_clients.client('sagemaker'), self.sagemaker.operations())
+        install_stand_in(aws_clients.client('sagemaker-runtime'), self.sagemaker.runtime_operations())
+        self.image_count = 0
+        self.__create_resources()
+
+    def __create_resources(self):
+        s3 = aws_clients.client('s3')
+        for name in ['DataSourceBucket', 'OutputBucket', 'SourceCodeBucket']:
+            s3.create_bucket(Bucket=RESOURCES[name])
+        s3.put_bucket_versioning(Bucket=RESOURCES['DataSourceBucket'], VersioningConfiguration={'Status': 'Enabled'})
+        for name in ['MasterEcrRepository', 'StagingEcrRepository']:
+            aws_clients.client('ecr').create_repository(repositoryName=RESOURCES[name])
+        aws_clients.client('sns').create_topic(Name=RESOURCES['PipelineStatusSnsTopic'].split(':')[-1])
+        aws_clients.client('dynamodb').create_table(
+            TableName=RESOURCES['PipelineStateTable'],
+            KeySchema=[{'AttributeName': 'key', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'key', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+
+    def upload_data(self):
+        """Upload a new version of the training data
+
+        Returns:
+            string -- the version of the trigger object (the first file)
+        """
+        versions = []
+        for name in self.data_files:
+            with open(os.path.join(self.data_path, name), 'rb') as f:
+                versions.append(aws_clients.client('s3').put_object(Bucket=RESOURCES['DataSourceBucket'], Key=name, Body=f)['VersionId'])
+        return versions[0]
+
+    def push_image(self):
+        """Push a new image to the master ECR repository, with its source code bundle
+
+        Returns:
+            dict -- the image tag and digest
+        """
+        self.image_count += 1
+        tag = 'local-{}'.format(self.image_count)
+        with open(os.path.join(REPOSITORY_DIR, 'deploy', 'sagemaker-settings.json')) as f:
+            settings = json.load(f)
+        if self.instance_count:
+            settings['TrainingJob']['TrainingResourceConfig']['InstanceCount'] = self.instance_count
+        bundle = io.BytesIO()
+        with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_DEFLATED) as f:
+            f.writestr('deploy/sagemaker-settings.json', json.dumps(settings, indent=3))
+            f.write(os.path.join(REPOSITORY_DIR, 'container', 'local_test', 'test_dir', 'input', 'config', 'hyperparameters.json'),
+                    'container/local_test/test_dir/input/config/hyperparameters.json')
+        aws_clients.client('s3').put_object(Bucket=RESOURCES['SourceCodeBucket'], Key='{}.zip'.format(tag), Body=bundle.getvalue())
+
+        # A layer that is different for every image, so every image has its own digest
+        manifest = {
+            'schemaVersion': 2,
+            'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+            'config': {'mediaType': 'application/vnd.docker.container.image.v1+json', 'size': 0, 'digest': 'sha256:' + '0' * 64},
+            'layers': [{'mediaType': 'application/vnd.docker.image.rootfs.diff.tar.gzip', 'size': 0, 'digest': 'sha256:' + uuid.uuid4().hex * 2}]
+        }
+        image = aws_clients.client('ecr').put_image(repositoryName=RESOURCES['MasterEcrRepository'], imageManifest=json.dumps(manifest), imageTag=tag)['image']
+        return {'tag': tag, 'digest': image['imageId']['imageDigest']}
+
+    def make_event(self, trigger):
+        """Make the event of new training data or of a new image, like the CloudWatch events of base.yaml"""
+        now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        if trigger == 'image':
+            image = self.push_image()
+            return {'time': now, 'detail': {
+                'eventSource': 'ecr.amazonaws.com',
+                'requestParameters': {'repositoryName': RESOURCES['MasterEcrRepository'], 'imageTag': image['tag']},
+                'responseElements': {'image': {'imageId': {'imageDigest': image['digest']}}}
+            }}
+        version = self.upload_data()
+        return {'time': now, 'detail': {
+            'eventSource': 's3.amazonaws.com',
+            'requestParameters': {'bucketName': RESOURCES['DataSourceBucket'], 'key': self.data_files[0]},
+            'responseElements': {'x-amz-version-id': version}
+        }}
+
+    def run(self, trigger='data', event=None):
+        """Run the pipeline from a trigger to the end of the execution, and send a prediction to the endpoint
+
+        Keyword Arguments:
+            trigger {string} -- data or image (default: {'data'})
+            event {dict} -- an event of make_event to send again, instead of a new trigger (default: {None})
+
+        Returns:
+            dict -- the status of the run, its stages and the steps inside the stand-ins
+        """
+        steps_before = len(self.sagemaker.steps)
+        event = event or self.make_event(trigger)
+        start = time.time()
+        response = self.initiate.invoke(event)
+        stages = [{'stage': 'initiate_step_functions', 'kind': 'lambda', 'seconds': time.time() - start}]
+        if not self.step_functions.executions:
+            return {'status': 'NOT_STARTED', 'error': None, 'cause': response.get('body'), 'caught_errors': [], 'stages': stages, 'steps': [], 'metrics': {}}
+
+        started = self.step_functions.executions.pop()
+        execution = Execution(self.definition, self.functions, started['name'], self.max_wait_seconds)
+        result = execution.run(started['input'])
+        stages += execution.stages
+
+        endpoint_name = os.environ.get('ENDPOINT_NAME')
+        if result['status'] == 'SUCCEEDED' and self.pipeline == 'model-server' and endpoint_name in self.sagemaker.endpoints:
+            with open(PAYLOAD_FILE, 'rb') as f:
+                payload = f.read()
+            invoke_start = time.time()
+            try:
+                aws_clients.client('sagemaker-runtime').invoke_endpoint(EndpointName=endpoint_name, Body=payload, ContentType='text/csv')['Body'].read()
+            except ClientError as e:
+                result.update(status='FAILED', error='InvokeEndpoint', cause=str(e))
+            stages.append({'stage': 'Invoke Endpoint', 'kind': 'invoke', 'seconds': time.time() - invoke_start})
+
+        job = self.sagemaker.training_jobs.get(started['name'], {})
+        return {
+            'status': result['status'],
+            'error': result['error'],
+            'cause': result['cause'],
+            'caught_errors': execution.caught_errors,
+            'execution_name': started['name'],
+            'stages': stages,
+            'steps': self.sagemaker.steps[steps_before:],
+            'metrics': {x['MetricName']: x['Value'] for x in job.get('FinalMetricDataList', [])}
+        }
+
+    def close(self):
+        self.sagemaker.close()
+
+def simulate(pipeline, runs=1, trigger='data', instance_count=None, max_wait_seconds=1.0, data_path=DATA_DIR, work_dir=None):
+    """Run the pipeline a number of times against fresh stand-ins
+
+    Arguments:
+        pipeline {string} -- model-server or batch-job
+
+    Keyword Arguments:
+        runs {int} -- the number of runs, every one with a new trigger (default: {1})
+        trigger {string} -- data or image (default: {'data'})
+        instance_count {int} -- overrides the InstanceCount of the training jobs (default: {None})
+        max_wait_seconds {float} -- the longest a Wait state actually waits (default: {1.0})
+        data_path {string} -- the directory with the training data (default: {DATA_DIR})
+        work_dir {string} -- the directory for the files of the stand-ins (default: {None}, a temporary
+            directory that is removed at the end)
+
+    Returns:
+        list -- the result of every run (see PipelineSimulator.run)
+    """
+    directory = work_dir or tempfile.mkdtemp(prefix='pipeline-')
+    results = []
+    try:
+        with mock_aws():
+            simulator = PipelineSimulator(pipeline, directory, data_path=data_path, instance_count=instance_count, max_wait_seconds=max_wait_seconds)
+            try:
+                if trigger == 'data':
+                    # The image the data triggers train with
+                    simulator.push_image()
+                else:
+                    simulator.upload_data()
+                for _ in range(runs):
+                    results.append(simulator.run(trigger))
+            finally:
+                simulator.close()
+                aws_clients.reset()
+    finally:
+        if work_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def print_run(number, result):
+    """Print the stages of a run, their share of the total and the steps inside the stand-ins"""
+    total = sum(x['seconds'] for x in result['stages'])
+    print('Run {}: {}'.format(number, result['status']))
+    if result['error'] or (result['status'] != 'SUCCEEDED' and result['cause']):
+        print('  {}: {}'.format(result['error'], result['cause']))
+    for error in result['caught_errors']:
+        print('  {} failed with {}: {}'.format(error['state'], error['error'], error['cause'].strip().split('\n')[0]))
+
+    # One line per state, in the order they first ran
+    stages = {}
+    for stage in result['stages']:
+        line = stages.setdefault(stage['stage'], {'kind': stage['kind'], 'calls': 0, 'seconds': 0.0, 'requested_seconds': None})
+        line['calls'] += 1
+        line['seconds'] += stage['seconds']
+        if 'requested_seconds' in stage:
+            line['requested_seconds'] = (line['requested_seconds'] or 0) + stage['requested_seconds']
+
+    print('{:<36}{:>10}{:>7}{:>10}{:>8}{:>14}'.format('stage', 'kind', 'calls', 'seconds', 'share', 'requested s'))
+    for name, line in stages.items():
+        requested = '' if line['requested_seconds'] is None else '{:.0f}'.format(line['requested_seconds'])
+        print('{:<36}{:>10}{:>7}{:>10.3f}{:>7.1f}%{:>14}'.format(name, line['kind'], line['calls'], line['seconds'], 100 * line['seconds'] / total, requested))
+    waited = sum(x['seconds'] for x in result['stages'] if x['kind'] == 'wait')
+    requested = sum(x['requested_seconds'] for x in result['stages'] if x['kind'] == 'wait')
+    print('{:<53}{:>10.3f}'.format('total', total))
+    if requested:
+        print('{:<53}{:>10.3f}'.format('total with the requested waits', total - waited + requested))
+
+    if result['steps']:
+        print('{:<16}{:<40}{:>10}'.format('stand-in', 'step', 'seconds'))
+        for step in result['steps']:
+            print('{:<16}{:<40}{:>10.3f}'.format(step['resource'], step['step'], step['seconds']))
+    if result['metrics']:
+        print('metrics: ' + ', '.join('{} {:g}'.format(x, y) for x, y in result['metrics'].items()))
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the training and deployment pipeline locally and time its stages.')
+    parser.add_argument('--pipeline', default='model-server', choices=PIPELINES, help='the stack type (deploy/cloudformation/<pipeline>.yaml)')
+    parser.add_argument('--runs', type=int, default=1, help='the number of runs, every one with a new trigger')
+    parser.add_argument('--trigger', default='data', choices=['data', 'image'], help='start with new training data or a new image')
+    parser.add_argument('--instance-count', type=int, default=None, help='overrides the InstanceCount of the training job')
+    parser.add_argument('--max-wait', type=float, default=1.0, help='the longest a Wait state actually waits, in seconds')
+    parser.add_argument('--data', default=DATA_DIR, help='the directory with the training data')
+    parser.add_argument('--work-dir', default=None, help='keep the files of the training jobs and endpoints (e.g. the logs) in this directory')
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show the logs of the Lambda functions')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # The Lambda functions set the level of the root logger, so their logs are filtered by the handler
+    logging.getLogger().handlers[0].setLevel(logging.INFO if args.verbose else logging.ERROR)
+    results = simulate(
+        args.pipeline, runs=args.runs, trigger=args.trigger, instance_count=args.instance_count,
+        max_wait_seconds=args.max_wait, data_path=args.data, work_dir=args.work_dir
+    )
+
+    print('Pipeline {}, trigger {}'.format(args.pipeline, args.trigger))
+    print()
+    for number, result in enumerate(results, 1):
+        print_run(number, result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'pipeline': args.pipeline, 'trigger': args.trigger, 'runs': results}, f, indent=2)
+    sys.exit(0 if all(x['status'] == 'SUCCEEDED' for x in results) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Tests for aws_clients.py: the clients are created on first use, once per execution environment,
+# with the settings of their service.
+#
+# Usage:
+#   python -m unittest test_aws_clients
+
+import os
+import sys
+import unittest
+import threading
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import aws_clients
+
+class TestClients(unittest.TestCase):
+    def setUp(self):
+        aws_clients.reset()
+        self.addCleanup(aws_clients.reset)
+
+    def test_importing_a_function_creates_no_clients(self):
+        import check_endpoint_status
+        import create_or_update_endpoint
+        import canary
+        self.assertEqual(aws_clients._clients, {})
+
+    def test_client_is_reused(self):
+        client = aws_clients.client('sagemaker')
+        self.assertIs(aws_clients.client('sagemaker'), client)
+        aws_clients.reset()
+        self.assertIsNot(aws_clients.client('sagemaker'), client)
+
+    def test_concurrent_first_use_creates_one_client(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(aws_clients.client('s3'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(set(id(x) for x in clients)), 1)
+
+    def test_client_settings(self):
+        s3 = aws_clients.client('s3').meta.config
+        self.assertEqual(s3.max_pool_connections, aws_clients.S3_MAX_POOL_CONNECTIONS)
+        self.assertEqual(s3.retries, {'mode': 'standard', 'total_max_attempts': 5})
+
+        self.assertEqual(aws_clients.client('sagemaker').meta.config.retries['mode'], 'adaptive')
+        self.assertEqual(aws_clients.client('dynamodb').meta.config.read_timeout, 5)
+        # Services without their own settings get the defaults
+        self.assertEqual(aws_clients.client('ecr').meta.config.retries, aws_clients.DEFAULT_CLIENT_CONFIG['retries'])
+
+if __name__ == '__main__':
+    unittest.main()
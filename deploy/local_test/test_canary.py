@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Tests for canary.py, with SageMaker and CloudWatch replaced by botocore stubs and the metrics by
+# the in-memory metrics source.
+#
+# Usage:
+#   python -m unittest test_canary
+
+import os
+import sys
+import random
+import datetime
+import unittest
+
+import boto3
+from botocore.stub import Stubber, ANY
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import canary
+import aws_clients
+
+ENDPOINT_NAME = 'dev-product-service'
+SETTINGS = canary.get_canary_settings({'EndpointConfig': {'Canary': {'Enabled': True, 'MinInvocations': 50}}})
+ENDPOINT_ARN = f'arn:aws:sagemaker:us-east-1:123456789012:endpoint/{ENDPOINT_NAME}'
+START = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+class TestStartCanary(unittest.TestCase):
+    def setUp(self):
+        self.stubber = Stubber(aws_clients.client('sagemaker'))
+        self.stubber.activate()
+        self.deployment = canary.CanaryDeployment(ENDPOINT_NAME, tags=[])
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def add_endpoint(self, variants):
+        self.stubber.add_response('describe_endpoint', {
+            'EndpointName': ENDPOINT_NAME, 'EndpointArn': ENDPOINT_ARN, 'EndpointConfigName': 'old-execution',
+            'EndpointStatus': 'InService', 'CreationTime': START, 'LastModifiedTime': START
+        }, {'EndpointName': ENDPOINT_NAME})
+        self.stubber.add_response('describe_endpoint_config', {
+            'EndpointConfigName': 'old-execution', 'EndpointConfigArn': ENDPOINT_ARN, 'CreationTime': START,
+            'ProductionVariants': [
+                {'VariantName': x, 'ModelName': 'old-execution', 'InitialInstanceCount': 2, 'InstanceType': 'ml.m5.large'} for x in variants
+            ]
+        }, {'EndpointConfigName': 'old-execution'})
+
+    def test_start(self):
+        self.add_endpoint(['AllTraffic'])
+        self.stubber.add_response('create_endpoint_config', {'EndpointConfigArn': ENDPOINT_ARN}, {
+            'EndpointConfigName': 'new-execution-canary',
+            'ProductionVariants': [
+                {'VariantName': 'Baseline', 'ModelName': 'old-execution', 'InstanceType': 'ml.m5.large', 'InitialInstanceCount': 2, 'InitialVariantWeight': 0.9},
+                {'VariantName': 'Canary', 'ModelName': 'new-execution', 'InstanceType': 'ml.t2.medium', 'InitialInstanceCount': 1, 'InitialVariantWeight': 0.1}
+            ],
+            'Tags': []
+        })
+        self.stubber.add_response('update_endpoint', {'EndpointArn': ENDPOINT_ARN}, {'EndpointName': ENDPOINT_NAME, 'EndpointConfigName': 'new-execution-canary'})
+
+        state = self.deployment.start('new-execution', 'ml.t2.medium', SETTINGS)
+
+        self.assertEqual(state, {'Mode': 'Canary', 'PreviousEndpointConfigName': 'old-execution', 'CanaryEndpointConfigName': 'new-execution-canary'})
+        self.stubber.assert_no_pending_responses()
+
+    def test_endpoint_without_all_traffic_variant(self):
+        # E.g. an endpoint left with both variants of an earlier canary
+        self.add_endpoint(['Baseline', 'Canary'])
+
+        with self.assertRaisesRegex(ValueError, 'Baseline, Canary, not AllTraffic'):
+            self.deployment.start('new-execution', 'ml.t2.medium', SETTINGS)
+        self.stubber.assert_no_pending_responses()
+
+    def test_first_deployment(self):
+        self.stubber.add_client_error('describe_endpoint', service_error_code='ValidationException')
+
+        self.assertEqual(self.deployment.start('new-execution', 'ml.t2.medium', SETTINGS), {'Mode': 'Full'})
+        self.stubber.assert_no_pending_responses()
+
+    def test_rollback(self):
+        self.stubber.add_response('update_endpoint', {'EndpointArn': ENDPOINT_ARN}, {'EndpointName': ENDPOINT_NAME, 'EndpointConfigName': 'old-execution'})
+
+        state = self.deployment.rollback({'Mode': 'Canary', 'PreviousEndpointConfigName': 'old-execution'})
+
+        self.assertEqual(state['Decision'], 'Rollback')
+        self.stubber.assert_no_pending_responses()
+
+class TestEvaluateCanary(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.original_metrics_source = canary.metrics_source
+        canary.metrics_source = canary.InMemoryMetricsSource()
+        self.deployment = canary.CanaryDeployment(ENDPOINT_NAME, tags=[])
+        # The first evaluation starts the observation
+        self.state = self.deployment.evaluate({'Mode': 'Canary'}, SETTINGS, now=START)
+
+    def tearDown(self):
+        canary.metrics_source = self.original_metrics_source
+
+    def send_traffic(self, invocations, baseline_ms, canary_ms, canary_error_rate=0):
+        # Split the traffic by the variant weights, like the endpoint does
+        for i in range(invocations):
+            timestamp = START + datetime.timedelta(seconds=i * 0.1)
+            if random.random() < SETTINGS['TrafficWeight']:
+                canary.metrics_source.record_invocation(ENDPOINT_NAME, 'Canary', random.gauss(canary_ms, 1), random.random() < canary_error_rate, timestamp)
+            else:
+                canary.metrics_source.record_invocation(ENDPOINT_NAME, 'Baseline', random.gauss(baseline_ms, 1), False, timestamp)
+
+    def evaluate(self, seconds):
+        return self.deployment.evaluate(self.state, SETTINGS, now=START + datetime.timedelta(seconds=seconds))
+
+    def test_slow_canary_is_rolled_back(self):
+        self.send_traffic(2000, baseline_ms=10, canary_ms=30)
+
+        state = self.evaluate(600)
+
+        self.assertEqual(state['Decision'], 'Rollback')
+        self.assertIn('p99 model latency', state['Reasons'][0])
+
+    def test_failing_canary_is_rolled_back(self):
+        self.send_traffic(2000, baseline_ms=10, canary_ms=10, canary_error_rate=0.05)
+
+        self.assertEqual(self.evaluate(600)['Decision'], 'Rollback')
+
+    def test_healthy_canary_is_promoted(self):
+        self.send_traffic(2000, baseline_ms=10, canary_ms=11)
+
+        state = self.evaluate(600)
+
+        self.assertEqual(state['Decision'], 'Promote')
+        self.assertGreater(state['Metrics']['Baseline']['invocations'], state['Metrics']['Canary']['invocations'])
+
+    def test_waits_for_enough_traffic(self):
+        self.send_traffic(100, baseline_ms=10, canary_ms=11)
+
+        self.assertEqual(self.evaluate(600)['Decision'], 'Wait')
+        # Without enough traffic, the InsufficientDataDecision is made after MaxObservationSeconds
+        self.assertEqual(self.evaluate(SETTINGS['MaxObservationSeconds'])['Decision'], 'Rollback')
+
+class TestCloudWatchMetricsSource(unittest.TestCase):
+    def test_variant_metrics(self):
+        client = boto3.client('cloudwatch')
+        metrics_source = canary.CloudWatchMetricsSource(client)
+        with Stubber(client) as stubber:
+            stubber.add_response('get_metric_data', {'MetricDataResults': [
+                {'Id': 'invocations0', 'Values': [900.0, 100.0]},
+                {'Id': 'errors0', 'Values': [2.0]},
+                {'Id': 'latency0', 'Values': [12000.0, 15000.0]},
+                {'Id': 'invocations1', 'Values': [110.0]},
+                {'Id': 'errors1', 'Values': []},
+                {'Id': 'latency1', 'Values': []}
+            ]}, {'MetricDataQueries': ANY, 'StartTime': START, 'EndTime': START + datetime.timedelta(minutes=10)})
+
+            metrics = metrics_source.get_variant_metrics(ENDPOINT_NAME, ['Baseline', 'Canary'], START, START + datetime.timedelta(minutes=10))
+
+        self.assertEqual(metrics['Baseline'], {'invocations': 1000, 'errors': 2, 'latency_p99_ms': 15.0})
+        self.assertEqual(metrics['Canary'], {'invocations': 110, 'errors': 0, 'latency_p99_ms': None})
+
+if __name__ == '__main__':
+    unittest.main()
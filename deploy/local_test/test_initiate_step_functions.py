@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# Tests for initiate_step_functions.py, with the AWS clients replaced by botocore stubs (a stub fails
+# on any request that was not queued, so the tests also check how many requests are made) or by
+# moto's in-process stand-in.
+#
+# Usage:
+#   python -m unittest test_initiate_step_functions
+
+import io
+import os
+import sys
+import json
+import zipfile
+import datetime
+import unittest
+import threading
+
+from moto import mock_aws
+from botocore.stub import Stubber
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import initiate_step_functions
+import aws_clients
+from state_store import InMemoryStateStore
+
+REPOSITORY_NAME = 'python-sagemaker-template'
+REPOSITORY_URI = f'123456789012.dkr.ecr.us-east-1.amazonaws.com/{REPOSITORY_NAME}'
+
+def image(tag, day):
+    return {
+        'repositoryName': REPOSITORY_NAME,
+        'imageDigest': f'sha256:{tag}',
+        'imageTags': [tag],
+        'imagePushedAt': datetime.datetime(2020, 1, day)
+    }
+
+class TestEcrClient(unittest.TestCase):
+    def setUp(self):
+        initiate_step_functions.repository_uri_cache.clear()
+        self.stubber = Stubber(aws_clients.client('ecr'))
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def add_describe_repositories(self):
+        self.stubber.add_response(
+            'describe_repositories',
+            {'repositories': [{'repositoryName': REPOSITORY_NAME, 'repositoryUri': REPOSITORY_URI}]},
+            {'repositoryNames': [REPOSITORY_NAME]}
+        )
+
+    def test_latest_image_across_pages(self):
+        params = {'repositoryName': REPOSITORY_NAME, 'filter': {'tagStatus': 'TAGGED'}}
+        self.stubber.add_response('describe_images', {'imageDetails': [image('a', 2), image('b', 5)], 'nextToken': 'page-2'}, params)
+        self.stubber.add_response('describe_images', {'imageDetails': [image('c', 9), image('d', 1)]}, dict(params, nextToken='page-2'))
+        self.add_describe_repositories()
+
+        ecr_info = initiate_step_functions.EcrClient.get_ecr_image_info(REPOSITORY_NAME)
+
+        self.assertEqual(ecr_info['image_tags'], ['c'])
+        self.assertEqual(ecr_info['image_uri'], f'{REPOSITORY_URI}:c')
+        self.assertEqual(ecr_info['image_digest'], 'sha256:c')
+        self.stubber.assert_no_pending_responses()
+
+    def test_repository_not_found(self):
+        self.stubber.add_client_error('describe_images', service_error_code='RepositoryNotFoundException')
+
+        self.assertIsNone(initiate_step_functions.EcrClient.get_ecr_image_info(REPOSITORY_NAME))
+        self.stubber.assert_no_pending_responses()
+
+    def test_repository_uri_is_cached(self):
+        self.add_describe_repositories()
+
+        # Only one response is queued, so a second request would fail
+        for _ in range(3):
+            self.assertEqual(initiate_step_functions.EcrClient.get_repository_uri(REPOSITORY_NAME), REPOSITORY_URI)
+        self.stubber.assert_no_pending_responses()
+
+    def test_repository_uri_cache_expires(self):
+        self.add_describe_repositories()
+        self.add_describe_repositories()
+
+        initiate_step_functions.EcrClient.get_repository_uri(REPOSITORY_NAME)
+        initiate_step_functions.repository_uri_cache[REPOSITORY_NAME]['expires'] = 0
+        self.assertEqual(initiate_step_functions.EcrClient.get_repository_uri(REPOSITORY_NAME), REPOSITORY_URI)
+        self.stubber.assert_no_pending_responses()
+
+    def test_unknown_repository_is_not_cached(self):
+        self.stubber.add_client_error('describe_repositories', service_error_code='RepositoryNotFoundException')
+        self.add_describe_repositories()
+
+        self.assertIsNone(initiate_step_functions.EcrClient.get_repository_uri(REPOSITORY_NAME))
+        self.assertEqual(initiate_step_functions.EcrClient.get_repository_uri(REPOSITORY_NAME), REPOSITORY_URI)
+        self.stubber.assert_no_pending_responses()
+
+class TestSourceCodeRepository(unittest.TestCase):
+    BUCKET_NAME = 'test-source-code-bucket'
+
+    def setUp(self):
+        initiate_step_functions.source_code_cache.clear()
+        self.mock = mock_aws()
+        self.mock.start()
+        # Create the shared client again, so it is created while moto is running
+        aws_clients.reset()
+        self.s3 = aws_clients.client('s3')
+        self.s3.create_bucket(Bucket=self.BUCKET_NAME)
+
+        self.requests = 0
+        def count(**kwargs):
+            self.requests += 1
+        self.s3.meta.events.register('before-call.s3.GetObject', count)
+
+    def tearDown(self):
+        aws_clients.reset()
+        self.mock.stop()
+
+    def put_bundle(self, name, padding_mb):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as f:
+            # Incompressible data standing in for the rest of the repository
+            f.writestr('notebook/data.bin', os.urandom(int(padding_mb * 1024 * 1024)))
+            f.writestr(initiate_step_functions.SourceCodeRepository.SETTINGS_FILE, json.dumps({'TrainingJob': {'StoppingCondition': {}}}))
+            f.writestr('container/model.bin', os.urandom(int(padding_mb * 1024 * 1024)))
+            f.writestr(initiate_step_functions.SourceCodeRepository.HYPERPARAMETERS_FILE, json.dumps({'max_leaf_nodes': '4'}))
+        self.s3.put_object(Bucket=self.BUCKET_NAME, Key=name, Body=buffer.getvalue())
+
+    def test_reads_only_the_settings(self):
+        self.put_bundle('abc123.zip', padding_mb=8)
+
+        settings = initiate_step_functions.SourceCodeRepository(self.BUCKET_NAME, 'abc123.zip').get_sagemaker_settings()
+
+        self.assertEqual(settings, {'TrainingJob': {'StoppingCondition': {}, 'HyperParameters': {'max_leaf_nodes': '4'}}})
+        # The central directory, plus one request for the settings file in the middle of the bundle
+        self.assertEqual(self.requests, 2)
+
+    def test_small_bundle(self):
+        self.put_bundle('small.zip', padding_mb=0.001)
+
+        settings = initiate_step_functions.SourceCodeRepository(self.BUCKET_NAME, 'small.zip').get_sagemaker_settings()
+
+        self.assertEqual(settings['TrainingJob']['HyperParameters'], {'max_leaf_nodes': '4'})
+        self.assertEqual(self.requests, 1)
+
+    def test_settings_are_cached_per_bundle(self):
+        self.put_bundle('abc123.zip', padding_mb=0.001)
+
+        first = initiate_step_functions.SourceCodeRepository(self.BUCKET_NAME, 'abc123.zip').get_sagemaker_settings()
+        first['TrainingJob']['HyperParameters']['max_leaf_nodes'] = '8'
+        second = initiate_step_functions.SourceCodeRepository(self.BUCKET_NAME, 'abc123.zip').get_sagemaker_settings()
+
+        self.assertEqual(second['TrainingJob']['HyperParameters'], {'max_leaf_nodes': '4'})
+        self.assertEqual(self.requests, 1)
+
+class TestTriggerCoalescer(unittest.TestCase):
+    def trigger(self, version, second):
+        return initiate_step_functions.TriggerCoalescer.create_trigger(
+            s3_info={'version': version},
+            ecr_info={'image_tags': ['abc123']},
+            s3_time=f'2020-01-01T00:00:{second:02d}Z',
+            ecr_time='2020-01-01T00:00:00Z'
+        )
+
+    def test_concurrent_triggers_start_one_execution(self):
+        coalescer = initiate_step_functions.TriggerCoalescer(InMemoryStateStore(), window_seconds=0.5)
+        results = [None] * 20
+        def invoke(i):
+            results[i] = coalescer.coalesce('trigger#repository', self.trigger(f'v{i}', i))
+        threads = [threading.Thread(target=invoke, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        launched = [x for x in results if x is not None]
+        self.assertEqual(len(launched), 1)
+        self.assertEqual(launched[0]['count'], 20)
+        self.assertEqual(launched[0]['s3'], {'version': 'v19'})
+
+    def test_trigger_after_launch_opens_a_new_window(self):
+        coalescer = initiate_step_functions.TriggerCoalescer(InMemoryStateStore(), window_seconds=0.01)
+
+        first = coalescer.coalesce('trigger#repository', self.trigger('v1', 1))
+        second = coalescer.coalesce('trigger#repository', self.trigger('v2', 2))
+
+        self.assertEqual((first['s3'], first['count']), ({'version': 'v1'}, 1))
+        self.assertEqual((second['s3'], second['count']), ({'version': 'v2'}, 1))
+
+    def test_abandoned_window_is_taken_over(self):
+        state_store = InMemoryStateStore()
+        state_store.put_item('trigger#repository', {
+            'status': 'open', 'owner': 'crashed', 'deadline': 0, 'trigger': self.trigger('v1', 1)
+        })
+        coalescer = initiate_step_functions.TriggerCoalescer(state_store, window_seconds=0.01, owner_timeout_seconds=60)
+
+        trigger = coalescer.coalesce('trigger#repository', self.trigger('v0', 0))
+
+        self.assertEqual((trigger['s3'], trigger['count']), ({'version': 'v1'}, 2))
+
+if __name__ == '__main__':
+    unittest.main()
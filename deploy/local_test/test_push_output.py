@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+# Tests for push_output.py, with S3 replaced by moto's in-process stand-in. Listing large buckets is
+# slow in moto, so the 100k object deletion test takes a minute or two.
+#
+# Usage:
+#   python -m unittest test_push_output
+
+import io
+import json
+import os
+import sys
+import tarfile
+import unittest
+
+import boto3
+from moto import mock_aws
+from moto.core import DEFAULT_ACCOUNT_ID
+from moto.s3.models import s3_backends
+
+BUCKET_NAME = 'test-output-bucket'
+os.environ['OUTPUT_BUCKET_NAME'] = BUCKET_NAME
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import push_output
+import aws_clients
+
+class S3TestCase(unittest.TestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        self.s3 = boto3.client('s3')
+        self.s3.create_bucket(Bucket=BUCKET_NAME)
+        # push_output's client is created from the default session when it is first used, i.e. after
+        # the handlers of a test were registered
+        aws_clients.reset()
+        self.session = boto3.DEFAULT_SESSION or boto3.setup_default_session() or boto3.DEFAULT_SESSION
+        self.handlers = []
+
+    def tearDown(self):
+        for event_name, handler in self.handlers:
+            self.session.events.unregister(event_name, handler)
+        aws_clients.reset()
+        self.mock.stop()
+
+    def register(self, event_name, handler):
+        self.session.events.register(event_name, handler)
+        self.handlers.append((event_name, handler))
+        # A client only gets the handlers registered before it was created
+        aws_clients.reset()
+
+    def count_objects(self, prefix):
+        pages = self.s3.get_paginator('list_objects_v2').paginate(Bucket=BUCKET_NAME, Prefix=prefix)
+        return sum(len(x.get('Contents', [])) for x in pages)
+
+class TestDeleteObjectsWithPrefix(S3TestCase):
+    def put_objects(self, prefix, count):
+        # Write straight to moto's backend, 100k put_object requests would take minutes
+        backend = s3_backends[DEFAULT_ACCOUNT_ID]['global']
+        for i in range(count):
+            backend.put_object(BUCKET_NAME, f'{prefix}/{i:06d}', b'')
+
+    def test_delete_100k_objects(self):
+        self.put_objects('result/old', 100000)
+        self.put_objects('result/keep', 10)
+
+        calls = []
+        self.register('provide-client-params.s3.DeleteObjects', lambda params, **kwargs: calls.append(len(params['Delete']['Objects'])))
+
+        result = push_output.S3Client().delete_objects_with_prefix('result/old')
+
+        self.assertEqual(result, {'deleted': 100000, 'errors': []})
+        self.assertEqual(calls, [1000] * 100)
+        self.assertEqual(self.count_objects('result/old'), 0)
+        self.assertEqual(self.count_objects('result/keep'), 10)
+
+    def test_partial_failure(self):
+        self.put_objects('result/old', 2500)
+
+        # Report one key of every batch as not deleted
+        def fail_one_key(parsed, **kwargs):
+            parsed['Errors'] = [{'Key': 'result/old/denied', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+        self.register('after-call.s3.DeleteObjects', fail_one_key)
+
+        result = push_output.S3Client().delete_objects_with_prefix('result/old')
+
+        self.assertEqual(result['deleted'], 2497)
+        self.assertEqual(len(result['errors']), 3)
+        self.assertTrue(all(x['Code'] == 'AccessDenied' for x in result['errors']))
+
+    def test_empty_prefix(self):
+        self.assertEqual(push_output.S3Client().delete_objects_with_prefix('result/missing'), {'deleted': 0, 'errors': []})
+
+class ArchiveTestCase(S3TestCase):
+    def setUp(self):
+        super().setUp()
+        # The smallest part size S3 accepts, so a multipart member doesn't need a large archive
+        self.part_size = push_output.MULTIPART_PART_SIZE
+        push_output.MULTIPART_PART_SIZE = 5 * push_output.MB
+
+    def tearDown(self):
+        push_output.MULTIPART_PART_SIZE = self.part_size
+        super().tearDown()
+
+    def make_archive(self, files):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar_file:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar_file.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    def get_object(self, key):
+        return self.s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+
+class TestUnzipTarfile(ArchiveTestCase):
+    def test_multipart_member(self):
+        large = os.urandom(12 * push_output.MB)
+        self.s3.put_object(Bucket=BUCKET_NAME, Key='job/output.tar.gz', Body=self.make_archive({'large.bin': large, 'small.txt': b'small'}))
+
+        parts = []
+        self.register('provide-client-params.s3.UploadPart', lambda params, **kwargs: parts.append(params['PartNumber']))
+
+        success, files = push_output.S3Client().unzip_tarfile('job/output.tar.gz', 'result/runs/job')
+
+        self.assertTrue(success)
+        self.assertEqual(sorted(parts), [1, 2, 3])
+        self.assertEqual(files['large.bin']['size'], len(large))
+        self.assertEqual(self.get_object('result/runs/job/large.bin'), large)
+        self.assertEqual(self.get_object('result/runs/job/small.txt'), b'small')
+
+    def test_truncated_archive(self):
+        large = os.urandom(12 * push_output.MB)
+        archive = self.make_archive({'small.txt': b'small', 'large.bin': large})
+        # Cut the archive in the second part of the large member
+        self.s3.put_object(Bucket=BUCKET_NAME, Key='job/output.tar.gz', Body=archive[:len(archive) // 2])
+
+        success, files = push_output.S3Client().unzip_tarfile('job/output.tar.gz', 'result/runs/job')
+
+        self.assertFalse(success)
+        self.assertIsNone(files['large.bin'])
+        # The multipart upload was aborted, so neither a partial object nor its parts are left
+        self.assertEqual(self.count_objects('result/runs/job/large.bin'), 0)
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=BUCKET_NAME).get('Uploads', []), [])
+
+class TestPublish(ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.large = os.urandom(12 * push_output.MB)
+
+    def publish(self, run_id, files):
+        self.s3.put_object(Bucket=BUCKET_NAME, Key=f'{run_id}/output/output.tar.gz', Body=self.make_archive(files))
+        return push_output.lambda_handler({'PreviousStep': {
+            'TrainingJobName': run_id,
+            'ModelArtifacts': {'S3ModelArtifacts': f's3://{BUCKET_NAME}/{run_id}/output/model.tar.gz'}
+        }}, None)
+
+    def get_manifest(self):
+        return json.loads(self.get_object(push_output.MANIFEST_KEY))
+
+    def test_unchanged_files_are_not_uploaded(self):
+        self.publish('job-1', {'a.txt': b'a1', 'b.txt': b'b', 'large.bin': self.large})
+
+        uploads = []
+        self.register('provide-client-params.s3.PutObject', lambda params, **kwargs: uploads.append(params['Key']))
+        self.register('provide-client-params.s3.CreateMultipartUpload', lambda params, **kwargs: uploads.append(params['Key']))
+        result = self.publish('job-2', {'a.txt': b'a2', 'b.txt': b'b', 'large.bin': self.large})
+
+        self.assertEqual((result['files_uploaded'], result['files_unchanged']), (1, 2))
+        self.assertEqual(sorted(uploads), ['result/manifest.json', 'result/runs/job-2/a.txt', 'result/runs/job-2/manifest.json'])
+        manifest = self.get_manifest()
+        self.assertEqual((manifest['run_id'], manifest['previous_run_id']), ('job-2', 'job-1'))
+        self.assertEqual({x: info['key'] for x, info in manifest['files'].items()}, {
+            'a.txt': 'result/runs/job-2/a.txt',
+            'b.txt': 'result/runs/job-1/b.txt',
+            'large.bin': 'result/runs/job-1/large.bin'
+        })
+        self.assertEqual(self.get_object(manifest['files']['a.txt']['key']), b'a2')
+
+    def test_changed_large_file_of_the_same_size(self):
+        self.publish('job-1', {'large.bin': self.large})
+        changed = self.large[:-1] + b'x'
+        result = self.publish('job-2', {'large.bin': changed})
+
+        self.assertEqual(result['files_uploaded'], 1)
+        self.assertEqual(self.get_object(self.get_manifest()['files']['large.bin']['key']), changed)
+
+    def test_manifest_is_not_updated_when_a_member_fails(self):
+        self.publish('job-1', {'a.txt': b'a1', 'b.txt': b'b1'})
+
+        def fail(params, **kwargs):
+            if params['Key'] == 'result/runs/job-2/b.txt':
+                raise IOError('Simulated failure')
+        self.register('provide-client-params.s3.PutObject', fail)
+        result = self.publish('job-2', {'a.txt': b'a2', 'b.txt': b'b2'})
+
+        self.assertFalse(result['extraction_successful'])
+        self.assertIsNone(result['manifest_key'])
+        self.assertEqual(self.get_manifest()['run_id'], 'job-1')
+        self.assertEqual(self.count_objects('result/runs/job-2/manifest.json'), 0)
+        self.assertEqual(self.count_objects('result/runs/job-2/error.txt'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# Tests for run_index.py and for recording succeeded runs in record_run.py, with the state store
+# replaced by its in-memory stand-in and SageMaker by a botocore stub.
+#
+# Usage:
+#   python -m unittest test_run_index
+
+import os
+import sys
+import copy
+import unittest
+
+from botocore.stub import Stubber
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import aws_clients
+import record_run
+from run_index import RunIndex, compute_fingerprint
+from state_store import InMemoryStateStore
+
+S3_INFO = {'bucket_name': 'data', 'key': 'iris.csv', 'version': 'v1'}
+ECR_INFO = {'repository_name': 'master', 'image_tags': ['abc123'], 'image_digest': 'sha256:1234'}
+SETTINGS = {'TrainingJob': {'HyperParameters': {'max_leaf_nodes': '4'}}}
+
+class TestFingerprint(unittest.TestCase):
+    def test_same_inputs(self):
+        # Another tag for the same image is the same run
+        retagged = dict(ECR_INFO, image_tags=['def456'], image_uri='uri:def456')
+        self.assertEqual(compute_fingerprint(S3_INFO, ECR_INFO, SETTINGS), compute_fingerprint(S3_INFO, retagged, copy.deepcopy(SETTINGS)))
+
+    def test_changed_inputs(self):
+        fingerprint = compute_fingerprint(S3_INFO, ECR_INFO, SETTINGS)
+        settings = {'TrainingJob': {'HyperParameters': {'max_leaf_nodes': '8'}}}
+        self.assertNotEqual(fingerprint, compute_fingerprint(dict(S3_INFO, version='v2'), ECR_INFO, SETTINGS))
+        self.assertNotEqual(fingerprint, compute_fingerprint(S3_INFO, dict(ECR_INFO, image_digest='sha256:5678'), SETTINGS))
+        self.assertNotEqual(fingerprint, compute_fingerprint(S3_INFO, dict(ECR_INFO, repository_name='staging'), SETTINGS))
+        self.assertNotEqual(fingerprint, compute_fingerprint(S3_INFO, ECR_INFO, settings))
+
+    def test_unknown_digest(self):
+        ecr_info = dict(ECR_INFO)
+        del ecr_info['image_digest']
+        self.assertIsNone(compute_fingerprint(S3_INFO, ecr_info, SETTINGS))
+
+class TestRecordRun(unittest.TestCase):
+    def setUp(self):
+        self.state_store = InMemoryStateStore()
+        self.run_index = RunIndex(self.state_store)
+        self.original_run_index = record_run.run_index
+        record_run.run_index = self.run_index
+        self.stubber = Stubber(aws_clients.client('sagemaker'))
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+        record_run.run_index = self.original_run_index
+
+    def record(self):
+        self.stubber.add_response('describe_training_job', {
+            'TrainingJobName': 'job',
+            'TrainingJobArn': 'arn:aws:sagemaker:us-east-1:123456789012:training-job/job',
+            'TrainingJobStatus': 'Completed',
+            'SecondaryStatus': 'Completed',
+            'ModelArtifacts': {'S3ModelArtifacts': 's3://output/job/output/model.tar.gz'},
+            'FinalMetricDataList': [{'MetricName': 'Scoring-Metric', 'Value': 90.0}],
+            'AlgorithmSpecification': {'TrainingInputMode': 'File'},
+            'ResourceConfig': {'InstanceType': 'ml.m5.large', 'InstanceCount': 1, 'VolumeSizeInGB': 1},
+            'StoppingCondition': {},
+            'CreationTime': 0
+        }, {'TrainingJobName': 'job'})
+        fingerprint = compute_fingerprint(S3_INFO, ECR_INFO, SETTINGS)
+        record_run.lambda_handler({'training_job_name': 'job', 'input': {'fingerprint': fingerprint}}, None)
+        return fingerprint
+
+    def test_succeeded_run_is_recorded(self):
+        run = self.run_index.get_completed_run(self.record())
+        self.assertEqual(run['training_job_name'], 'job')
+        self.assertEqual(run['metrics'], {'Scoring-Metric': 90.0})
+
+    def test_no_fingerprint(self):
+        self.assertEqual(record_run.lambda_handler({'training_job_name': 'job', 'input': {'fingerprint': None}}, None), {'Recorded': False})
+
+if __name__ == '__main__':
+    unittest.main()
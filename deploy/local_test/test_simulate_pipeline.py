@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+# Tests for simulate_pipeline.py: reading the templates, the state machine interpreter, and runs of
+# the batch-job pipeline (in a separate process, because it imports the Lambda functions with the
+# environment of the template). Every run trains a model, so they take a few seconds each.
+#
+# Usage:
+#   python -m unittest test_simulate_pipeline
+
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+import multiprocessing
+
+import simulate_pipeline
+from simulate_pipeline import Template, Execution, StatesError, get_path, set_path, matches, mock_aws
+
+class TestTemplate(unittest.TestCase):
+    def test_state_machines(self):
+        for pipeline in simulate_pipeline.PIPELINES:
+            template = Template(pipeline)
+            definition, functions = template.get_state_machine()
+            self.assertEqual(definition['StartAt'], 'Try')
+            self.assertIn('CreateTrainingJobLambda', functions)
+            # Every Lambda function of the state machine has a handler in deploy/lambda
+            for logical_id in functions:
+                module = template.get_function(logical_id)['handler'].split('.')[0]
+                self.assertTrue(os.path.exists(os.path.join(simulate_pipeline.LAMBDA_DIR, module + '.py')), module)
+            # The variables of the definition are replaced
+            branch = definition['States']['Try']['Branches'][0]['States']
+            self.assertEqual(branch['Is Feature Branch']['Choices'][0]['StringEquals'], simulate_pipeline.RESOURCES['StagingEcrRepository'])
+            self.assertTrue(branch['Create Training Job Parameters']['Resource'].endswith(':function:CreateTrainingJobLambda'))
+
+    def test_function_environment(self):
+        template = Template('model-server')
+        function = template.get_function('CheckEndpointStatusLambda')
+        self.assertEqual(function['handler'], 'check_endpoint_status.lambda_handler')
+        self.assertEqual(function['timeout'], 3)
+        self.assertEqual(function['environment'], {'ENDPOINT_NAME': 'local-demo-pipeline', 'ENDPOINT_STATUS_LONG_WAIT_SECONDS': '0'})
+        self.assertEqual(Template('batch-job').get_function('PushOutputLambda')['environment']['OUTPUT_BUCKET_NAME'], simulate_pipeline.RESOURCES['OutputBucket'])
+
+class FakeFunction:
+    def __init__(self, function):
+        self.function = function
+
+    def invoke(self, event):
+        return self.function(event)
+
+def fail(event):
+    raise StatesError('ValueError', 'no')
+
+DEFINITION = {
+    'StartAt': 'Try',
+    'States': {
+        'Try': {
+            'Type': 'Parallel',
+            'Branches': [{
+                'StartAt': 'Score',
+                'States': {
+                    'Score': {'Type': 'Task', 'Resource': 'arn:aws:lambda:score', 'Parameters': {'name.$': '$$.Execution.Name', 'value.$': '$.value'}, 'ResultPath': '$.PreviousStep', 'Next': 'Check'},
+                    'Check': {'Type': 'Choice', 'Choices': [{
+                        'And': [{'Variable': '$.PreviousStep.Metrics.Scoring-Metric', 'IsPresent': True}, {'Variable': '$.PreviousStep.Metrics.Scoring-Metric', 'NumericGreaterThan': 50}],
+                        'Next': 'Wait'
+                    }], 'Default': 'Fail'},
+                    'Wait': {'Type': 'Wait', 'SecondsPath': '$.PreviousStep.WaitSeconds', 'Next': 'Success'},
+                    'Fail': {'Type': 'Fail'},
+                    'Success': {'Type': 'Pass', 'End': True}
+                }
+            }],
+            'Catch': [{'ErrorEquals': ['States.ALL'], 'ResultPath': '$.PreviousStep', 'Next': 'Failed'}],
+            'Next': 'Unwrap'
+        },
+        'Failed': {'Type': 'Fail', 'Error': 'Failed'},
+        'Unwrap': {'Type': 'Pass', 'InputPath': '$[0]', 'End': True}
+    }
+}
+
+class TestInterpreter(unittest.TestCase):
+    def run_execution(self, score):
+        execution = Execution(DEFINITION, {'arn:aws:lambda:score': FakeFunction(score)}, 'execution-1', max_wait_seconds=0)
+        return execution, execution.run({'value': 60})
+
+    def test_paths(self):
+        data = {'a': {'b-c': [1, {'d': 2}]}}
+        self.assertEqual(get_path(data, '$.a.b-c[1].d'), 2)
+        self.assertEqual(get_path(data, '$$.Execution.Name', {'Execution': {'Name': 'x'}}), 'x')
+        with self.assertRaises(StatesError):
+            get_path(data, '$.a.missing')
+        self.assertEqual(set_path(data, '$.a.e', 3)['a']['e'], 3)
+        self.assertNotIn('e', data['a'])
+        self.assertIs(set_path(data, None, 3), data)
+
+    def test_choice_rules(self):
+        data = {'x': 'a', 'n': 5, 'flag': True}
+        self.assertTrue(matches({'Or': [{'Variable': '$.x', 'StringEquals': 'b'}, {'Variable': '$.n', 'NumericGreaterThan': 4}]}, data))
+        self.assertFalse(matches({'Variable': '$.flag', 'BooleanEquals': False}, data))
+        self.assertTrue(matches({'Not': {'Variable': '$.missing', 'IsPresent': True}}, data))
+        with self.assertRaises(StatesError):
+            matches({'Variable': '$.missing', 'StringEquals': 'a'}, data)
+
+    def test_success(self):
+        execution, result = self.run_execution(lambda event: {'Metrics': {'Scoring-Metric': event['value']}, 'WaitSeconds': 30, 'Name': event['name']})
+        self.assertEqual(result['status'], 'SUCCEEDED')
+        self.assertEqual(result['output']['PreviousStep'], {'Metrics': {'Scoring-Metric': 60}, 'WaitSeconds': 30, 'Name': 'execution-1'})
+        self.assertEqual([(x['stage'], x['kind']) for x in execution.stages], [('Score', 'lambda'), ('Wait', 'wait')])
+        # The wait is cut to max_wait_seconds, and the requested wait is kept
+        self.assertEqual(execution.stages[1]['requested_seconds'], 30)
+        self.assertLess(execution.stages[1]['seconds'], 1)
+
+    def test_failed_choice_and_task(self):
+        # A low score goes to the Fail state of the branch, which is caught around the Parallel state
+        execution, result = self.run_execution(lambda event: {'Metrics': {'Scoring-Metric': 10}})
+        self.assertEqual((result['status'], result['error']), ('FAILED', 'Failed'))
+        self.assertEqual(execution.caught_errors[0]['state'], 'Try')
+
+        execution, result = self.run_execution(fail)
+        self.assertEqual(result['status'], 'FAILED')
+        self.assertEqual(execution.caught_errors, [{'state': 'Try', 'error': 'ValueError', 'cause': 'no'}])
+
+    def test_canary_rollback_waits_for_the_endpoint(self):
+        definition, _ = Template('model-server').get_state_machine()
+        branch = dict(definition['States']['Try']['Branches'][0], StartAt='Evaluate Canary')
+        statuses = ['Updating', 'Updating', 'InService']
+        functions = {
+            branch['States']['Evaluate Canary']['Resource']: FakeFunction(lambda event: dict(event['canary'], Decision='Rollback')),
+            branch['States']['Get Rollback Endpoint Status']['Resource']: FakeFunction(lambda event: {'EndpointStatus': statuses.pop(0), 'WaitSeconds': 30})
+        }
+        with mock_aws():
+            try:
+                simulate_pipeline.aws_clients.client('sns').create_topic(Name=simulate_pipeline.RESOURCES['PipelineStatusSnsTopic'].split(':')[-1])
+                execution = Execution(branch, functions, 'execution-1', max_wait_seconds=0)
+                # The canary is rolled back after its evaluation
+                result = execution.run({'Canary': {}, 'ecr': {'image_tags': ['abc']}, 's3': {'version': '1'}})
+            finally:
+                simulate_pipeline.aws_clients.reset()
+
+        # The execution fails once the endpoint is back in service
+        self.assertEqual(result['status'], 'FAILED')
+        self.assertEqual([x['stage'] for x in execution.stages], [
+            'Evaluate Canary', 'Roll Back Canary', 'Get Rollback Endpoint Status', 'Wait For Rollback',
+            'Get Rollback Endpoint Status', 'Wait For Rollback', 'Get Rollback Endpoint Status', 'NotifyError'
+        ])
+        self.assertEqual(statuses, [])
+
+class TestSimulation(unittest.TestCase):
+    def test_batch_job(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'timings.json')
+            process = subprocess.run(
+                [sys.executable, 'simulate_pipeline.py', '--pipeline', 'batch-job', '--max-wait', '0', '--json', path],
+                cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+            )
+            self.assertEqual(process.returncode, 0, process.stdout)
+            with open(path) as f:
+                run = json.load(f)['runs'][0]
+        self.assertEqual(run['status'], 'SUCCEEDED')
+        self.assertEqual(
+            [x['stage'] for x in run['stages']],
+            ['initiate_step_functions', 'Create Training Job Parameters', 'Execute Training Job', 'Get Training Job Metrics', 'Push Output Data', 'Record Run', 'NotifySuccess']
+        )
+        self.assertGreater(run['metrics']['Scoring-Metric'], 50)
+        self.assertEqual([x['step'] for x in run['steps']], ['download input', 'train (1 hosts)', 'upload artifacts'])
+
+    def run_retries(self, push_output):
+        context = multiprocessing.get_context('spawn')
+        queue = context.Queue()
+        process = context.Process(target=run_retries, args=(queue, push_output))
+        process.start()
+        statuses = queue.get(timeout=300)
+        process.join()
+        return statuses
+
+    def test_failed_execution_is_retried(self):
+        # The trigger is sent again after Push Output Data failed, and a third time after that succeeded
+        self.assertEqual(self.run_retries(fail), ['FAILED', 'SUCCEEDED', 'NOT_STARTED'])
+
+    def test_failed_extraction_is_not_recorded(self):
+        self.assertEqual(self.run_retries(fail_extraction), ['FAILED', 'SUCCEEDED', 'NOT_STARTED'])
+
+def fail_extraction(event):
+    return {'extraction_successful': False, 'manifest_key': None}
+
+def run_retries(queue, push_output_function):
+    """Send the same trigger three times, with Push Output Data replaced by push_output_function the first time (runs in a child process)"""
+    with tempfile.TemporaryDirectory() as directory, mock_aws():
+        simulator = simulate_pipeline.PipelineSimulator('batch-job', directory, max_wait_seconds=0)
+        try:
+            simulator.push_image()
+            event = simulator.make_event('data')
+            push_output = Template('batch-job').evaluate('!GetAtt PushOutputLambda.Arn')
+            original, simulator.functions[push_output] = simulator.functions[push_output], FakeFunction(push_output_function)
+            statuses = [simulator.run(event=event)['status']]
+            simulator.functions[push_output] = original
+            statuses += [simulator.run(event=event)['status'] for _ in range(2)]
+        finally:
+            simulator.close()
+            simulate_pipeline.aws_clients.reset()
+    queue.put(statuses)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Tests for state_store.py. The DynamoDB store runs against moto's in-process stand-in, and both
+# stores have to behave the same.
+#
+# Usage:
+#   python -m unittest test_state_store
+
+import os
+import sys
+import unittest
+
+import boto3
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from state_store import DynamoDbStateStore, InMemoryStateStore
+
+class StateStoreTests:
+    def test_missing_item(self):
+        self.assertEqual(self.state_store.get_item('missing'), (None, None))
+
+    def test_conditional_writes(self):
+        self.assertEqual(self.state_store.put_item('key', {'value': 1}), 1)
+        # Only the first writer can create an item
+        self.assertIsNone(self.state_store.put_item('key', {'value': 2}))
+        self.assertEqual(self.state_store.get_item('key'), ({'value': 1}, 1))
+
+        self.assertEqual(self.state_store.put_item('key', {'value': 3}, expected_version=1), 2)
+        # A writer with an old version loses
+        self.assertIsNone(self.state_store.put_item('key', {'value': 4}, expected_version=1))
+        self.assertEqual(self.state_store.get_item('key'), ({'value': 3}, 2))
+
+class TestInMemoryStateStore(StateStoreTests, unittest.TestCase):
+    def setUp(self):
+        self.state_store = InMemoryStateStore()
+
+    def test_expired_item(self):
+        # DynamoDB removes expired items in the background, the in-memory store does it right away
+        self.state_store.put_item('key', {'value': 1}, ttl_seconds=-1)
+        self.assertEqual(self.state_store.get_item('key'), (None, None))
+        self.assertEqual(self.state_store.put_item('key', {'value': 2}), 1)
+
+class TestDynamoDbStateStore(StateStoreTests, unittest.TestCase):
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        client = boto3.client('dynamodb')
+        client.create_table(
+            TableName='state',
+            KeySchema=[{'AttributeName': 'key', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'key', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        self.state_store = DynamoDbStateStore('state', client)
+
+    def tearDown(self):
+        self.mock.stop()
+
+if __name__ == '__main__':
+    unittest.main()
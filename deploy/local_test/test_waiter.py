@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Tests for waiter.py and the status checks that use it, with SageMaker replaced by a botocore stub
+# and the sleeps replaced by a fake clock.
+#
+# Usage:
+#   python -m unittest test_waiter
+
+import os
+import sys
+import random
+import unittest
+from unittest import mock
+
+from botocore.stub import Stubber
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('ENDPOINT_NAME', 'endpoint')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import waiter
+import aws_clients
+import check_endpoint_status
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeContext:
+    def __init__(self, clock, timeout_seconds):
+        self.__clock = clock
+        self.__deadline = clock.now + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return (self.__deadline - self.__clock.now) * 1000
+
+class WaiterTestCase(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.clock = FakeClock()
+        patcher = mock.patch.multiple(waiter.time, time=self.clock.time, sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class TestNextWaitSeconds(unittest.TestCase):
+    def test_waits_shrink_towards_the_expected_end(self):
+        for _ in range(100):
+            self.assertTrue(60 <= waiter.next_wait_seconds(420, 0, 0) <= 120)
+            self.assertTrue(50 <= waiter.next_wait_seconds(420, 220, 0) <= 100)
+            self.assertTrue(2 <= waiter.next_wait_seconds(420, 415, 0) <= 5)
+
+    def test_backoff_when_overdue(self):
+        for _ in range(100):
+            self.assertTrue(2 <= waiter.next_wait_seconds(420, 600, 0) <= 5)
+            self.assertTrue(5 <= waiter.next_wait_seconds(420, 600, 2) <= 11)
+            self.assertTrue(15 <= waiter.next_wait_seconds(420, 900, 10) <= 30)
+
+class TestCheckEndpointStatus(WaiterTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stubber = Stubber(aws_clients.client('sagemaker'))
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+
+    def add_status(self, status):
+        self.stubber.add_response('describe_endpoint', {
+            'EndpointName': 'endpoint',
+            'EndpointArn': 'arn:aws:sagemaker:us-east-1:123456789012:endpoint/endpoint',
+            'EndpointConfigName': 'config',
+            'EndpointStatus': status,
+            'CreationTime': 0,
+            'LastModifiedTime': 0
+        }, {'EndpointName': 'endpoint'})
+
+    def test_state_machine_loop(self):
+        # Creating takes 400 seconds, like a Step Functions loop of check -> wait -> check
+        event = {'PreviousStep': {'EndpointName': 'endpoint'}}
+        checks = 0
+        while True:
+            self.add_status('InService' if self.clock.now >= 1400 else 'Creating')
+            output = check_endpoint_status.lambda_handler(event, FakeContext(self.clock, 3))
+            checks += 1
+            if output['WaitSeconds'] == 0:
+                break
+            event = {'PreviousStep': output}
+            self.clock.now += output['WaitSeconds']
+
+        self.assertEqual(output['EndpointStatus'], 'InService')
+        # The fixed 30 second loop needs 14 checks and finishes 20 seconds late
+        self.assertLess(checks, 14)
+        self.assertLess(self.clock.now - 1400, 10)
+        self.stubber.assert_no_pending_responses()
+
+    def test_long_wait(self):
+        for status in ['Updating', 'Updating', 'InService']:
+            self.add_status(status)
+        with mock.patch.object(check_endpoint_status, 'ENDPOINT_STATUS_LONG_WAIT_SECONDS', 900):
+            output = check_endpoint_status.lambda_handler({'PreviousStep': {}}, FakeContext(self.clock, 900))
+
+        self.assertEqual(output['EndpointStatus'], 'InService')
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.stubber.assert_no_pending_responses()
+
+    def test_long_wait_stops_before_the_lambda_timeout(self):
+        self.add_status('Creating')
+        with mock.patch.object(check_endpoint_status, 'ENDPOINT_STATUS_LONG_WAIT_SECONDS', 900):
+            output = check_endpoint_status.lambda_handler({'PreviousStep': {}}, FakeContext(self.clock, 20))
+
+        self.assertEqual(output['EndpointStatus'], 'Creating')
+        self.assertGreater(output['WaitSeconds'], 0)
+        self.assertEqual(self.clock.sleeps, [])
+        self.stubber.assert_no_pending_responses()
+
+if __name__ == '__main__':
+    unittest.main()